@@ -0,0 +1,156 @@
+############################################################
+#
+# Author(s):       Georg Schnabel
+# Email:           g.schnabel@iaea.org
+# Creation date:   2023/03/27
+# Last modified:   2023/03/27
+# License:         MIT
+# Copyright (c) 2023 International Atomic Energy Agency (IAEA)
+#
+############################################################
+
+import re
+import gzip
+import bz2
+import lzma
+import zlib
+from bisect import bisect_right
+from .section_index_utils import build_section_index
+
+
+# a bz2 stream starts with the block size and the magic number
+# of the first block or of the end of stream if it is empty,
+# so that a plain file starting with BZh is not mistaken for it
+compression_magic_patterns = {
+    'gzip': re.compile(b'\x1f\x8b'),
+    'bz2': re.compile(b'BZh[1-9](1AY&SY|\x17rE8P\x90)'),
+    'xz': re.compile(b'\xfd7zXZ\x00')
+}
+
+compression_extensions = {
+    '.gz': 'gzip',
+    '.bz2': 'bz2',
+    '.xz': 'xz'
+}
+
+compression_open_funs = {
+    'gzip': gzip.open,
+    'bz2': bz2.open,
+    'xz': lzma.open
+}
+
+
+def get_compression(filename, mode='r'):
+    # the compression of an existing file is determined by
+    # its first bytes and of a new file by its extension
+    if mode == 'r':
+        with open(filename, 'rb') as fin:
+            head = fin.read(10)
+        for compression, magic in compression_magic_patterns.items():
+            if magic.match(head):
+                return compression
+        return None
+    for ext, compression in compression_extensions.items():
+        if str(filename).endswith(ext):
+            return compression
+    return None
+
+
+def open_endf_file(filename, mode='r'):
+    # opens plain and compressed ENDF files in text mode
+    compression = get_compression(filename, mode)
+    if compression is None:
+        return open(filename, mode)
+    return compression_open_funs[compression](filename, mode + 't')
+
+
+def read_decompressed_buffer(filename):
+    compression = get_compression(filename)
+    open_fun = compression_open_funs.get(compression, open)
+    with open_fun(filename, 'rb') as fin:
+        return fin.read()
+
+
+# A gzip checkpoint buffer gives access to ranges of the decompressed
+# content of a gzip file without decompressing the whole file.
+# While the section index is built in a single pass over the file,
+# copies of the state of the decompressor are stored at regular
+# intervals. A range is then decompressed starting from the
+# closest preceding checkpoint.
+gzip_checkpoint_interval = 4*1024*1024
+gzip_chunk_size = 65536
+
+
+class GzipCheckpointBuffer():
+
+    def __init__(self, filename, **read_opts):
+        self.filename = filename
+        self.checkpoints = []
+        self.index = {}
+        self.size = 0
+        self.build_index(**read_opts)
+
+    def __len__(self):
+        return self.size
+
+    def new_decompressor(self):
+        # wbits=16+MAX_WBITS lets zlib process the gzip header
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def iter_chunks(self, fin, dec, cofs):
+        # yields the compressed offset after each chunk, the decompressor
+        # and the decompressed data. Files with several gzip members,
+        # e.g., produced by concatenation, are supported.
+        fin.seek(cofs)
+        while True:
+            chunk = fin.read(gzip_chunk_size)
+            if not chunk:
+                break
+            cofs += len(chunk)
+            while chunk:
+                data = dec.decompress(chunk)
+                chunk = b''
+                if dec.eof:
+                    chunk = dec.unused_data
+                    dec = self.new_decompressor()
+                yield cofs - len(chunk), dec, data
+
+    def build_index(self, **read_opts):
+        dec = self.new_decompressor()
+        self.checkpoints = [(0, 0, dec.copy())]
+        # incomplete last line of the previous chunk
+        rest = b''
+        uofs = 0
+        with open(self.filename, 'rb') as fin:
+            for cofs, dec, data in self.iter_chunks(fin, dec, 0):
+                uofs += len(data)
+                if uofs - self.checkpoints[-1][1] >= gzip_checkpoint_interval:
+                    self.checkpoints.append((cofs, uofs, dec.copy()))
+                data = rest + data
+                cut = data.rfind(b'\n') + 1
+                rest = data[cut:]
+                build_section_index(data[:cut], self.index, uofs - len(data),
+                                    **read_opts)
+        build_section_index(rest, self.index, uofs - len(rest), **read_opts)
+        self.size = uofs
+
+    def read(self, start, stop):
+        pos = bisect_right([c[1] for c in self.checkpoints], start) - 1
+        cofs, uofs, dec = self.checkpoints[pos]
+        parts = []
+        with open(self.filename, 'rb') as fin:
+            for _, dec, data in self.iter_chunks(fin, dec.copy(), cofs):
+                if uofs + len(data) > start:
+                    parts.append(data[max(0, start-uofs):stop-uofs])
+                uofs += len(data)
+                if uofs >= stop:
+                    break
+        return b''.join(parts)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step is not None:
+            raise TypeError('only slices without step are supported')
+        start, stop, _ = key.indices(self.size)
+        if start >= stop:
+            return b''
+        return self.read(start, stop)
@@ -0,0 +1,361 @@
+############################################################
+#
+# Author(s):       Georg Schnabel
+# Email:           g.schnabel@iaea.org
+# Creation date:   2023/04/07
+# Last modified:   2023/04/07
+# License:         MIT
+# Copyright (c) 2023 International Atomic Energy Agency (IAEA)
+#
+############################################################
+
+# The functions in this module assemble the covariance matrices
+# given in the NI-type sub-subsections of MF33, MF34 and MF35
+# as NumPy arrays. The contributions of all sub-subsections of a
+# block are added on the union of their energy grids. The matrices
+# are indexed by the intervals of the union grids, hence they have
+# one row and column less than there are energies.
+# Absolute (LB=0 and LB=7) and relative contributions (all others)
+# are summed up separately. NC-type sub-subsections are ignored
+# because they refer to the covariances of other reactions.
+
+from itertools import chain
+from .indexed_array_utils import IndexedArray
+# numpy is only needed if the functions of this module are used
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# the assembled blocks are cached, see get_cached_block
+covariance_cache = {}
+covariance_cache_size = 32
+
+
+def check_numpy():
+    if numpy is None:
+        raise ImportError('the package numpy is required '
+                          'to assemble covariance matrices')
+
+
+def to_float_array(dic):
+    # the values of an indexed variable in the order of the indices
+    if isinstance(dic, IndexedArray) and dic.is_dense():
+        return numpy.array(dic.get_typed_array(), dtype=numpy.float64)
+    return numpy.fromiter(dic.values(), dtype=numpy.float64, count=len(dic))
+
+
+def to_nested_float_array(dic):
+    # the values of a variable with two indices, e.g., F[k,kp],
+    # flattened in the order of the indices
+    if any(isinstance(row, IndexedArray) for row in dic.values()):
+        return numpy.concatenate([to_float_array(row)
+                                  for row in dic.values()])
+    return numpy.fromiter(chain.from_iterable(row.values()
+                                              for row in dic.values()),
+                          dtype=numpy.float64)
+
+
+def pack_symmetric(mat):
+    # the upper triangle row by row, i.e., in the
+    # same order as in a LIST record with LB=5 and LS=1
+    return mat[numpy.triu_indices(mat.shape[0])]
+
+
+def unpack_symmetric(vals, n):
+    mat = numpy.zeros((n, n))
+    rowidx, colidx = numpy.triu_indices(n)
+    mat[rowidx, colidx] = vals
+    mat[colidx, rowidx] = vals
+    return mat
+
+
+def get_list_component(LB, L1, NT, NE, vals):
+    # interprets the values of a LIST record of an NI-type
+    # sub-subsection. L1 is LT for LB=0-4 and LS for LB=5.
+    vals = numpy.asarray(vals, dtype=numpy.float64)
+    if LB in (0, 1, 2, 3, 4, 8, 9):
+        LT = L1 if LB <= 4 else 0
+        pairs = vals[:2*NE].reshape(NE, 2)
+        comp = {'LB': LB, 'Ek': pairs[:NE-LT, 0], 'Fk': pairs[:NE-LT, 1],
+                'El': None, 'Fl': None}
+        if LT > 0:
+            comp['El'] = pairs[NE-LT:, 0]
+            comp['Fl'] = pairs[NE-LT:, 1]
+        return comp
+    elif LB in (5, 7):
+        E = vals[:NE]
+        if LB == 7 or L1 == 1:
+            F = unpack_symmetric(vals[NE:], NE-1)
+        else:
+            F = vals[NE:NE+(NE-1)**2].reshape(NE-1, NE-1)
+        return {'LB': LB, 'ER': E, 'EC': E, 'F': F}
+    elif LB == 6:
+        NER = NE
+        NEC = (NT-1) // NER
+        ER = vals[:NER]
+        EC = vals[NER:NER+NEC]
+        F = vals[NER+NEC:NER+NEC+(NER-1)*(NEC-1)].reshape(NER-1, NEC-1)
+        return {'LB': LB, 'ER': ER, 'EC': EC, 'F': F}
+    raise ValueError(f'covariance representation LB={LB} not supported')
+
+
+def get_mf33_component(ni_dic):
+    # takes the arrays from the variables of an NI-type
+    # sub-subsection parsed according to the MF33 recipe
+    LB = ni_dic['LB']
+    if LB in (0, 1, 2, 3, 4):
+        comp = {'LB': LB, 'Ek': to_float_array(ni_dic['Ek']),
+                'Fk': to_float_array(ni_dic['Fk']), 'El': None, 'Fl': None}
+        if ni_dic['LT'] > 0:
+            comp['El'] = to_float_array(ni_dic['El'])
+            comp['Fl'] = to_float_array(ni_dic['Fl'])
+        return comp
+    elif LB in (8, 9):
+        return {'LB': LB, 'Ek': to_float_array(ni_dic['E']),
+                'Fk': to_float_array(ni_dic['F']), 'El': None, 'Fl': None}
+    elif LB in (5, 7):
+        E = to_float_array(ni_dic['E'])
+        F = to_nested_float_array(ni_dic['F'])
+        if LB == 7 or ni_dic['LS'] == 1:
+            F = unpack_symmetric(F, len(E)-1)
+        else:
+            F = F.reshape(len(E)-1, len(E)-1)
+        return {'LB': LB, 'ER': E, 'EC': E, 'F': F}
+    elif LB == 6:
+        ER = to_float_array(ni_dic['ER'])
+        EC = to_float_array(ni_dic['EC'])
+        F = to_nested_float_array(ni_dic['F'])
+        return {'LB': LB, 'ER': ER, 'EC': EC,
+                'F': F.reshape(len(ER)-1, len(EC)-1)}
+    raise ValueError(f'covariance representation LB={LB} not supported')
+
+
+def get_component_grids(comp):
+    # the energy grids along the rows and columns
+    LB = comp['LB']
+    if LB in (5, 6, 7):
+        return [comp['ER']], [comp['EC']]
+    elif LB in (3, 4) and comp['El'] is None:
+        # LB=3 and LB=4 without El values (LT=0) contribute nothing
+        return [comp['Ek']], [comp['Ek']]
+    elif LB == 3:
+        return [comp['Ek']], [comp['El']]
+    elif LB == 4:
+        return [comp['Ek'], comp['El']], [comp['Ek'], comp['El']]
+    return [comp['Ek']], [comp['Ek']]
+
+
+def get_interval_indices(grid, union):
+    # the index of the interval of grid containing each interval
+    # of the union grid. Intervals outside of grid are mapped to
+    # len(grid)-1, which is the index of the zero appended by pad.
+    idcs = numpy.searchsorted(grid, union[:-1], side='right') - 1
+    idcs[(idcs < 0) | (idcs >= len(grid)-1)] = len(grid)-1
+    return idcs
+
+
+def pad(F, n):
+    # the values of the n-1 intervals followed by a zero.
+    # The last value of a LIST with LB=0-4, 8, 9 belongs
+    # to no interval and is replaced by the zero.
+    return numpy.append(F[:n-1], 0.)
+
+
+def add_component(mat, comp, rows, cols):
+    LB = comp['LB']
+    if LB in (5, 6, 7):
+        ER = comp['ER']
+        EC = comp['EC']
+        F = numpy.zeros((len(ER), len(EC)))
+        F[:len(ER)-1, :len(EC)-1] = comp['F']
+        kr = get_interval_indices(ER, rows)
+        kc = get_interval_indices(EC, cols)
+        mat += F[numpy.ix_(kr, kc)]
+        return
+    if LB in (3, 4) and comp['El'] is None:
+        return
+    Ek = comp['Ek']
+    Fk = pad(comp['Fk'], len(Ek))
+    kr = get_interval_indices(Ek, rows)
+    kc = get_interval_indices(Ek, cols)
+    if LB in (0, 1):
+        # correlated only within each interval
+        mat += numpy.where(kr[:, None] == kc[None, :], Fk[kr][:, None], 0.)
+    elif LB == 2:
+        mat += numpy.outer(Fk[kr], Fk[kc])
+    elif LB == 3:
+        El = comp['El']
+        Fl = pad(comp['Fl'], len(El))
+        mat += numpy.outer(Fk[kr], Fl[get_interval_indices(El, cols)])
+    elif LB == 4:
+        # correlated over the El intervals within each Ek interval
+        El = comp['El']
+        Fl = pad(comp['Fl'], len(El))
+        lr = get_interval_indices(El, rows)
+        lc = get_interval_indices(El, cols)
+        mat += (numpy.where(kr[:, None] == kc[None, :], Fk[kr][:, None], 0.) *
+                numpy.outer(Fl[lr], Fl[lc]))
+    elif LB in (8, 9):
+        # contributions to the variances of the union intervals, which
+        # are scaled by the width of the Ek interval over the
+        # width of the union interval
+        same = ((rows[:-1, None] == cols[None, :-1]) &
+                (rows[1:, None] == cols[None, 1:]))
+        widths = numpy.append(numpy.diff(Ek), 0.)
+        ratio = widths[kr] / numpy.diff(rows)
+        mat += numpy.where(same, (Fk[kr] * ratio)[:, None], 0.)
+
+
+def is_absolute(comp, mf):
+    return comp['LB'] == 0 or (mf == 35 and comp['LB'] == 7)
+
+
+def assemble_block(comps, mf):
+    rowgrids = []
+    colgrids = []
+    for comp in comps:
+        curgrids = get_component_grids(comp)
+        rowgrids.extend(curgrids[0])
+        colgrids.extend(curgrids[1])
+    rows = numpy.unique(numpy.concatenate(rowgrids))
+    cols = numpy.unique(numpy.concatenate(colgrids))
+    relmat = numpy.zeros((len(rows)-1, len(cols)-1))
+    absmat = numpy.zeros((len(rows)-1, len(cols)-1))
+    for comp in comps:
+        add_component(absmat if is_absolute(comp, mf) else relmat,
+                      comp, rows, cols)
+    return {'row_energies': rows, 'col_energies': cols,
+            'relative': relmat, 'absolute': absmat}
+
+
+def transpose_block(block):
+    return {'row_energies': block['col_energies'],
+            'col_energies': block['row_energies'],
+            'relative': block['relative'].T,
+            'absolute': block['absolute'].T}
+
+
+def pack_block(block):
+    if not numpy.array_equal(block['row_energies'], block['col_energies']):
+        raise ValueError('only blocks with the same energies along '
+                         'the rows and columns can be packed')
+    return {'row_energies': block['row_energies'],
+            'col_energies': block['col_energies'],
+            'relative': pack_symmetric(block['relative']),
+            'absolute': pack_symmetric(block['absolute'])}
+
+
+def get_cached_block(srcdic, key, assemble):
+    # the blocks are cached by the identity of the dictionary of
+    # the MF/MT section. If the section is modified afterwards,
+    # clear_covariance_cache must be called. The arrays are
+    # read-only so that the cached blocks cannot be changed.
+    check_numpy()
+    key = (id(srcdic),) + key
+    entry = covariance_cache.get(key, None)
+    if entry is not None and entry[0] is srcdic:
+        return entry[1]
+    block = assemble()
+    for arr in block.values():
+        arr.setflags(write=False)
+    covariance_cache[key] = (srcdic, block)
+    if len(covariance_cache) > covariance_cache_size:
+        del covariance_cache[next(iter(covariance_cache))]
+    return block
+
+
+def clear_covariance_cache():
+    covariance_cache.clear()
+
+
+def get_section(endf_dic, mf, mt):
+    section = endf_dic[mf][mt]
+    if not isinstance(section, dict):
+        raise TypeError(f'MF{mf}/MT{mt} has not been parsed')
+    return section
+
+
+def find_mf33_subsection(endf_dic, mt, mt1, mat1):
+    if mt not in endf_dic[33]:
+        return None
+    section = get_section(endf_dic, 33, mt)
+    # MTL != 0 indicates a lumped contribution without data
+    if section['MTL'] != 0:
+        return None
+    for subsec in section.get('subsection', {}).values():
+        if subsec['MT1'] == mt1 and subsec['MAT1'] == mat1:
+            return subsec
+    return None
+
+
+def get_mf33_covariance(endf_dic, mt, mt1, mat1=0, packed=False):
+    # the block of the covariance matrix between the reactions
+    # MT and MT1. If it is only stored in the section of MT1,
+    # the transposed block of MT1 and MT is returned.
+    subsec = find_mf33_subsection(endf_dic, mt, mt1, mat1)
+    if subsec is None:
+        if (mat1 == 0 and mt != mt1 and
+                find_mf33_subsection(endf_dic, mt1, mt, 0) is not None):
+            block = transpose_block(get_mf33_covariance(endf_dic, mt1, mt))
+            return pack_block(block) if packed else block
+        raise KeyError(f'no covariance data for MT={mt} and MT1={mt1}')
+    def assemble():
+        comps = [get_mf33_component(ni_dic) for ni_dic
+                 in subsec.get('ni_subsection', {}).values()]
+        if len(comps) == 0:
+            raise KeyError(f'no NI-type sub-subsections '
+                           f'for MT={mt} and MT1={mt1}')
+        return assemble_block(comps, 33)
+    section = endf_dic[33][mt]
+    key = ('mf33', mt1, mat1)
+    block = get_cached_block(section, key, assemble)
+    if packed:
+        return get_cached_block(section, key + ('packed',),
+                                lambda: pack_block(block))
+    return block
+
+
+def get_mf34_covariance(endf_dic, mt, mt1, l, l1, packed=False):
+    # the block of the covariance matrix between the Legendre
+    # coefficients of order L of reaction MT and order L1 of MT1
+    section = get_section(endf_dic, 34, mt)
+    for subsec in section['subsection'].values():
+        if subsec['MT1'] != mt1:
+            continue
+        for n, curl in subsec['L'].items():
+            if curl == l and subsec['L1'][n] == l1:
+                break
+        else:
+            continue
+        break
+    else:
+        raise KeyError(f'no covariance data for MT={mt}, MT1={mt1}, '
+                       f'L={l} and L1={l1}')
+    def assemble():
+        comps = [get_list_component(subsec['LB'][n][m], subsec['LS'][n][m],
+                                    subsec['NT'][n][m], subsec['NE'][n][m],
+                                    to_float_array(subsec['Data'][n][m]))
+                 for m in range(1, subsec['NI'][n]+1)]
+        return assemble_block(comps, 34)
+    key = ('mf34', mt1, l, l1)
+    block = get_cached_block(section, key, assemble)
+    if packed:
+        return get_cached_block(section, key + ('packed',),
+                                lambda: pack_block(block))
+    return block
+
+
+def get_mf35_covariance(endf_dic, mt, k, packed=False):
+    # the covariance matrix of the energy distribution of secondary
+    # particles for the k-th range of incident energies E1 to E2
+    section = get_section(endf_dic, 35, mt)
+    subsec = section['subsection'][k]
+    def assemble():
+        return assemble_block([get_mf33_component(subsec)], 35)
+    block = get_cached_block(section, ('mf35', k), assemble)
+    if packed:
+        return get_cached_block(section, ('mf35', k, 'packed'),
+                                lambda: pack_block(block))
+    return block
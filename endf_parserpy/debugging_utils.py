@@ -9,6 +9,7 @@
 #
 ############################################################
 
+from collections.abc import Mapping
 from .math_utils import math_allclose
 
 
@@ -41,12 +42,15 @@ def compare_objects(obj1, obj2, curpath='', atol=1e-8, rtol=1e-6,
             diff_log.append(msg)
             print(msg)
 
-    if type(obj1) != type(obj2):
+    # mappings are compared by their content irrespective of their
+    # type, e.g., LazyDict with sections only decoded on access
+    is_mapping = isinstance(obj1, Mapping) and isinstance(obj2, Mapping)
+    if type(obj1) != type(obj2) and not is_mapping:
         treat_diff(f'at path {curpath}: ' +
                    f'type mismatch found, obj1: {obj1}, obj2: {obj2}',
                    TypeError)
 
-    elif isinstance(obj1, dict):
+    elif isinstance(obj1, Mapping):
         only_in_obj1 = set(obj1).difference(obj2)
         if len(only_in_obj1) > 0:
             treat_diff(f'at path {curpath}: only obj1 contains {only_in_obj1}',
@@ -9,16 +9,16 @@
 #
 ############################################################
 
-from .logging_utils import logging, abbreviate_valstr, should_skip_logging_info
+from .logging_utils import (logging, abbreviate_valstr, should_skip_logging_info,
+        trace_handlers, trace_event)
 from .custom_exceptions import (
         NumberMismatchError,
         InconsistentVariableAssignmentError,
         InvalidIntegerError,
-        SeveralUnboundVariablesError,
     )
 from .endf_mapping_utils import (
-        get_varname, get_indexquants, eval_expr,
-        varvalue_expr_conversion, get_indexvalue
+        eval_expr, varvalue_expr_conversion, get_indexvalues,
+        get_expr_vars
     )
 from .tree_utils import (is_token, is_tree, get_name, search_name)
 from .math_utils import math_allclose
@@ -50,18 +50,16 @@ def map_recorddic_to_datadic(basekeys, record_dic, expr_list,
     ignore_zero_mismatch = parse_opts.get('ignore_zero_mismatch', True)
     ignore_number_mismatch = parse_opts.get('ignore_number_mismatch', True)
     ignore_varspec_mismatch = parse_opts.get('ignore_varspec_mismatch', True)
+    # NOTE: the expressions must be in an order so that each of them
+    #       contains at most one unknown variable at the time it
+    #       is evaluated, see get_resolution_order
     zipit = zip(basekeys, expr_list)
-    found_unbound = False
     varnames = []
     for sourcekey, curexpr in zipit:
-        try:
-            expr_vv = eval_expr(curexpr, datadic,
-                                loop_vars, look_up=False)
-        except SeveralUnboundVariablesError:
-            found_unbound = True
-            continue
-
-        targetkey = get_varname(expr_vv[2])
+        expr_vv = eval_expr(curexpr, datadic,
+                            loop_vars, look_up=False)
+        varref = expr_vv[2]
+        targetkey = varref[0] if varref is not None else None
         varnames.append(targetkey)
         # if the record specification contains a value,
         # hence targetkey is None, we check if the value
@@ -109,33 +107,64 @@ def map_recorddic_to_datadic(basekeys, record_dic, expr_list,
             except InvalidIntegerError as pexc:
                 raise InvalidIntegerError(str(pexc) + f' (variable {targetkey})')
 
-            idxquants = get_indexquants(expr_vv[2])
-            if idxquants is None:
+            idxspecs = varref[1]
+            if idxspecs is None:
                 datadic[targetkey] = val
             else:
                 # loop through indexvars, and initialize
                 # nested dictionaries with the indicies as keys
-                datadic.setdefault(targetkey, {})
-                curdic = datadic[targetkey]
-                for i, idxquant in enumerate(idxquants):
-                    idx = get_indexvalue(idxquant, loop_vars)
-                    if i < len(idxquants)-1:
-                        curdic.setdefault(idx, {})
-                        curdic = curdic[idx]
-                idx = get_indexvalue(idxquants[-1], loop_vars)
-                curdic[idx] = val
-
-    # we write out logging info the first time we encounter a variable
-    tmp = tuple(v for v in varnames if v is not None)
-    if not should_skip_logging_info(tmp, datadic):
-        varvals = tuple(abbreviate_valstr(datadic[v]) for v in tmp)
-        logging.info('Variable names in this record: ' + ', '.join([f'{v}: {vv}' for v, vv in zip(tmp, varvals)]))
-
-    if found_unbound:
-        raise SeveralUnboundVariablesError(
-                'Found several unbound variables in this line')
-    else:
-        return datadic
+                idcs = get_indexvalues(idxspecs, loop_vars)
+                curdic = datadic.setdefault(targetkey, {})
+                for idx in idcs[:-1]:
+                    curdic = curdic.setdefault(idx, {})
+                curdic[idcs[-1]] = val
+
+    # we trace the variables the first time we encounter them
+    if trace_handlers:
+        tmp = tuple(v for v in varnames if v is not None)
+        if not should_skip_logging_info(tmp, datadic):
+            trace_event('bind_variables',
+                        variables={v: abbreviate_valstr(datadic[v]) for v in tmp})
+    return datadic
+
+
+def get_resolution_order(expr_list, known_vars=()):
+    # determine the order in which the expressions of a record
+    # need to be evaluated so that the values of variables depending on
+    # other variables in the same record can be determined.
+    # known_vars contains the references (see get_varref) of the
+    # variables bound by the records preceding this one in the recipe
+    # on every path and of the loop variables.
+    # We mimic evaluating the expressions in several passes,
+    # like the parser did before the order was determined beforehand.
+    # In each pass, an expression is taken if it contains at most
+    # one variable not determined in the previous expressions
+    # and it can be solved for that variable. The first expression
+    # in the order containing a variable determines its value and
+    # the others are checked against it.
+    expr_vars = tuple(get_expr_vars(expr) for expr in expr_list)
+    bound_vars = set(known_vars)
+    order = []
+    remaining = tuple(range(len(expr_list)))
+    while len(remaining) > 0:
+        deferred = []
+        for i in remaining:
+            unbound = tuple(v for v in expr_vars[i] if v not in bound_vars)
+            if (len(unbound) == 0 or
+                    (len(unbound) == 1 and expr_vars[i][unbound[0]])):
+                order.append(i)
+                bound_vars.update(unbound)
+            else:
+                deferred.append(i)
+        if len(deferred) == len(remaining):
+            # the remaining expressions contain several variables
+            # that are not bound on every path leading to this record.
+            # They keep their source order and an error will be raised
+            # during the evaluation if the variables are indeed unknown.
+            order.extend(deferred)
+            break
+        remaining = tuple(deferred)
+    return tuple(order)
 
 
 def map_datadic_to_recorddic(basekeys, record_dic, expr_list,
@@ -152,22 +181,11 @@ def map_datadic_to_recorddic(basekeys, record_dic, expr_list,
 
 def map_record_helper(expr_list, basekeys, record_dic, datadic, loop_vars,
                       inverse, parse_opts=None):
-    # remove COMMA token because it is not relevant
-    expr_list = [expr for expr in expr_list
-                 if not is_token(expr) or get_name(expr) != 'COMMA']
-
+    # NOTE: expr_list must not contain COMMA tokens, they are
+    #       already removed during the compilation of the recipe
     if not inverse:
-        parse_tries = 3
-        while parse_tries > 0:
-            try:
-                return map_recorddic_to_datadic(
-                        basekeys, record_dic, expr_list,
-                        datadic, loop_vars, parse_opts)
-            except SeveralUnboundVariablesError:
-                parse_tries -= 1
-
-        raise SeveralUnboundVariablesError(
-                'Found several unbound variables')
+        return map_recorddic_to_datadic(basekeys, record_dic, expr_list,
+                                        datadic, loop_vars, parse_opts)
     else:
         return map_datadic_to_recorddic(basekeys, record_dic, expr_list,
                                         datadic, loop_vars, parse_opts)
@@ -11,7 +11,7 @@
 
 from .tree_utils import (is_tree, get_name, get_value, is_token,
         get_child, get_value)
-from .logging_utils import write_info
+from .logging_utils import trace_handlers, trace_event
 from .custom_exceptions import (
         VariableInDenominatorError,
         LoopVariableError,
@@ -25,32 +25,41 @@ from .math_utils import (math_add, math_sub,
         math_mul, math_div, math_neg)
 import re
 
+# The dictionaries of the enclosing sections are kept on a stack
+# in loop_vars['__scopes'] so that variables of the outer scopes
+# can be looked up without storing pointers in the dictionaries.
+
 def open_section(extvarname, datadic, loop_vars):
-    varname = get_varname(extvarname)
-    indexquants = get_indexquants(extvarname)
-    curdatadic = datadic
+    varname, idxspecs = get_varref(extvarname)
+    loop_vars['__scopes'].append(datadic)
     datadic.setdefault(varname, {})
     datadic = datadic[varname]
-    idcsstr_list = []
-    if indexquants is not None:
-        for idxquant in indexquants:
-            idx = get_indexvalue(idxquant, loop_vars)
-            idcsstr_list.append(str(idx))
+    idcs = ()
+    if idxspecs is not None:
+        idcs = get_indexvalues(idxspecs, loop_vars)
+        for idx in idcs:
             datadic.setdefault(idx, {})
             datadic = datadic[idx]
-    # provide a pointer so that functions
-    # can look for variable names in the outer scope
-    datadic['__up'] = curdatadic
-    write_info(f'Open section {varname}[' + ','.join(idcsstr_list) + ']')
+    if trace_handlers:
+        trace_event('open_section', name=varname, indices=idcs)
     return datadic
 
-def close_section(extvarname, datadic):
-    varname = get_varname(extvarname)
-    write_info(f'Close section {varname}')
-    curdatadic = datadic
-    datadic = datadic['__up']
-    del curdatadic['__up']
-    return datadic
+def close_section(extvarname, datadic, loop_vars):
+    varname = get_varref(extvarname)[0]
+    if trace_handlers:
+        trace_event('close_section', name=varname)
+    return loop_vars['__scopes'].pop()
+
+def get_scope(varname, datadic, loop_vars):
+    # return the innermost scope that contains the variable
+    # or the outermost one if the variable cannot be found
+    if varname in datadic or loop_vars is None:
+        return datadic
+    scopes = loop_vars.get('__scopes', ())
+    for scope in reversed(scopes):
+        if varname in scope:
+            return scope
+    return scopes[0] if len(scopes) > 0 else datadic
 
 def get_indexvalue(token, loop_vars):
     tokname = get_name(token)
@@ -68,7 +77,13 @@ def get_indexvalue(token, loop_vars):
     else:
         raise TypeError(f'The token of type {tokname} is not allowed as index specification.')
 
-def get_varval(expr, datadic, loop_vars, look_up=True):
+def get_indexvalues(idxspecs, loop_vars):
+    # idxspecs as returned by get_varref, i.e., names
+    # of loop variables or integers for fixed indices
+    return tuple(loop_vars[idx] if isinstance(idx, str) else idx
+                 for idx in idxspecs)
+
+def resolve_varref(expr):
     name = get_name(expr, nofail=True)
     if name in ('VARNAME', 'extvarname'):
         varname = get_varname(expr)
@@ -80,7 +95,41 @@ def get_varval(expr, datadic, loop_vars, look_up=True):
         raise TypeError(f'node must be either of type VARNAME or extvarname ' +
                         'but is {name} OR it must be at least a string with ' +
                         'the variable name')
+    if idxquants is not None:
+        # loop variables are stored by name and fixed indices as integer
+        idxspecs = tuple(str(get_value(idxquant)) if get_name(idxquant) == 'INDEXVAR'
+                         else get_indexvalue(idxquant, None) for idxquant in idxquants)
+    else:
+        idxspecs = None
+    return (str(varname), idxspecs)
+
+# cache for variable references so that the variable name and the
+# index specification only need to be extracted once from the node
+varref_cache = {}
 
+def get_varref(expr):
+    cache_entry = varref_cache.get(id(expr), None)
+    if cache_entry is None or cache_entry[0] is not expr:
+        cache_entry = (expr, resolve_varref(expr))
+        varref_cache[id(expr)] = cache_entry
+    return cache_entry[1]
+
+def get_plain_varref(expr):
+    # returns the variable reference if the expression
+    # consists of nothing else than a variable, otherwise None
+    while is_tree(expr) and len(expr.children) == 1:
+        if get_name(expr) == 'extvarname':
+            break
+        expr = expr.children[0]
+    if get_name(expr, nofail=True) not in ('VARNAME', 'extvarname'):
+        return None
+    return get_varref(expr)
+
+def get_varval(expr, datadic, loop_vars, look_up=True):
+    varname, idxspecs = get_varref(expr)
+    return get_varval_by_ref(varname, idxspecs, datadic, loop_vars, look_up)
+
+def get_varval_by_ref(varname, idxspecs, datadic, loop_vars, look_up=True):
     if loop_vars is not None:
         if varname in datadic and varname in loop_vars:
             raise LoopVariableError(
@@ -89,29 +138,20 @@ def get_varval(expr, datadic, loop_vars, look_up=True):
         if varname in loop_vars:
             return loop_vars[varname]
 
-    while (varname not in datadic and
-           '__up' in datadic and look_up):
-        datadic = datadic['__up']
+    if look_up:
+        datadic = get_scope(varname, datadic, loop_vars)
     if varname not in datadic:
         raise VariableNotFoundError(f'variable {varname} not found')
-    if idxquants is None:
+    if idxspecs is None:
         return datadic[varname]
     else:
-        curdic = datadic[varname]
-        for i, idxquant in enumerate(idxquants):
-            idx = get_indexvalue(idxquant, loop_vars)
-            if i < len(idxquants)-1:
-                try:
-                    curdic = curdic[idx]
-                except Exception:
-                    raise UnavailableIndexError(
-                            f'index {idx} does not exist in array {varname}')
-        idx = get_indexvalue(idxquants[-1], loop_vars)
-        try:
-            val = curdic[idx]
-        except Exception:
-            raise UnavailableIndexError(
-                    f'index {idx} does not exist in array {varname}')
+        val = datadic[varname]
+        for idx in get_indexvalues(idxspecs, loop_vars):
+            try:
+                val = val[idx]
+            except Exception:
+                raise UnavailableIndexError(
+                        f'index {idx} does not exist in array {varname}')
         return val
 
 def count_unassigned_vars(expr, datadic, loop_vars, look_up=True):
@@ -173,29 +213,45 @@ def eval_expr_without_unknown_var(expr, datadic=None,
                                   loop_vars=None, look_up=True):
     ret = eval_expr(expr, datadic, loop_vars, look_up)
     if ret[1] != 0:
-        unknown_varname = get_varname(ret[2])
+        unknown_varname = ret[2][0]
         raise VariableNotFoundError(
                 f'Unknown variable in expression ({unknown_varname})')
     return ret[0]
 
+# cache for the compiled expressions
+compiled_expr_cache = {}
+
+def get_compiled_expr(expr):
+    cache_entry = compiled_expr_cache.get(id(expr), None)
+    if cache_entry is None or cache_entry[0] is not expr:
+        cache_entry = (expr, compile_expr(expr))
+        compiled_expr_cache[id(expr)] = cache_entry
+    return cache_entry[1]
+
 def eval_expr(expr, datadic=None, loop_vars=None, look_up=True):
+    # returns a tuple (value, coeff, varref) so that the value of the expression
+    # is given by value + coeff * variable. If all variables in the
+    # expression are known, coeff is zero and varref is None.
+    # Otherwise, varref is (varname, idxspecs) of the unknown variable,
+    # see get_varref for the definition of the latter.
+    return get_compiled_expr(expr)(datadic, loop_vars, look_up)
+
+def compile_expr(expr):
+    # translate the expression into a function with the same
+    # arguments and return value as eval_expr
+    expr_fun, expr_const = compile_expr_helper(expr)
+    return expr_fun
+
+def compile_expr_helper(expr):
+    # returns the function to evaluate the expression and,
+    # if the expression does not contain variables,
+    # the precomputed result of the function
     name = get_name(expr, nofail=True)
     # reminder: VARNAME is is a string of letters and number, e.g., foo1
     #           extvarname can contain an index specification, e.g., foo1[i]
     if (name in ('VARNAME', 'extvarname') or
             (name is None and isinstance(expr, str))):
-        if datadic is None:
-            return (0, 1, expr)
-        else:
-            # if datadic and variable exists in datadic
-            # we substitute the variable name by its value
-            try:
-                val = get_varval(expr, datadic, loop_vars, look_up)
-                return (val, 0, None)
-            except VariableNotFoundError:
-                return (0, 1, expr)
-            except UnavailableIndexError:
-                return (0, 1, expr)
+        return compile_variable(expr), None
     elif name == 'NUMBER' or name == 'DESIRED_NUMBER':
         vstr = expr.value
         # a desired number is suffixed by a question mark
@@ -206,57 +262,25 @@ def eval_expr(expr, datadic=None, loop_vars=None, look_up=True):
             v = int(vstr)
         else:
             v = float(vstr)
-        return (v, 0, None)
+        return compile_constant((v, 0, None))
     elif name == 'minusexpr':
-        v = eval_expr(expr.children[0], datadic, loop_vars, look_up)
-        return (math_neg(v[0]), -v[1], v[2])
-    elif name in ('addition', 'subtraction',
-                'multiplication', 'division'):
-        v1 = eval_expr(expr.children[0], datadic, loop_vars, look_up)
+        return compile_operation(minus_operation, expr.children[0])
+    elif name == 'multiplication':
         # children[1] contains the operator symbol *,/,+,-
-        v2 = eval_expr(expr.children[2], datadic, loop_vars, look_up)
-        if name == 'multiplication':
-            if v1[1] != 0 and v2[1] != 0:
-                raise SeveralUnboundVariablesError(
-                        'More than one unassigned variables must not appear ' +
-                        'in an expression.')
-            if v1[1] == 0:
-                return (math_mul(v1[0], v2[0]),
-                        math_mul(v1[0], v2[1]),
-                        v2[2])
-            else:
-                return (math_mul(v1[0], v2[0]),
-                        math_mul(v1[1], v2[0]),
-                        v1[2])
-        elif name == 'division':
-            if v2[1] != 0:
-                raise VariableInDenominatorError(
-                        'A variable name must not appear in the denominator ' +
-                        'of an expression.')
-            vx = math_div(v1[0], v2[0], cast_int=True)
-            vy = math_div(v1[1], v2[0], cast_int=True)
-            return (vx, vy, v1[2])
-        elif name == 'addition':
-            if v1[1] != 0 and v2[1] != 0:
-                raise SeveralUnboundVariablesError(
-                    'More than one unassigned variable must not appear ' +
-                    'in an expression.')
-            vexpr = v1[2] if v1[1] != 0 else v2[2]
-            return (math_add(v1[0], v2[0]),
-                    math_add(v1[1], v2[1]),
-                    vexpr)
-        elif name == 'subtraction':
-            if v1[1] != 0 and v2[1] != 0:
-                raise SeveralUnboundVariablesError(
-                        'More than one unassigned variable must not appear ' +
-                        'in an expression.')
-            vexpr = v1[2] if v1[1] != 0 else v2[2]
-            return (math_sub(v1[0], v2[0]),
-                    math_sub(v1[1], v2[1]),
-                    vexpr)
+        return compile_operation(multiplication_operation,
+                                 expr.children[0], expr.children[2])
+    elif name == 'division':
+        return compile_operation(division_operation,
+                                 expr.children[0], expr.children[2])
+    elif name == 'addition':
+        return compile_operation(addition_operation,
+                                 expr.children[0], expr.children[2])
+    elif name == 'subtraction':
+        return compile_operation(subtraction_operation,
+                                 expr.children[0], expr.children[2])
     elif name == 'inconsistent_varspec':
         ch = get_child(expr, 'extvarname')
-        return eval_expr(ch, datadic, loop_vars, look_up)
+        return compile_expr_helper(ch)
     else:
         # we remove enclosing brackets if present
         ch_first = expr.children[0]
@@ -267,4 +291,138 @@ def eval_expr(expr, datadic=None, loop_vars=None, look_up=True):
         else:
             trimmed_children = expr.children
         assert len(trimmed_children) == 1
-        return eval_expr(trimmed_children[0], datadic, loop_vars, look_up)
+        return compile_expr_helper(trimmed_children[0])
+
+def get_expr_vars(expr):
+    # static analysis of an expression to find out
+    # for which variables it can be solved. Returns a dictionary
+    # with the variable references (see get_varref) as keys
+    # and True as value if the expression is linear in the variable,
+    # assuming that all other variables are known.
+    # Otherwise, the value is False. The conditions are the same
+    # as those leading to errors in the operation functions below.
+    name = get_name(expr, nofail=True)
+    if (name in ('VARNAME', 'extvarname') or
+            (name is None and isinstance(expr, str))):
+        return {get_varref(expr): True}
+    elif name == 'NUMBER' or name == 'DESIRED_NUMBER':
+        return {}
+    elif name == 'minusexpr':
+        return get_expr_vars(expr.children[0])
+    elif name in ('multiplication', 'addition', 'subtraction', 'division'):
+        vars1 = get_expr_vars(expr.children[0])
+        vars2 = get_expr_vars(expr.children[2])
+        if name == 'division':
+            vars2 = {v: False for v in vars2}
+        expr_vars = vars1.copy()
+        for v, linear in vars2.items():
+            expr_vars[v] = linear and v not in vars1
+        for v in vars1:
+            if v in vars2:
+                expr_vars[v] = False
+        return expr_vars
+    elif name == 'inconsistent_varspec':
+        return get_expr_vars(get_child(expr, 'extvarname'))
+    else:
+        ch_first = expr.children[0]
+        ch_last = expr.children[-1]
+        if (is_token(ch_first) and get_name(ch_first) == 'LPAR' and
+            is_token(ch_last) and get_name(ch_last) == 'RPAR'):
+            trimmed_children = expr.children[1:-1]
+        else:
+            trimmed_children = expr.children
+        assert len(trimmed_children) == 1
+        return get_expr_vars(trimmed_children[0])
+
+def compile_constant(const):
+    def eval_constant(datadic, loop_vars, look_up):
+        return const
+    return eval_constant, const
+
+def compile_variable(expr):
+    varref = get_varref(expr)
+    varname, idxspecs = varref
+    unknown = (0, 1, varref)
+
+    def eval_variable(datadic, loop_vars, look_up):
+        if datadic is None:
+            return unknown
+        # if datadic and variable exists in datadic
+        # we substitute the variable name by its value
+        try:
+            val = get_varval_by_ref(varname, idxspecs, datadic, loop_vars, look_up)
+            return (val, 0, None)
+        except VariableNotFoundError:
+            return unknown
+        except UnavailableIndexError:
+            return unknown
+
+    return eval_variable
+
+def compile_operation(operation, *operands):
+    compiled = tuple(compile_expr_helper(op) for op in operands)
+    funs = tuple(c[0] for c in compiled)
+    consts = tuple(c[1] for c in compiled)
+    if all(c is not None for c in consts):
+        # constant folding, but errors, such as division by zero,
+        # should only show up if the expression is evaluated
+        try:
+            return compile_constant(operation(*consts))
+        except Exception:
+            pass
+    if len(funs) == 1:
+        fun = funs[0]
+        def eval_operation(datadic, loop_vars, look_up):
+            return operation(fun(datadic, loop_vars, look_up))
+    else:
+        fun1, fun2 = funs
+        def eval_operation(datadic, loop_vars, look_up):
+            return operation(fun1(datadic, loop_vars, look_up),
+                             fun2(datadic, loop_vars, look_up))
+    return eval_operation, None
+
+def minus_operation(v):
+    return (math_neg(v[0]), -v[1], v[2])
+
+def multiplication_operation(v1, v2):
+    if v1[1] != 0 and v2[1] != 0:
+        raise SeveralUnboundVariablesError(
+                'More than one unassigned variables must not appear ' +
+                'in an expression.')
+    if v1[1] == 0:
+        return (math_mul(v1[0], v2[0]),
+                math_mul(v1[0], v2[1]),
+                v2[2])
+    else:
+        return (math_mul(v1[0], v2[0]),
+                math_mul(v1[1], v2[0]),
+                v1[2])
+
+def division_operation(v1, v2):
+    if v2[1] != 0:
+        raise VariableInDenominatorError(
+                'A variable name must not appear in the denominator ' +
+                'of an expression.')
+    vx = math_div(v1[0], v2[0], cast_int=True)
+    vy = math_div(v1[1], v2[0], cast_int=True)
+    return (vx, vy, v1[2])
+
+def addition_operation(v1, v2):
+    if v1[1] != 0 and v2[1] != 0:
+        raise SeveralUnboundVariablesError(
+            'More than one unassigned variable must not appear ' +
+            'in an expression.')
+    vexpr = v1[2] if v1[1] != 0 else v2[2]
+    return (math_add(v1[0], v2[0]),
+            math_add(v1[1], v2[1]),
+            vexpr)
+
+def subtraction_operation(v1, v2):
+    if v1[1] != 0 and v2[1] != 0:
+        raise SeveralUnboundVariablesError(
+                'More than one unassigned variable must not appear ' +
+                'in an expression.')
+    vexpr = v1[2] if v1[1] != 0 else v2[2]
+    return (math_sub(v1[0], v2[0]),
+            math_sub(v1[1], v2[1]),
+            vexpr)
@@ -10,132 +10,310 @@
 ############################################################
 
 from .tree_utils import (
-        is_tree, get_name, get_child, get_child_value
+        is_tree, is_token, get_name, get_child, get_child_value
     )
-from .flow_control_utils import cycle_for_loop
-from .endf_mapping_utils import open_section, close_section
+from .flow_control_utils import cycle_for_loop, get_loop_range
+from .endf_mapping_utils import (open_section, close_section,
+        get_plain_varref, get_indexvalues, get_scope, get_expr_vars)
 from .custom_exceptions import (
         UnexpectedControlRecordError,
         MoreListElementsExpectedError,
         UnconsumedListElementsError
     )
-from .endf_mapping_core import map_record_helper
+from .endf_mapping_core import map_record_helper, get_resolution_order
+from collections.abc import Mapping
 
-def check_ctrl_spec(record_line_node, record_dic, datadic, inverse):
+def get_ctrl_spec(record_line_node):
+    # resolve the control specification of a record once so that
+    # the comparison with the MAT/MF/MT numbers in the file is cheap.
+    # None means that any value is accepted.
     ctrl_spec = get_child(record_line_node, 'ctrl_spec')
-    dic = record_dic if not inverse else datadic
-    # if MAT not found in local scope, scan the outer ones
-    while not 'MAT' in dic and '__up' in dic:
-        dic = dic['__up']
-    cur_mat = dic['MAT']
-    cur_mf  = dic['MF']
-    cur_mt  = dic['MT']
     exp_mat = get_child_value(ctrl_spec, 'MAT_SPEC')
     exp_mf = get_child_value(ctrl_spec, 'MF_SPEC')
     exp_mt = get_child_value(ctrl_spec, 'MT_SPEC')
-    if exp_mat != 'MAT' and int(exp_mat) != cur_mat:
-        raise UnexpectedControlRecordError(
-                f'Expected MAT {exp_mat} but encountered {cur_mat}')
-    if exp_mf != 'MF' and int(exp_mf) != cur_mf:
-        raise UnexpectedControlRecordError(
-                f'Expected MF {exp_mf} but encountered {cur_mf}')
-    if exp_mt != 'MT' and int(exp_mt) != cur_mt:
-        raise UnexpectedControlRecordError(
-                f'Expected MT {exp_mt} but encountered {cur_mt}')
+    exp_mat = int(exp_mat) if exp_mat != 'MAT' else None
+    exp_mf = int(exp_mf) if exp_mf != 'MF' else None
+    exp_mt = int(exp_mt) if exp_mt != 'MT' else None
+    return (exp_mat, exp_mf, exp_mt)
+
+def get_expr_list(children):
+    # remove COMMA token because it is not relevant
+    return tuple(expr for expr in children
+                 if not is_token(expr) or get_name(expr) != 'COMMA')
+
+def get_section_varref(node, name):
+    # extvarname node of an optional table or list name
+    name_node = get_child(node, name, nofail=True)
+    if name_node is None:
+        return None
+    return get_child(name_node, 'extvarname')
+
+def compile_text_spec(text_line_node):
+    return {'fields': get_expr_list(get_child(text_line_node, 'text_fields').children),
+            'keys': ('HL',)}
 
+def compile_head_spec(head_line_node):
+    return {'fields': get_expr_list(get_child(head_line_node, 'head_fields').children),
+            'keys': ('C1', 'C2', 'L1', 'L2', 'N1', 'N2')}
 
-def map_text_dic(text_line_node, text_dic={}, datadic={}, loop_vars={}, inverse=False, parse_opts=None):
-    check_ctrl_spec(text_line_node, text_dic, datadic, inverse)
-    expr_list = get_child(text_line_node, 'text_fields').children
-    cn = ('HL',)
-    return map_record_helper(expr_list, cn, text_dic, datadic, loop_vars, inverse, parse_opts)
-
-def map_head_dic(head_line_node, head_dic={}, datadic={}, loop_vars={}, inverse=False, parse_opts=None):
-    check_ctrl_spec(head_line_node, head_dic, datadic, inverse)
-    expr_list = get_child(head_line_node, 'head_fields').children
-    cn = ('C1', 'C2', 'L1', 'L2', 'N1', 'N2')
-    return map_record_helper(expr_list, cn, head_dic, datadic, loop_vars, inverse, parse_opts)
-
-def map_cont_dic(cont_line_node, cont_dic={}, datadic={}, loop_vars={}, inverse=False, parse_opts=None):
-    check_ctrl_spec(cont_line_node, cont_dic, datadic, inverse)
-    expr_list = get_child(cont_line_node, 'cont_fields').children
-    cn = ('C1', 'C2', 'L1', 'L2', 'N1', 'N2')
-    return map_record_helper(expr_list, cn, cont_dic, datadic, loop_vars, inverse, parse_opts)
-
-def map_dir_dic(dir_line_node, dir_dic={}, datadic={}, loop_vars={}, inverse=False, parse_opts=None):
-    check_ctrl_spec(dir_line_node, dir_dic, datadic, inverse)
-    expr_list = get_child(dir_line_node, 'dir_fields').children
-    cn = ('L1', 'L2', 'N1', 'N2')
-    return map_record_helper(expr_list, cn, dir_dic, datadic, loop_vars, inverse, parse_opts)
-
-def map_intg_dic(intg_line_node, intg_dic={}, datadic={}, loop_vars={}, inverse=False, parse_opts=None):
-    check_ctrl_spec(intg_line_node, intg_dic, datadic, inverse)
-    expr_list = get_child(intg_line_node, 'intg_fields').children
-    cn = ('II', 'JJ', 'KIJ')
-    return map_record_helper(expr_list, cn, intg_dic, datadic, loop_vars, inverse, parse_opts)
-
-def map_tab2_dic(tab2_line_node, tab2_dic={}, datadic={}, loop_vars={}, inverse=False, parse_opts=None):
-    check_ctrl_spec(tab2_line_node, tab2_dic, datadic, inverse)
+def compile_cont_spec(cont_line_node):
+    return {'fields': get_expr_list(get_child(cont_line_node, 'cont_fields').children),
+            'keys': ('C1', 'C2', 'L1', 'L2', 'N1', 'N2')}
+
+def compile_dir_spec(dir_line_node):
+    return {'fields': get_expr_list(get_child(dir_line_node, 'dir_fields').children),
+            'keys': ('L1', 'L2', 'N1', 'N2')}
+
+def compile_intg_spec(intg_line_node):
+    return {'fields': get_expr_list(get_child(intg_line_node, 'intg_fields').children),
+            'keys': ('II', 'JJ', 'KIJ'),
+            'ndigit_expr': get_child(intg_line_node, 'ndigit_expr')}
+
+def compile_tab2_spec(tab2_line_node):
     tab2_fields = get_child(tab2_line_node, 'tab2_fields')
     tab2_cont_fields = get_child(tab2_fields, 'tab2_cont_fields')
     # tab2_def_fields contains the name of the Z variable
     # we don't need it because the following TAB1/LIST records
-    # contain the name of this variable at position of C2
-    tab2_def_fields = get_child(tab2_fields, 'tab2_def').children
-    tab2_name_node = get_child(tab2_line_node, 'table_name', nofail=True)
-    # open section if desired
-    if tab2_name_node is not None:
-        datadic = open_section(tab2_name_node, datadic, loop_vars)
-    # deal with the mapping of the variable names in the table first
-    cn = ('NBT', 'INT')
-    tab2_def_fields = get_child(tab2_fields, 'tab2_def').children
-    expr_list = ['NBT', 'INT']
-    tbl_dic = {} if inverse else tab2_dic['table']
-    tbl_ret = map_record_helper(expr_list, cn, tbl_dic, datadic, loop_vars, inverse, parse_opts)
-    # close section if desired
-    if tab2_name_node is not None:
-        datadic = close_section(tab2_name_node, datadic)
+    # contain the name of this variable at position of C2.
     # we remove NR because we can infer it from the length of the NBT array
     # we keep NZ because it contains the number of following TAB1/LIST records
     # NOTE: -(2+1) because a comma separates NR and NZ
     expr_list = tab2_cont_fields.children[:-3] + tab2_cont_fields.children[-1:]
-    cn = ('C1', 'C2', 'L1', 'L2','N2')
-    main_ret = map_record_helper(expr_list, cn, tab2_dic, datadic, loop_vars, inverse, parse_opts)
-    if inverse:
-        main_ret['table'] = tbl_ret
-    return main_ret
+    return {'fields': get_expr_list(expr_list),
+            'keys': ('C1', 'C2', 'L1', 'L2', 'N2'),
+            'table_name': get_section_varref(tab2_line_node, 'table_name'),
+            'table_fields': ('NBT', 'INT'),
+            'table_keys': ('NBT', 'INT')}
 
-def map_tab1_dic(tab1_line_node, tab1_dic={}, datadic={}, loop_vars={}, inverse=False, parse_opts=None):
-    check_ctrl_spec(tab1_line_node, tab1_dic, datadic, inverse)
+def compile_tab1_spec(tab1_line_node):
     tab1_fields = get_child(tab1_line_node, 'tab1_fields')
     tab1_cont_fields = get_child(tab1_fields, 'tab1_cont_fields')
     tab1_def_fields = get_child(tab1_fields, 'tab1_def').children
-    tab1_name_node = get_child(tab1_line_node, 'table_name', nofail=True)
-
-    # open section if desired
-    if tab1_name_node is not None:
-        datadic = open_section(tab1_name_node, datadic, loop_vars)
-    # deal with the mapping of the variable names in the table first
-    cn = ('NBT', 'INT', 'X', 'Y')
-    tab1_def_fields = get_child(tab1_fields, 'tab1_def').children
     # remove the slash
     tab1_def_fields = [field for field in tab1_def_fields if get_name(field) != 'SLASH']
-    expr_list = ['NBT', 'INT'] + list(tab1_def_fields)
-    tbl_dic = {} if inverse else tab1_dic['table']
-    tbl_ret = map_record_helper(expr_list, cn, tbl_dic, datadic, loop_vars, inverse, parse_opts)
-    # close section if desired
-    if tab1_name_node is not None:
-        datadic = close_section(tab1_name_node, datadic)
     # we remove NR and NP (last two elements) because redundant information
     # and not used by write_tab1 and read_tab1 (2+1 because a comma separates NR and NP)
     expr_list = tab1_cont_fields.children[:-3]
-    cn = ('C1', 'C2', 'L1', 'L2')
-    main_ret = map_record_helper(expr_list, cn, tab1_dic, datadic, loop_vars, inverse, parse_opts)
+    return {'fields': get_expr_list(expr_list),
+            'keys': ('C1', 'C2', 'L1', 'L2'),
+            'table_name': get_section_varref(tab1_line_node, 'table_name'),
+            'table_fields': ('NBT', 'INT') + tuple(tab1_def_fields),
+            'table_keys': ('NBT', 'INT', 'X', 'Y')}
+
+def compile_list_spec(list_line_node):
+    return {'fields': get_expr_list(get_child(list_line_node, 'list_fields').children),
+            'keys': ('C1', 'C2', 'L1', 'L2', 'N1', 'N2'),
+            'list_name': get_section_varref(list_line_node, 'list_name'),
+            'list_body': get_child(list_line_node, 'list_body')}
+
+def compile_send_spec(send_line_node):
+    return {}
+
+
+record_spec_compilers = {
+        'text_line': compile_text_spec,
+        'head_line': compile_head_spec,
+        'cont_line': compile_cont_spec,
+        'dir_line': compile_dir_spec,
+        'intg_line': compile_intg_spec,
+        'tab1_line': compile_tab1_spec,
+        'tab2_line': compile_tab2_spec,
+        'list_line': compile_list_spec,
+        'send_line': compile_send_spec
+    }
+
+
+def compile_record_spec(record_line_node, known_vars=()):
+    # a record specification collects all the information
+    # in the record node of the recipe tree that is needed
+    # to map between ENDF records and the data dictionary.
+    # known_vars are the references of the variables already
+    # bound when the record is reached, see get_resolution_order
+    record_type = get_name(record_line_node)
+    record_spec = record_spec_compilers[record_type](record_line_node)
+    record_spec['type'] = record_type
+    record_spec['node'] = record_line_node
+    if record_type != 'send_line':
+        record_spec['ctrl_spec'] = get_ctrl_spec(record_line_node)
+        # the fields are stored in the order in which they
+        # need to be processed to determine all variables
+        order = get_resolution_order(record_spec['fields'], known_vars)
+        record_spec['fields'] = tuple(record_spec['fields'][i] for i in order)
+        record_spec['keys'] = tuple(record_spec['keys'][i] for i in order)
+    return record_spec
+
+
+def get_bound_varrefs(record_spec):
+    # references of the variables in the current scope
+    # whose values are known after the record has been read.
+    # Variables in the body of a LIST record are not considered.
+    exprs = record_spec.get('fields', ())
+    if 'table_fields' in record_spec and record_spec['table_name'] is None:
+        exprs = exprs + record_spec['table_fields']
+    varrefs = set()
+    for expr in exprs:
+        varrefs.update(get_expr_vars(expr))
+    return varrefs
+
+
+def check_ctrl_spec(record_spec, record_dic, datadic, loop_vars, inverse):
+    # if MAT not found in local scope, scan the outer ones
+    dic = record_dic if not inverse else get_scope('MAT', datadic, loop_vars)
+    exp_mat, exp_mf, exp_mt = record_spec['ctrl_spec']
+    cur_mat = dic['MAT']
+    cur_mf  = dic['MF']
+    cur_mt  = dic['MT']
+    if exp_mat is not None and exp_mat != cur_mat:
+        raise UnexpectedControlRecordError(
+                f'Expected MAT {exp_mat} but encountered {cur_mat}')
+    if exp_mf is not None and exp_mf != cur_mf:
+        raise UnexpectedControlRecordError(
+                f'Expected MF {exp_mf} but encountered {cur_mf}')
+    if exp_mt is not None and exp_mt != cur_mt:
+        raise UnexpectedControlRecordError(
+                f'Expected MT {exp_mt} but encountered {cur_mt}')
+
+
+def map_text_dic(text_spec, text_dic={}, datadic={}, loop_vars={}, inverse=False, parse_opts=None):
+    check_ctrl_spec(text_spec, text_dic, datadic, loop_vars, inverse)
+    return map_record_helper(text_spec['fields'], text_spec['keys'], text_dic,
+                             datadic, loop_vars, inverse, parse_opts)
+
+def map_head_dic(head_spec, head_dic={}, datadic={}, loop_vars={}, inverse=False, parse_opts=None):
+    check_ctrl_spec(head_spec, head_dic, datadic, loop_vars, inverse)
+    return map_record_helper(head_spec['fields'], head_spec['keys'], head_dic,
+                             datadic, loop_vars, inverse, parse_opts)
+
+def map_cont_dic(cont_spec, cont_dic={}, datadic={}, loop_vars={}, inverse=False, parse_opts=None):
+    check_ctrl_spec(cont_spec, cont_dic, datadic, loop_vars, inverse)
+    return map_record_helper(cont_spec['fields'], cont_spec['keys'], cont_dic,
+                             datadic, loop_vars, inverse, parse_opts)
+
+def map_dir_dic(dir_spec, dir_dic={}, datadic={}, loop_vars={}, inverse=False, parse_opts=None):
+    check_ctrl_spec(dir_spec, dir_dic, datadic, loop_vars, inverse)
+    return map_record_helper(dir_spec['fields'], dir_spec['keys'], dir_dic,
+                             datadic, loop_vars, inverse, parse_opts)
+
+def map_intg_dic(intg_spec, intg_dic={}, datadic={}, loop_vars={}, inverse=False, parse_opts=None):
+    check_ctrl_spec(intg_spec, intg_dic, datadic, loop_vars, inverse)
+    return map_record_helper(intg_spec['fields'], intg_spec['keys'], intg_dic,
+                             datadic, loop_vars, inverse, parse_opts)
+
+def map_table_dic(table_spec, table_dic, datadic, loop_vars, inverse, parse_opts):
+    # common part of map_tab1_dic and map_tab2_dic
+    check_ctrl_spec(table_spec, table_dic, datadic, loop_vars, inverse)
+    table_name_node = table_spec['table_name']
+    # open section if desired
+    if table_name_node is not None:
+        datadic = open_section(table_name_node, datadic, loop_vars)
+    # deal with the mapping of the variable names in the table first
+    tbl_dic = {} if inverse else table_dic['table']
+    tbl_ret = map_record_helper(table_spec['table_fields'], table_spec['table_keys'],
+                                tbl_dic, datadic, loop_vars, inverse, parse_opts)
+    # close section if desired
+    if table_name_node is not None:
+        datadic = close_section(table_name_node, datadic, loop_vars)
+    main_ret = map_record_helper(table_spec['fields'], table_spec['keys'], table_dic,
+                                 datadic, loop_vars, inverse, parse_opts)
     if inverse:
         main_ret['table'] = tbl_ret
     return main_ret
 
-def map_list_dic(list_line_node, list_dic={}, datadic={}, loop_vars={}, inverse=False,
+def map_tab2_dic(tab2_spec, tab2_dic={}, datadic={}, loop_vars={}, inverse=False, parse_opts=None):
+    return map_table_dic(tab2_spec, tab2_dic, datadic, loop_vars, inverse, parse_opts)
+
+def map_tab1_dic(tab1_spec, tab1_dic={}, datadic={}, loop_vars={}, inverse=False, parse_opts=None):
+    return map_table_dic(tab1_spec, tab1_dic, datadic, loop_vars, inverse, parse_opts)
+
+# cache for the analysis of list loops whose values can be
+# assigned to the variables in one go, see bind_list_loop
+list_loop_bindings_cache = {}
+
+def get_list_loop_bindings(list_loop_node):
+    cache_entry = list_loop_bindings_cache.get(id(list_loop_node), None)
+    if cache_entry is None or cache_entry[0] is not list_loop_node:
+        cache_entry = (list_loop_node, determine_list_loop_bindings(list_loop_node))
+        list_loop_bindings_cache[id(list_loop_node)] = cache_entry
+    return cache_entry[1]
+
+def determine_list_loop_bindings(list_loop_node):
+    # a list loop, such as {ER[k], AJ[k], GN[k]}{k=1 to NRS},
+    # qualifies for the assignment of whole slices if its body
+    # only contains variables whose last index is the loop variable
+    for_head = get_child(list_loop_node, 'list_for_head')
+    loopvar = get_child_value(for_head, 'VARNAME')
+    list_body = get_child(list_loop_node, 'list_body')
+    targets = []
+    for child in list_body.children:
+        child_name = get_name(child)
+        if child_name in ('NEWLINE', 'COMMA'):
+            continue
+        elif child_name != 'expr':
+            return None
+        varref = get_plain_varref(child)
+        if varref is None:
+            return None
+        varname, idxspecs = varref
+        if (idxspecs is None or idxspecs[-1] != loopvar or
+                loopvar in idxspecs[:-1]):
+            return None
+        targets.append((varname, idxspecs[:-1]))
+    if len(targets) == 0:
+        return None
+    return {'loopvar': loopvar,
+            'start_expr': get_child(for_head, 'for_start'),
+            'stop_expr': get_child(for_head, 'for_stop'),
+            'targets': tuple(targets)}
+
+def bind_list_loop(bindings, vals, val_idx, datadic, loop_vars):
+    # assign the values of a list loop to the variables
+    # in slices with a stride given by the number of variables.
+    # Returns the number of consumed values or None if the values
+    # need to be mapped element by element, e.g., because some of
+    # the variables already exist and need to be checked for consistency.
+    loopvar = bindings['loopvar']
+    if loopvar in loop_vars:
+        return None
+    start, stop = get_loop_range(bindings['start_expr'], bindings['stop_expr'],
+                                 datadic, loop_vars)
+    numiter = stop - start + 1
+    if numiter <= 0:
+        return 0
+    stride = len(bindings['targets'])
+    numbound = numiter * stride
+    if val_idx + numbound > len(vals):
+        return None
+    targets = []
+    for varname, idxspecs in bindings['targets']:
+        if varname in loop_vars:
+            return None
+        try:
+            idcs = get_indexvalues(idxspecs, loop_vars)
+        except KeyError:
+            return None
+        # make sure that we don't overwrite anything
+        curdic = datadic
+        for key in (varname,) + idcs:
+            curdic = curdic.get(key, None)
+            if curdic is None:
+                break
+            if not isinstance(curdic, Mapping):
+                return None
+        if curdic is not None and not curdic.keys().isdisjoint(range(start, stop+1)):
+            return None
+        targets.append((varname, idcs))
+    if len(set(targets)) != len(targets):
+        return None
+
+    for i, (varname, idcs) in enumerate(targets):
+        curdic = datadic.setdefault(varname, {})
+        for idx in idcs:
+            curdic = curdic.setdefault(idx, {})
+        curdic.update(zip(range(start, stop+1),
+                          vals[val_idx+i:val_idx+numbound:stride]))
+    return numbound
+
+def map_list_dic(list_spec, list_dic={}, datadic={}, loop_vars={}, inverse=False,
                  run_instruction=None, parse_opts=None):
     val_idx = 0
     # we embed recurisve helper function here so that
@@ -182,6 +360,14 @@ def map_list_dic(list_line_node, list_dic={}, datadic={}, loop_vars={}, inverse=
             return
 
         elif node_type == 'list_loop':
+            if not inverse:
+                bindings = get_list_loop_bindings(node)
+                if bindings is not None:
+                    numbound = bind_list_loop(bindings, list_dic['vals'], val_idx,
+                                              datadic, loop_vars)
+                    if numbound is not None:
+                        val_idx += numbound
+                        return
             cycle_for_loop(node, parse_list_body_node, datadic, loop_vars,
                            loop_name='list_loop', head_name='list_for_head',
                            body_name='list_body')
@@ -196,21 +382,19 @@ def map_list_dic(list_line_node, list_dic={}, datadic={}, loop_vars={}, inverse=
         else:
             raise ValueError(f'A node of type {node_type} must not appear in a list_body')
 
-    check_ctrl_spec(list_line_node, list_dic, datadic, inverse)
-    expr_list = get_child(list_line_node, 'list_fields').children
-    cn = ('C1', 'C2', 'L1', 'L2', 'N1', 'N2', 'vals')
-    map_record_helper(expr_list, cn, list_dic, datadic, loop_vars, inverse, parse_opts)
+    check_ctrl_spec(list_spec, list_dic, datadic, loop_vars, inverse)
+    map_record_helper(list_spec['fields'], list_spec['keys'], list_dic,
+                      datadic, loop_vars, inverse, parse_opts)
 
     # enter subsection if demanded
-    list_name_node = get_child(list_line_node, 'list_name', nofail=True)
+    list_name_node = list_spec['list_name']
     if list_name_node is not None:
         datadic = open_section(list_name_node, datadic, loop_vars)
     # parse the list body
-    list_body_node = get_child(list_line_node, 'list_body')
-    parse_list_body_node(list_body_node)
+    parse_list_body_node(list_spec['list_body'])
     # close subsection if opened
     if list_name_node is not None:
-        datadic = close_section(list_name_node, datadic)
+        datadic = close_section(list_name_node, datadic, loop_vars)
 
     numels_in_list = len(list_dic['vals'])
     if val_idx < numels_in_list:
@@ -9,32 +9,40 @@
 #
 ############################################################
 
-from .logging_utils import logging, write_info, RingBuffer
+from .logging_utils import logging, RingBuffer, trace_handlers, trace_event
 from os.path import exists as file_exists
 from copy import deepcopy
-from .tree_utils import (is_tree, get_name, get_child, get_child_value,
-        retrieve_value)
 from .endf_mappings import (map_cont_dic, map_head_dic, map_text_dic,
         map_dir_dic, map_intg_dic, map_tab1_dic, map_tab2_dic, map_list_dic)
-from .endf_mapping_utils import (eval_expr_without_unknown_var, get_varname,
-        open_section, close_section)
-from .flow_control_utils import cycle_for_loop, evaluate_if_clause, should_proceed
+from .endf_mapping_utils import eval_expr_without_unknown_var, get_scope
 
-from .endf_utils import (read_cont, write_cont, read_ctrl, get_ctrl,
+from .endf_utils import (read_cont, write_cont, read_ctrl, copy_ctrl,
         write_head, read_head, read_text, write_text, read_intg, write_intg,
         read_dir, write_dir, read_tab1, write_tab1, read_tab2, write_tab2,
         read_send, write_send, write_fend, write_mend, write_tend,
-        read_list, write_list, split_sections, skip_blank_lines)
-from .custom_exceptions import (
-        InconsistentSectionBracketsError,
-        InvalidIntegerError,
-        StopException,
-        ParserException
-    )
+        read_list, write_list, split_sections, skip_blank_lines,
+        iter_section_lines, get_section_hashes, check_array_backend)
+from .custom_exceptions import ParserException
 from .endf_recipe_utils import (
         get_recipe_parsetree_dic,
         get_responsible_recipe_parsetree,
 )
+from .endf_recipe_compiler import get_recipe_plan
+from .section_index_utils import (map_endf_file, build_section_index,
+        split_sections_by_index, load_section_index, iter_material_indices)
+from .lazy_utils import LazyDict
+from .indexed_array_utils import compact_indexed_values
+from .section_cache_utils import (get_section_cache_key,
+        load_cached_section, store_cached_section)
+from .compression_utils import (get_compression, open_endf_file,
+        read_decompressed_buffer, GzipCheckpointBuffer)
+from mmap import mmap
+from functools import partial
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+from glob import glob
+import os
 
 
 class BasicEndfParser():
@@ -43,7 +51,9 @@ class BasicEndfParser():
                        ignore_varspec_mismatch=False, fuzzy_matching=True,
                        blank_as_zero=True, log_lookahead_traceback=False,
                        abuse_signpos=False, skip_intzero=False, prefer_noexp=False,
-                       accept_spaces=True, keep_E=False, width=11):
+                       accept_spaces=True, keep_E=False, width=11,
+                       section_cache=False, array_backend=None,
+                       indexed_arrays=False):
         # obtain the parsing tree for the language
         # in which ENDF reading recipes are formulated
         self.tree_dic = get_recipe_parsetree_dic()
@@ -72,7 +82,8 @@ class BasicEndfParser():
                 'ignore_varspec_mismatch': ignore_varspec_mismatch,
                 'fuzzy_matching': fuzzy_matching,
                 'blank_as_zero': blank_as_zero,
-                'log_lookahead_traceback': log_lookahead_traceback
+                'log_lookahead_traceback': log_lookahead_traceback,
+                'indexed_arrays': indexed_arrays
             }
         self.write_opts = {
                 'abuse_signpos': abuse_signpos,
@@ -81,198 +92,202 @@ class BasicEndfParser():
                 'keep_E': keep_E,
                 'width': width
             }
+        check_array_backend(array_backend)
         self.read_opts = {
                 'accept_spaces': accept_spaces,
-                'width': width
+                'width': width,
+                'array_backend': array_backend
             }
+        # parsed sections are stored in and loaded from
+        # the cache directory if section_cache=True
+        self.section_cache = section_cache
 
-    def process_stop_line(self, tree):
-        stop_message = retrieve_value(tree, 'STOP_MESSAGE')
-        stop_message = stop_message if stop_message is not None else "stop instruction"
-        raise StopException(stop_message)
+    def get_parser_opts(self):
+        # the arguments to create a parser with the same options
+        return {**self.parse_opts, **self.write_opts, **self.read_opts,
+                'section_cache': self.section_cache}
 
-    def process_text_line(self, tree):
+    def process_text_line(self, record_spec):
         if self.rwmode == 'read':
             self.ofs = skip_blank_lines(self.lines, self.ofs)
             self.loop_vars['__ofs'] = self.ofs
-            # write_info('Reading a TEXT record', self.ofs)
+            if trace_handlers:
+                trace_event('read_record', record_type='TEXT', ofs=self.ofs,
+                            node=record_spec['node'])
             text_dic, self.ofs = read_text(self.lines, self.ofs, with_ctrl=True, **self.read_opts)
-            map_text_dic(tree, text_dic, self.datadic, self.loop_vars, parse_opts=self.parse_opts)
+            map_text_dic(record_spec, text_dic, self.datadic, self.loop_vars, parse_opts=self.parse_opts)
             # this line adds MAT, MF, MT to the dictionary.
             # this line is introduced here to deal with the tape head (mf=0, mt=0)
             # which does not contain a head record as first item, which is the
             # only other place that adds this information.
-            self.datadic.update(get_ctrl(text_dic))
+            copy_ctrl(self.datadic, text_dic)
         else:
-            text_dic = map_text_dic(tree, {}, self.datadic, self.loop_vars, inverse=True, parse_opts=self.parse_opts)
-            text_dic.update(get_ctrl(self.datadic))
+            text_dic = map_text_dic(record_spec, {}, self.datadic, self.loop_vars, inverse=True, parse_opts=self.parse_opts)
+            copy_ctrl(text_dic, self.get_ctrl_scope())
             newlines = write_text(text_dic, with_ctrl=True, **self.write_opts)
             self.lines += newlines
 
-    def process_head_line(self, tree):
+    def process_head_line(self, record_spec):
         if self.rwmode == 'read':
             self.ofs = skip_blank_lines(self.lines, self.ofs)
             self.loop_vars['__ofs'] = self.ofs
-            write_info('Reading a HEAD record', self.ofs)
-            self.logbuffer.save_record_log(self.ofs, self.lines[self.ofs], tree)
+            if trace_handlers:
+                trace_event('read_record', record_type='HEAD', ofs=self.ofs,
+                            node=record_spec['node'])
+            self.logbuffer.save_record_log(self.ofs, record_spec['node'])
             cont_dic, self.ofs = read_head(self.lines, self.ofs, with_ctrl=True,
                     blank_as_zero=self.parse_opts['blank_as_zero'], **self.read_opts)
-            write_info('Content of the HEAD record: ' + str(cont_dic), self.ofs)
-            map_head_dic(tree, cont_dic, self.datadic, self.loop_vars, parse_opts=self.parse_opts)
-            self.datadic.update(get_ctrl(cont_dic))
+            if trace_handlers:
+                trace_event('record_content', record_type='HEAD', ofs=self.ofs,
+                            content=cont_dic)
+            map_head_dic(record_spec, cont_dic, self.datadic, self.loop_vars, parse_opts=self.parse_opts)
+            copy_ctrl(self.datadic, cont_dic)
         else:
-            head_dic = map_head_dic(tree, {}, self.datadic, self.loop_vars, inverse=True, parse_opts=self.parse_opts)
-            head_dic.update(get_ctrl(self.datadic))
+            head_dic = map_head_dic(record_spec, {}, self.datadic, self.loop_vars, inverse=True, parse_opts=self.parse_opts)
+            copy_ctrl(head_dic, self.get_ctrl_scope())
             newlines = write_head(head_dic, with_ctrl=True, **self.write_opts)
             self.lines += newlines
 
-    def process_cont_line(self, tree):
+    def process_cont_line(self, record_spec):
         if self.rwmode == 'read':
             self.ofs = skip_blank_lines(self.lines, self.ofs)
             self.loop_vars['__ofs'] = self.ofs
-            write_info('Reading a CONT record', self.ofs)
-            self.logbuffer.save_record_log(self.ofs, self.lines[self.ofs], tree)
+            if trace_handlers:
+                trace_event('read_record', record_type='CONT', ofs=self.ofs,
+                            node=record_spec['node'])
+            self.logbuffer.save_record_log(self.ofs, record_spec['node'])
             cont_dic, self.ofs = read_cont(self.lines, self.ofs,
                     blank_as_zero=self.parse_opts['blank_as_zero'], **self.read_opts)
-            write_info('Content of the CONT record: ' + str(cont_dic))
-            map_cont_dic(tree, cont_dic, self.datadic, self.loop_vars, parse_opts=self.parse_opts)
+            if trace_handlers:
+                trace_event('record_content', record_type='CONT', content=cont_dic)
+            map_cont_dic(record_spec, cont_dic, self.datadic, self.loop_vars, parse_opts=self.parse_opts)
         else:
-            cont_dic = map_cont_dic(tree, {}, self.datadic, self.loop_vars, inverse=True, parse_opts=self.parse_opts)
-            cont_dic.update(get_ctrl(self.datadic))
+            cont_dic = map_cont_dic(record_spec, {}, self.datadic, self.loop_vars, inverse=True, parse_opts=self.parse_opts)
+            copy_ctrl(cont_dic, self.get_ctrl_scope())
             newlines = write_cont(cont_dic, with_ctrl=True, **self.write_opts)
             self.lines += newlines
 
-    def process_dir_line(self, tree):
+    def process_dir_line(self, record_spec):
         if self.rwmode == 'read':
             self.ofs = skip_blank_lines(self.lines, self.ofs)
             self.loop_vars['__ofs'] = self.ofs
-            self.logbuffer.save_record_log(self.ofs, self.lines[self.ofs], tree)
+            if trace_handlers:
+                trace_event('read_record', record_type='DIR', ofs=self.ofs,
+                            node=record_spec['node'])
+            self.logbuffer.save_record_log(self.ofs, record_spec['node'])
             dir_dic, self.ofs = read_dir(self.lines, self.ofs,
                     blank_as_zero=self.parse_opts['blank_as_zero'], **self.read_opts)
-            map_dir_dic(tree, dir_dic, self.datadic, self.loop_vars, parse_opts=self.parse_opts)
+            map_dir_dic(record_spec, dir_dic, self.datadic, self.loop_vars, parse_opts=self.parse_opts)
         else:
-            dir_dic = map_dir_dic(tree, {}, self.datadic, self.loop_vars, inverse=True, parse_opts=self.parse_opts)
-            dir_dic.update(get_ctrl(self.datadic))
+            dir_dic = map_dir_dic(record_spec, {}, self.datadic, self.loop_vars, inverse=True, parse_opts=self.parse_opts)
+            copy_ctrl(dir_dic, self.get_ctrl_scope())
             newlines = write_dir(dir_dic, with_ctrl=True, **self.write_opts)
             self.lines += newlines
 
-    def process_intg_line(self, tree):
+    def process_intg_line(self, record_spec):
         if self.rwmode == 'read':
             self.ofs = skip_blank_lines(self.lines, self.ofs)
             self.loop_vars['__ofs'] = self.ofs
-            self.logbuffer.save_record_log(self.ofs, self.lines[self.ofs], tree)
-            ndigit = eval_expr_without_unknown_var(get_child(tree, 'ndigit_expr'), self.datadic, self.loop_vars)
+            if trace_handlers:
+                trace_event('read_record', record_type='INTG', ofs=self.ofs,
+                            node=record_spec['node'])
+            self.logbuffer.save_record_log(self.ofs, record_spec['node'])
+            ndigit = eval_expr_without_unknown_var(record_spec['ndigit_expr'], self.datadic, self.loop_vars)
             intg_dic, self.ofs = read_intg(self.lines, self.ofs, ndigit=ndigit,
                     blank_as_zero=self.parse_opts['blank_as_zero'], **self.read_opts)
-            map_intg_dic(tree, intg_dic, self.datadic, self.loop_vars, parse_opts=self.parse_opts)
+            map_intg_dic(record_spec, intg_dic, self.datadic, self.loop_vars, parse_opts=self.parse_opts)
         else:
-            intg_dic = map_intg_dic(tree, {}, self.datadic, self.loop_vars, inverse=True, parse_opts=self.parse_opts)
-            intg_dic.update(get_ctrl(self.datadic))
-            ndigit = eval_expr_without_unknown_var(get_child(tree, 'ndigit_expr'), self.datadic, self.loop_vars)
+            intg_dic = map_intg_dic(record_spec, {}, self.datadic, self.loop_vars, inverse=True, parse_opts=self.parse_opts)
+            copy_ctrl(intg_dic, self.get_ctrl_scope())
+            ndigit = eval_expr_without_unknown_var(record_spec['ndigit_expr'], self.datadic, self.loop_vars)
             newlines = write_intg(intg_dic, with_ctrl=True, ndigit=ndigit, **self.write_opts)
             self.lines += newlines
 
-    def process_tab1_line(self, tree):
+    def process_tab1_line(self, record_spec):
         if self.rwmode == 'read':
             self.ofs = skip_blank_lines(self.lines, self.ofs)
             self.loop_vars['__ofs'] = self.ofs
-            write_info('Reading a TAB1 record', self.ofs)
-            self.logbuffer.save_record_log(self.ofs, self.lines[self.ofs], tree)
+            if trace_handlers:
+                trace_event('read_record', record_type='TAB1', ofs=self.ofs,
+                            node=record_spec['node'])
+            self.logbuffer.save_record_log(self.ofs, record_spec['node'])
             tab1_dic, self.ofs = read_tab1(self.lines, self.ofs,
                     blank_as_zero=self.parse_opts['blank_as_zero'], **self.read_opts)
-            map_tab1_dic(tree, tab1_dic, self.datadic, self.loop_vars, parse_opts=self.parse_opts)
+            map_tab1_dic(record_spec, tab1_dic, self.datadic, self.loop_vars, parse_opts=self.parse_opts)
         else:
-            tab1_dic = map_tab1_dic(tree, {}, self.datadic, self.loop_vars, inverse=True, parse_opts=self.parse_opts)
-            tab1_dic.update(get_ctrl(self.datadic))
+            tab1_dic = map_tab1_dic(record_spec, {}, self.datadic, self.loop_vars, inverse=True, parse_opts=self.parse_opts)
+            copy_ctrl(tab1_dic, self.get_ctrl_scope())
             newlines = write_tab1(tab1_dic, with_ctrl=True, **self.write_opts)
             self.lines += newlines
 
-    def process_tab2_line(self, tree):
+    def process_tab2_line(self, record_spec):
         if self.rwmode == 'read':
             self.ofs = skip_blank_lines(self.lines, self.ofs)
             self.loop_vars['__ofs'] = self.ofs
-            write_info('Reading a TAB2 record', self.ofs)
-            self.logbuffer.save_record_log(self.ofs, self.lines[self.ofs], tree)
+            if trace_handlers:
+                trace_event('read_record', record_type='TAB2', ofs=self.ofs,
+                            node=record_spec['node'])
+            self.logbuffer.save_record_log(self.ofs, record_spec['node'])
             tab2_dic, self.ofs = read_tab2(self.lines, self.ofs,
                     blank_as_zero=self.parse_opts['blank_as_zero'], **self.read_opts)
-            map_tab2_dic(tree, tab2_dic, self.datadic, self.loop_vars, parse_opts=self.parse_opts)
+            map_tab2_dic(record_spec, tab2_dic, self.datadic, self.loop_vars, parse_opts=self.parse_opts)
         else:
-            tab2_dic = map_tab2_dic(tree, {}, self.datadic, self.loop_vars, inverse=True, parse_opts=self.parse_opts)
-            tab2_dic.update(get_ctrl(self.datadic))
+            tab2_dic = map_tab2_dic(record_spec, {}, self.datadic, self.loop_vars, inverse=True, parse_opts=self.parse_opts)
+            copy_ctrl(tab2_dic, self.get_ctrl_scope())
             newlines = write_tab2(tab2_dic, with_ctrl=True, **self.write_opts)
             self.lines += newlines
 
-    def process_list_line(self, tree):
+    def process_list_line(self, record_spec):
         if self.rwmode == 'read':
             self.ofs = skip_blank_lines(self.lines, self.ofs)
             self.loop_vars['__ofs'] = self.ofs
-            write_info('Reading a LIST record', self.ofs)
-            self.logbuffer.save_record_log(self.ofs, self.lines[self.ofs], tree)
+            if trace_handlers:
+                trace_event('read_record', record_type='LIST', ofs=self.ofs,
+                            node=record_spec['node'])
+            self.logbuffer.save_record_log(self.ofs, record_spec['node'])
             list_dic, self.ofs = read_list(self.lines, self.ofs,
                     blank_as_zero=self.parse_opts['blank_as_zero'], **self.read_opts)
-            map_list_dic(tree, list_dic, self.datadic, self.loop_vars, parse_opts=self.parse_opts)
+            map_list_dic(record_spec, list_dic, self.datadic, self.loop_vars, parse_opts=self.parse_opts)
         else:
-            list_dic = map_list_dic(tree, {}, self.datadic, self.loop_vars, inverse=True, parse_opts=self.parse_opts)
-            list_dic.update(get_ctrl(self.datadic))
+            list_dic = map_list_dic(record_spec, {}, self.datadic, self.loop_vars, inverse=True, parse_opts=self.parse_opts)
+            copy_ctrl(list_dic, self.get_ctrl_scope())
             newlines = write_list(list_dic, with_ctrl=True, **self.write_opts)
             self.lines += newlines
 
-    def process_send_line(self, tree):
+    def process_send_line(self, record_spec):
         if self.rwmode == 'read':
             self.ofs = skip_blank_lines(self.lines, self.ofs)
-            self.logbuffer.save_record_log(self.ofs, self.lines[self.ofs], tree)
+            self.logbuffer.save_record_log(self.ofs, record_spec['node'])
             read_send(self.lines, self.ofs,
                       blank_as_zero=self.parse_opts['blank_as_zero'], **self.read_opts)
         else:
-            newlines = write_send(self.datadic, with_ctrl=True,
+            newlines = write_send(self.get_ctrl_scope(), with_ctrl=True,
                                   zero_as_blank=self.zero_as_blank,
                                   **self.write_opts)
             self.lines += newlines
 
+    def get_ctrl_scope(self):
+        # dictionary with MAT, MF and MT of the current section
+        return get_scope('MAT', self.datadic, self.loop_vars)
+
+    # the flow control nodes are executed by the plan
+    # compiled from the recipe. These methods compile and
+    # run the plan of a single node of a recipe tree.
+    def process_stop_line(self, tree):
+        self.run_instruction(tree)
+
     def process_section(self, tree):
-        self.loop_vars['__ofs'] = self.ofs
-        section_head = get_child(tree, 'section_head')
-        section_tail = get_child(tree, 'section_tail')
-        varname = get_varname(section_head)
-        varname2 = get_varname(section_tail)
-        if varname != varname2:
-            raise InconsistentSectionBracketsError(
-                    'The section name in the tail does not correspond to ' +
-                    f'the one in the head (`{varname}` vs `{varname2}`)')
-
-        self.datadic = open_section(section_head, self.datadic, self.loop_vars)
-        section_body = get_child(tree, 'section_body')
-        self.run_instruction(section_body)
-        self.datadic = close_section(section_head, self.datadic)
+        self.run_instruction(tree)
 
     def process_for_loop(self, tree):
-        return cycle_for_loop(tree, self.run_instruction, self.datadic, self.loop_vars)
+        self.run_instruction(tree)
 
     def process_if_clause(self, tree):
-        evaluate_if_clause(tree, self.run_instruction,
-                           self.datadic, self.loop_vars,
-                           set_parser_state=self.set_parser_state,
-                           get_parser_state=self.get_parser_state,
-                           parse_opts=self.parse_opts)
+        self.run_instruction(tree)
 
     def run_instruction(self, tree):
-        if tree.data in self.endf_actions:
-            if should_proceed(tree, self.datadic, self.loop_vars,
-                                         action_type='endf_action'):
-                self.endf_actions[tree.data](tree)
-        elif tree.data in self.flow_actions:
-            if should_proceed(tree, self.datadic, self.loop_vars,
-                                          action_type='flow_action'):
-                self.flow_actions[tree.data](tree)
-        else:
-            for child in tree.children:
-                if is_tree(child):
-                    if should_proceed(tree, self.datadic,
-                                      self.loop_vars,
-                                      action_type='unspecified'):
-                        self.run_instruction(child)
-                    else:
-                        break
+        plan = get_recipe_plan(tree)
+        plan(self)
 
     def reset_parser_state(self, rwmode='read', lines=None, datadic=None):
         self.loop_vars = {}
@@ -288,7 +303,7 @@ class BasicEndfParser():
         #           development.
         datadic = datadic if datadic is not None else {}
         lines = lines if lines is not None else []
-        self.loop_vars = {'__ofs': 0}
+        self.loop_vars = {'__ofs': 0, '__scopes': []}
         self.datadic = datadic
         self.lines = lines
         self.rwmode = rwmode
@@ -301,7 +316,7 @@ class BasicEndfParser():
                 'lines': self.lines,
                 'rwmode': self.rwmode,
                 'ofs': self.ofs,
-                'logbuffer_state': self.logbuffer.dump_state()}
+                'logbuffer_position': self.logbuffer.get_position()}
 
     def set_parser_state(self, parser_state):
         self.loop_vars = parser_state['loop_vars']
@@ -309,7 +324,7 @@ class BasicEndfParser():
         self.lines = parser_state['lines']
         self.rwmode = parser_state['rwmode']
         self.ofs = parser_state['ofs']
-        self.logbuffer.load_state(parser_state['logbuffer_state'])
+        self.logbuffer.rewind(parser_state['logbuffer_position'])
 
     def should_skip_section(self, mf, mt, exclude=None, include=None):
         if exclude is None:
@@ -325,35 +340,179 @@ class BasicEndfParser():
                 return True
         return False
 
-    def parse(self, lines, exclude=None, include=None, nofail=False):
+    def parse(self, lines, exclude=None, include=None, nofail=False,
+              lazy=False, workers=None):
         if isinstance(lines, str):
             lines = lines.split('\n')
+        mfmt_dic = split_sections(lines, **self.read_opts)
+        return self.parse_sections(mfmt_dic, exclude, include, nofail,
+                                   lazy, workers)
+
+    def parse_sections(self, mfmt_dic, exclude=None, include=None,
+                       nofail=False, lazy=False, workers=None, errors=None):
+        if workers is not None and workers > 1 and not lazy:
+            return self.parse_sections_in_parallel(
+                    mfmt_dic, exclude, include, nofail, workers, errors)
         tree_dic = self.tree_dic
+        for mf in mfmt_dic:
+            if trace_handlers:
+                trace_event('parse_section', mf=mf)
+            if lazy:
+                # the recipe of a MF/MT section is only run
+                # when the section is accessed for the first time
+                srcdic = mfmt_dic[mf]
+                loader = partial(self.load_subsection, mf, srcdic,
+                                 exclude, include, nofail)
+                lazy_dic = LazyDict(loader)
+                for mt in srcdic:
+                    lazy_dic.set_lazy(mt, None)
+                mfmt_dic[mf] = lazy_dic
+                continue
+            for mt in mfmt_dic[mf]:
+                cur_tree = get_responsible_recipe_parsetree(tree_dic, mf, mt)
+                should_skip = self.should_skip_section(mf, mt, exclude, include)
+                if cur_tree is not None and not should_skip:
+                    curlines = mfmt_dic[mf][mt]
+                    mfmt_dic[mf][mt] = self.parse_subsection(
+                            mf, mt, curlines, nofail, errors)
+        return mfmt_dic
+
+    def parse_incremental(self, lines, previous=None, exclude=None,
+                          include=None, nofail=False, workers=None):
+        if isinstance(lines, str):
+            lines = lines.split('\n')
         mfmt_dic = split_sections(lines, **self.read_opts)
+        return self.parse_sections_incremental(mfmt_dic, previous, exclude,
+                                               include, nofail, workers)
+
+    def parsefile_incremental(self, filename, previous=None, exclude=None,
+                              include=None, nofail=False, workers=None):
+        mfmt_dic = self.split_file_sections(filename)
+        return self.parse_sections_incremental(mfmt_dic, previous, exclude,
+                                               include, nofail, workers)
+
+    def parse_sections_incremental(self, mfmt_dic, previous=None,
+                                   exclude=None, include=None, nofail=False,
+                                   workers=None):
+        # previous is the tuple of the ENDF dictionary and the section
+        # hashes returned by an earlier call. Only the sections whose
+        # lines have changed are parsed again, the dictionaries of
+        # the other sections are taken from the previous result.
+        hashes = get_section_hashes(mfmt_dic)
+        prev_dic, prev_hashes = previous if previous is not None else ({}, {})
+        changed_dic = {}
+        for mf in mfmt_dic:
+            prev_mtdic = prev_dic.get(mf, {})
+            for mt in mfmt_dic[mf]:
+                prev_section = prev_mtdic.get(mt, None)
+                should_skip = self.should_skip_section(mf, mt, exclude, include)
+                if (prev_hashes.get((mf, mt), None) == hashes[(mf, mt)] and
+                        isinstance(prev_section, dict) and not should_skip):
+                    mfmt_dic[mf][mt] = prev_section
+                else:
+                    changed_dic.setdefault(mf, {})
+                    changed_dic[mf][mt] = mfmt_dic[mf][mt]
+        self.parse_sections(changed_dic, exclude, include, nofail,
+                            workers=workers)
+        for mf in changed_dic:
+            for mt in changed_dic[mf]:
+                mfmt_dic[mf][mt] = changed_dic[mf][mt]
+        return mfmt_dic, hashes
+
+    def parse_sections_in_parallel(self, mfmt_dic, exclude, include,
+                                   nofail, workers, errors=None):
+        # the sections are distributed in chunks to a pool of processes,
+        # the largest sections first so that the work is evenly balanced
+        tree_dic = self.tree_dic
+        jobs = []
         for mf in mfmt_dic:
-            write_info(f'Parsing section MF{mf}')
             for mt in mfmt_dic[mf]:
-                curmat = read_ctrl(mfmt_dic[mf][mt][0], **self.read_opts)
-                write_info(f'Parsing subsection MF/MT {mf}/{mt}')
-                curlines = mfmt_dic[mf][mt]
                 cur_tree = get_responsible_recipe_parsetree(tree_dic, mf, mt)
                 should_skip = self.should_skip_section(mf, mt, exclude, include)
                 if cur_tree is not None and not should_skip:
-                    # we add the SEND line so that parsing fails
-                    # if the MT section cannot be completely parsed
-                    curlines += write_send(curmat, with_ctrl=True, **self.write_opts)
-                    self.reset_parser_state(rwmode='read', lines=curlines)
-                    try:
-                        self.run_instruction(cur_tree)
-                        mfmt_dic[mf][mt] = self.datadic
-                    except ParserException as exc:
-                        if not nofail:
-                            logstr = self.logbuffer.display_record_logs()
-                            raise ParserException(
-                                    '\nHere is the parser record log until failure:\n\n' +
-                                    logstr + 'Error message: ' + str(exc))
+                    jobs.append((mf, mt, mfmt_dic[mf][mt]))
+        jobs.sort(key=lambda job: len(job[2]), reverse=True)
+        chunk_numlines = sum(len(job[2]) for job in jobs) / (4*workers)
+        chunks = []
+        curchunk = []
+        curnumlines = 0
+        for job in jobs:
+            curchunk.append(job)
+            curnumlines += len(job[2])
+            if curnumlines >= chunk_numlines:
+                chunks.append(curchunk)
+                curchunk = []
+                curnumlines = 0
+        if curchunk:
+            chunks.append(curchunk)
+        parser_opts = self.get_parser_opts()
+        results = {}
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=init_worker_parser,
+                                 initargs=(parser_opts,)) as executor:
+            for chunk_results, chunk_errors in executor.map(
+                    parse_chunk_in_worker, chunks, repeat(nofail)):
+                for mf, mt, section in chunk_results:
+                    results[(mf, mt)] = section
+                if errors is not None:
+                    errors.update(chunk_errors)
+        # the results are merged in the order of the sections so that
+        # the error of the first section that failed is raised
+        for mf in mfmt_dic:
+            for mt in mfmt_dic[mf]:
+                section = results.get((mf, mt), None)
+                if isinstance(section, Exception):
+                    raise section
+                elif section is not None:
+                    mfmt_dic[mf][mt] = section
         return mfmt_dic
 
+    def load_subsection(self, mf, srcdic, exclude, include, nofail,
+                        mt, rawval=None):
+        curlines = srcdic[mt]
+        cur_tree = get_responsible_recipe_parsetree(self.tree_dic, mf, mt)
+        should_skip = self.should_skip_section(mf, mt, exclude, include)
+        if cur_tree is not None and not should_skip:
+            return self.parse_subsection(mf, mt, curlines, nofail)
+        return curlines
+
+    def parse_subsection(self, mf, mt, curlines, nofail=False, errors=None):
+        if trace_handlers:
+            trace_event('parse_subsection', mf=mf, mt=mt)
+        if self.section_cache:
+            cache_key = get_section_cache_key(mf, mt, curlines,
+                                              self.parse_opts, self.read_opts)
+            datadic = load_cached_section(cache_key)
+            if datadic is not None:
+                return datadic
+        curmat = read_ctrl(curlines[0], **self.read_opts)
+        cur_tree = get_responsible_recipe_parsetree(self.tree_dic, mf, mt)
+        # we add the SEND line so that parsing fails
+        # if the MT section cannot be completely parsed
+        curlines = curlines + write_send(curmat, with_ctrl=True,
+                                         **self.write_opts)
+        self.reset_parser_state(rwmode='read', lines=curlines)
+        try:
+            self.run_instruction(cur_tree)
+            # the values of indexed variables are stored
+            # in typed arrays if indexed_arrays=True
+            if self.parse_opts['indexed_arrays']:
+                compact_indexed_values(self.datadic)
+            if self.section_cache:
+                store_cached_section(cache_key, self.datadic)
+            return self.datadic
+        except ParserException as exc:
+            if not nofail:
+                logstr = self.logbuffer.display_record_logs(self.lines)
+                raise ParserException(
+                        '\nHere is the parser record log until failure:\n\n' +
+                        logstr + 'Error message: ' + str(exc))
+            # the error messages of the sections that
+            # could not be parsed can be collected
+            if errors is not None:
+                errors[(mf, mt)] = str(exc)
+        return curlines
+
     def write(self, endf_dic, exclude=None, include=None, zero_as_blank=False):
         self.zero_as_blank = zero_as_blank
         self.reset_parser_state(rwmode='write', datadic={})
@@ -425,10 +584,144 @@ class BasicEndfParser():
         del self.zero_as_blank
         return lines
 
-    def parsefile(self, filename, exclude=None, include=None, nofail=False):
-        with open(filename, 'r') as fin:
-            lines = fin.readlines()
-        return self.parse(lines, exclude, include, nofail=nofail)
+    def parsefile(self, filename, exclude=None, include=None, nofail=False,
+                  lazy=False, use_index_cache=False, workers=None):
+        mfmt_dic = self.split_file_sections(filename, lazy, use_index_cache,
+                                            exclude, include)
+        return self.parse_sections(mfmt_dic, exclude, include, nofail,
+                                   lazy, workers)
+
+    def get_skip_function(self, exclude=None, include=None):
+        # the lines of sections that are not parsed are
+        # only decoded if they are accessed
+        if exclude is None and include is None:
+            return None
+        return partial(self.should_skip_section,
+                       exclude=exclude, include=include)
+
+    def split_file_sections(self, filename, lazy=False, use_index_cache=False,
+                            exclude=None, include=None):
+        compression = get_compression(filename)
+        if compression == 'gzip' and lazy:
+            # sections are decompressed starting from
+            # the closest checkpoint when they are accessed
+            buf = GzipCheckpointBuffer(filename, **self.read_opts)
+            return split_sections_by_index(buf, buf.index, lazy=True,
+                                           **self.read_opts)
+        elif compression is not None:
+            # the decompressed lines are directly split into sections
+            with open_endf_file(filename, 'r') as fin:
+                return split_sections(fin, **self.read_opts)
+        # the file is memory-mapped and split into sections
+        # based on an index of the section positions.
+        # With use_index_cache=True, the index is stored
+        # in the cache directory and reused for the same file.
+        # With lazy=True, the lines of a section are only
+        # read from the mapped file when it is accessed.
+        with open(filename, 'rb') as fin:
+            buf = map_endf_file(fin)
+            try:
+                if use_index_cache:
+                    index, heads = load_section_index(filename, fin, buf,
+                                                      **self.read_opts)
+                else:
+                    index = build_section_index(buf, **self.read_opts)
+                skip = self.get_skip_function(exclude, include)
+                mfmt_dic = split_sections_by_index(buf, index, lazy=lazy,
+                                                   skip=skip, **self.read_opts)
+            finally:
+                # the mapped file remains open as long as
+                # sections of a lazy dictionary refer to it
+                if isinstance(buf, mmap) and not lazy:
+                    buf.close()
+        return mfmt_dic
+
+    def parse_library(self, paths_or_dir, workers=None, exclude=None,
+                      include=None, nofail=False, pattern='*.endf'):
+        # yields a result dictionary for each file as soon as it has
+        # been parsed. It contains the ENDF dictionary, the error
+        # message if the file could not be parsed, the error messages
+        # of sections not parsed with nofail=True and the throughput.
+        if isinstance(paths_or_dir, (str, os.PathLike)):
+            paths = sorted(glob(os.path.join(paths_or_dir, pattern)))
+        else:
+            paths = list(paths_or_dir)
+        start_time = perf_counter()
+        executor = None
+        if workers is not None and workers > 1:
+            parser_opts = self.get_parser_opts()
+            executor = ProcessPoolExecutor(max_workers=workers,
+                                           initializer=init_worker_parser,
+                                           initargs=(parser_opts,))
+            futures = {executor.submit(parse_library_file_in_worker, path,
+                                       exclude, include, nofail): path
+                       for path in paths}
+            results = (get_library_file_result(future, futures[future])
+                       for future in as_completed(futures))
+        else:
+            results = (parse_library_file(self, path, exclude, include, nofail)
+                       for path in paths)
+        numfiles = 0
+        numbytes = 0
+        try:
+            for result in results:
+                numfiles += 1
+                numbytes += result['filesize']
+                elapsed = max(perf_counter() - start_time, 1e-9)
+                result['files_per_s'] = numfiles / elapsed
+                result['mb_per_s'] = numbytes / 1e6 / elapsed
+                yield result
+        finally:
+            if executor is not None:
+                # files not yet started are skipped if the
+                # caller stops iterating over the results
+                for future in futures:
+                    future.cancel()
+                executor.shutdown()
+        elapsed = max(perf_counter() - start_time, 1e-9)
+        logging.info(f'parsed {numfiles} files ({numbytes/1e6:.1f} MB) '
+                     f'in {elapsed:.1f} s: {numfiles/elapsed:.2f} files/s, '
+                     f'{numbytes/1e6/elapsed:.2f} MB/s')
+
+    def iter_materials(self, filename, exclude=None, include=None,
+                       nofail=False, lazy=False):
+        # yields the materials on a tape one after another,
+        # each one as a dictionary like the one returned by parsefile
+        if get_compression(filename) is not None:
+            buf = read_decompressed_buffer(filename)
+        else:
+            with open(filename, 'rb') as fin:
+                buf = map_endf_file(fin)
+        skip = self.get_skip_function(exclude, include)
+        try:
+            for index in iter_material_indices(buf, **self.read_opts):
+                mfmt_dic = split_sections_by_index(buf, index, lazy=lazy,
+                                                   skip=skip, **self.read_opts)
+                yield self.parse_sections(mfmt_dic, exclude, include,
+                                          nofail, lazy)
+        finally:
+            if isinstance(buf, mmap) and not lazy:
+                buf.close()
+
+    def iter_sections(self, source, exclude=None, include=None,
+                      nofail=False):
+        # yields (MAT, MF, MT, section) for the sections of a file,
+        # each one as soon as it has been read. The source can be a
+        # filename, a file object or any other iterable of lines.
+        if isinstance(source, (str, os.PathLike)):
+            with open_endf_file(source, 'r') as fin:
+                yield from self.iter_sections(fin, exclude, include, nofail)
+            return
+        tree_dic = self.tree_dic
+        for mat, mf, mt, curlines in iter_section_lines(source,
+                                                         **self.read_opts):
+            cur_tree = get_responsible_recipe_parsetree(tree_dic, mf, mt)
+            should_skip = self.should_skip_section(mf, mt, exclude, include)
+            if cur_tree is not None and not should_skip:
+                section = self.parse_subsection(mf, mt, curlines, nofail)
+            else:
+                section = curlines
+            yield mat, mf, mt, section
 
     def writefile(self, filename, endf_dic, exclude=None, include=None,
                         zero_as_blank=False, overwrite=False):
@@ -438,5 +731,68 @@ class BasicEndfParser():
                                    'really want to overwrite this file.')
         else:
             lines = self.write(endf_dic, exclude, include, zero_as_blank)
-            with open(filename, 'w') as fout:
+            with open_endf_file(filename, 'w') as fout:
                 fout.write('\n'.join(lines))
+
+
+# each worker process of parse_sections_in_parallel
+# creates its own parser, which loads the recipe trees once
+worker_parser_store = {}
+
+
+def init_worker_parser(parser_opts):
+    worker_parser_store['parser'] = BasicEndfParser(**parser_opts)
+
+
+def parse_chunk_in_worker(chunk, nofail):
+    parser = worker_parser_store['parser']
+    results = []
+    errors = {}
+    for mf, mt, curlines in chunk:
+        try:
+            section = parser.parse_subsection(mf, mt, curlines, nofail,
+                                              errors)
+        except Exception as exc:
+            # raised in the main process in the order of the sections
+            section = exc
+        results.append((mf, mt, section))
+    return results, errors
+
+
+def create_library_file_result(filename):
+    return {'filename': filename, 'endf_dic': None, 'error': None,
+            'section_errors': {}, 'filesize': 0}
+
+
+def parse_library_file(parser, filename, exclude, include, nofail):
+    # errors are reported in the result instead of being raised
+    # so that the remaining files of a library are still parsed
+    result = create_library_file_result(filename)
+    try:
+        result['filesize'] = os.path.getsize(filename)
+        mfmt_dic = parser.split_file_sections(filename, exclude=exclude,
+                                              include=include)
+        result['endf_dic'] = parser.parse_sections(
+                mfmt_dic, exclude, include, nofail,
+                errors=result['section_errors'])
+    except Exception as exc:
+        result['error'] = f'{type(exc).__name__}: {exc}'
+    return result
+
+
+def parse_library_file_in_worker(filename, exclude, include, nofail):
+    parser = worker_parser_store['parser']
+    return parse_library_file(parser, filename, exclude, include, nofail)
+
+
+def get_library_file_result(future, filename):
+    # the result of a worker is not available if the worker process
+    # terminated abruptly or the result could not be transferred
+    try:
+        return future.result()
+    except Exception as exc:
+        result = create_library_file_result(filename)
+        result['error'] = f'{type(exc).__name__}: {exc}'
+        if file_exists(filename):
+            result['filesize'] = os.path.getsize(filename)
+        return result
@@ -0,0 +1,253 @@
+############################################################
+#
+# Author(s):       Georg Schnabel
+# Email:           g.schnabel@iaea.org
+# Creation date:   2023/03/13
+# Last modified:   2023/03/13
+# License:         MIT
+# Copyright (c) 2023 International Atomic Energy Agency (IAEA)
+#
+############################################################
+
+# The recipe compiler translates the parse tree of an ENDF recipe
+# into a plan, i.e., nested Python closures that only need to be
+# called with the parser object to execute the recipe.
+# All child nodes, field lists and control specifications
+# are looked up once during the compilation so that the
+# recipe tree does not need to be walked anymore for each record.
+# During the compilation, the set known_vars keeps track of the
+# variables that are bound on every path through the recipe up to
+# the current instruction so that the fields of a record can be
+# arranged in the order needed to determine their variables.
+# The variables of a section are only known within the section
+# and the loop variables only within the loop.
+
+from .tree_utils import (is_tree, get_name, get_child, get_child_value,
+        retrieve_value)
+from .endf_mappings import compile_record_spec, get_bound_varrefs
+from .endf_mapping_utils import get_varname, open_section, close_section
+from .flow_control_utils import (get_loop_range, evaluate_if_clause,
+        compile_condition, should_proceed)
+from .logging_utils import trace_handlers, trace_event
+from .custom_exceptions import (
+        InconsistentSectionBracketsError,
+        LoopVariableError,
+        StopException
+    )
+
+
+# plans are cached for each recipe tree so that
+# a recipe is compiled only once per process.
+# We also store the tree in the cache because the
+# key is the id of the tree object, which must not be
+# reused by another object.
+recipe_plan_cache = {}
+
+
+def get_recipe_plan(tree):
+    cache_entry = recipe_plan_cache.get(id(tree), None)
+    if cache_entry is None or cache_entry[0] is not tree:
+        cache_entry = (tree, compile_recipe(tree))
+        recipe_plan_cache[id(tree)] = cache_entry
+    return cache_entry[1]
+
+
+def compile_recipe(tree):
+    plan = compile_instruction(tree, set(), ())
+    if plan is None:
+        # empty recipe, nothing to do
+        plan = lambda parser: None
+    return plan
+
+
+def compile_instruction(tree, known_vars, loop_varnames):
+    # known_vars is updated by the variables bound by the instruction
+    name = get_name(tree)
+    if name in endf_line_names:
+        return compile_endf_line(tree, known_vars)
+    elif name == 'for_loop':
+        return compile_for_loop(tree, known_vars, loop_varnames)
+    elif name == 'if_clause':
+        return compile_if_clause(tree, known_vars, loop_varnames)
+    elif name == 'section':
+        return compile_section(tree, known_vars, loop_varnames)
+    elif name == 'stop_line':
+        return compile_stop_line(tree)
+    else:
+        return compile_block(tree, known_vars, loop_varnames)
+
+
+def compile_block(tree, known_vars, loop_varnames):
+    plans = [compile_instruction(child, known_vars, loop_varnames)
+             for child in tree.children if is_tree(child)]
+    # nodes without action, e.g., DUMMY records, don't need a plan
+    plans = tuple(p for p in plans if p is not None)
+    if len(plans) == 0:
+        return None
+    elif len(plans) == 1:
+        return plans[0]
+
+    def run_block(parser):
+        for plan in plans:
+            if not should_proceed(tree, parser.datadic, parser.loop_vars,
+                                  action_type='unspecified'):
+                break
+            plan(parser)
+
+    return run_block
+
+
+# names of the nodes that are associated with a record in the
+# ENDF file. The parser must provide the method as the dictionary
+# value to read or write the corresponding record.
+endf_line_names = ('head_line', 'cont_line', 'text_line', 'dir_line',
+                   'intg_line', 'tab1_line', 'tab2_line', 'list_line',
+                   'send_line')
+
+
+def compile_endf_line(tree, known_vars):
+    record_spec = compile_record_spec(tree, known_vars)
+    record_type = record_spec['type']
+    known_vars.update(get_bound_varrefs(record_spec))
+
+    def run_endf_line(parser):
+        if should_proceed(tree, parser.datadic, parser.loop_vars,
+                          action_type='endf_action'):
+            parser.endf_actions[record_type](record_spec)
+
+    return run_endf_line
+
+
+def compile_stop_line(tree):
+    stop_message = retrieve_value(tree, 'STOP_MESSAGE')
+    stop_message = stop_message if stop_message is not None else "stop instruction"
+
+    def run_stop_line(parser):
+        if should_proceed(tree, parser.datadic, parser.loop_vars,
+                          action_type='flow_action'):
+            raise StopException(stop_message)
+
+    return run_stop_line
+
+
+def compile_section(tree, known_vars, loop_varnames):
+    section_head = get_child(tree, 'section_head')
+    section_tail = get_child(tree, 'section_tail')
+    varname = get_varname(section_head)
+    varname2 = get_varname(section_tail)
+    if varname != varname2:
+        raise InconsistentSectionBracketsError(
+                'The section name in the tail does not correspond to ' +
+                f'the one in the head (`{varname}` vs `{varname2}`)')
+    section_varref = get_child(section_head, 'extvarname')
+    # a section has its own dictionary, in which
+    # only the loop variables are known at the beginning
+    section_known_vars = set((v, None) for v in loop_varnames)
+    section_body = compile_instruction(get_child(tree, 'section_body'),
+                                       section_known_vars, loop_varnames)
+
+    def run_section(parser):
+        if not should_proceed(tree, parser.datadic, parser.loop_vars,
+                              action_type='flow_action'):
+            return
+        parser.loop_vars['__ofs'] = parser.ofs
+        parser.datadic = open_section(section_varref, parser.datadic, parser.loop_vars)
+        if section_body is not None:
+            section_body(parser)
+        parser.datadic = close_section(section_varref, parser.datadic,
+                                       parser.loop_vars)
+
+    return run_section
+
+
+def compile_for_loop(tree, known_vars, loop_varnames):
+    for_head = get_child(tree, 'for_head')
+    varname = get_child_value(for_head, 'VARNAME')
+    start_expr = get_child(for_head, 'for_start')
+    stop_expr = get_child(for_head, 'for_stop')
+    # the variables bound in the body are not known after
+    # the loop because the body may not be executed at all
+    body_known_vars = known_vars | {(varname, None)}
+    for_body = compile_instruction(get_child(tree, 'for_body'),
+                                   body_known_vars,
+                                   loop_varnames + (varname,))
+
+    def run_for_loop(parser):
+        datadic = parser.datadic
+        loop_vars = parser.loop_vars
+        if not should_proceed(tree, datadic, loop_vars,
+                              action_type='flow_action'):
+            return
+        start, stop = get_loop_range(start_expr, stop_expr, datadic, loop_vars)
+        if varname in loop_vars:
+            raise LoopVariableError(
+                    f'The loop variable {varname} is already in use for another loop')
+        if trace_handlers:
+            trace_event('enter_loop', loop_type='for_loop', node=for_head,
+                        start=start, stop=stop)
+        if for_body is not None:
+            for i in range(start, stop+1):
+                loop_vars[varname] = i
+                for_body(parser)
+        # if we don't enter the loop, then
+        # the loop variable will not be set
+        # and consequently we don't have to delete it
+        if start <= stop and varname in loop_vars:
+            del(loop_vars[varname])
+        if trace_handlers:
+            trace_event('leave_loop', loop_type='for_loop', node=for_head,
+                        start=start, stop=stop)
+
+    return run_for_loop
+
+
+def compile_if_statement(tree, known_vars, loop_varnames):
+    if_head = get_child(tree, 'if_head')
+    lookahead_option = get_child(tree, 'lookahead_option', nofail=True)
+    if lookahead_option is not None:
+        lookahead_expr = get_child(lookahead_option, 'expr')
+    else:
+        lookahead_expr = None
+    return {'if_head': if_head,
+            'condition': compile_condition(get_child(if_head, 'disjunction')),
+            'lookahead_expr': lookahead_expr,
+            'if_body': compile_instruction(get_child(tree, 'if_body'),
+                                           known_vars, loop_varnames)}
+
+
+def compile_if_clause(tree, known_vars, loop_varnames):
+    # a variable is only known after the if clause
+    # if it is bound in all branches
+    branch_known_vars = []
+    if_statements = []
+    for t in tree.children:
+        if get_name(t, nofail=True) in ('if_statement', 'elif_statement'):
+            branch_known_vars.append(set(known_vars))
+            if_statements.append(compile_if_statement(
+                    t, branch_known_vars[-1], loop_varnames))
+    if_statements = tuple(if_statements)
+    else_statement = get_child(tree, 'else_statement', nofail=True)
+    if else_statement is not None:
+        branch_known_vars.append(set(known_vars))
+        else_body = compile_instruction(get_child(else_statement, 'if_body'),
+                                        branch_known_vars[-1], loop_varnames)
+        known_vars.update(set.intersection(*branch_known_vars))
+    else:
+        else_body = None
+
+    def run_if_clause(parser):
+        if not should_proceed(tree, parser.datadic, parser.loop_vars,
+                              action_type='flow_action'):
+            return
+
+        def run_body(body):
+            if body is not None:
+                body(parser)
+
+        evaluate_if_clause(if_statements, else_body, run_body,
+                           parser.datadic, parser.loop_vars,
+                           set_parser_state=parser.set_parser_state,
+                           get_parser_state=parser.get_parser_state,
+                           parse_opts=parser.parse_opts)
+
+    return run_if_clause
@@ -1,7 +1,7 @@
 from lark import Lark
 from .endf_lark import endf_recipe_grammar
 from .endf_recipes import endf_recipe_dictionary as recipe_dic
-from .tree_utils import is_tree
+from .tree_utils import is_tree, annotate_tree
 from hashlib import md5
 from appdirs import user_cache_dir
 import os
@@ -30,10 +30,20 @@ def get_recipe_parsetree(recipe, recipe_parser, grammar_hash):
     else:
         with open(filepath, 'rb') as fr:
             recipe_parsetree = pickle.load(fr)
-    return recipe_parsetree
+    # NOTE: the annotation must happen after pickling
+    #       so that it is not stored in the cache file
+    return annotate_tree(recipe_parsetree)
+
+
+# the parse trees are only created once per process
+# and shared by all parser instances. This also enables
+# the reuse of the plans compiled from the parse trees.
+recipe_parsetree_dic_cache = {}
 
 
 def get_recipe_parsetree_dic():
+    if 'tree_dic' in recipe_parsetree_dic_cache:
+        return recipe_parsetree_dic_cache['tree_dic']
     recipe_parser = get_recipe_parser(endf_recipe_grammar)
     grammar_hash = get_string_hash(endf_recipe_grammar)
     tree_dic = {}
@@ -49,6 +59,7 @@ def get_recipe_parsetree_dic():
                         get_recipe_parsetree(recipe_dic[mf][mt],
                                              recipe_parser,
                                              grammar_hash)
+    recipe_parsetree_dic_cache['tree_dic'] = tree_dic
     return tree_dic
 
 
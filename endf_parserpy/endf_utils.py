@@ -10,7 +10,14 @@
 ############################################################
 
 from .fortran_utils import (float2fortstr, fortstr2float,
-        read_fort_floats, write_fort_floats, read_fort_int)
+        read_fort_floats, write_fort_floats, read_fort_int,
+        read_fort_float_block, write_fort_float_block)
+from hashlib import md5
+# numpy is only needed for array_backend='numpy'
+try:
+    import numpy
+except ImportError:
+    numpy = None
 from .custom_exceptions import (
         NotSectionEndError,
         UnexpectedEndOfInputError,
@@ -18,7 +25,9 @@ from .custom_exceptions import (
     )
 
 
-def read_ctrl(line, nofail=False, **read_opts):
+def read_ctrl_fields(line, nofail=False, **read_opts):
+    # returns MAT, MF and MT as a tuple so that the fields can be
+    # assigned to a record dictionary without creating another one
     width = read_opts.get('width', 11)
     ofs = 6*width
     if nofail:
@@ -38,15 +47,20 @@ def read_ctrl(line, nofail=False, **read_opts):
         mat = int(matstr) if matstr != '' else 0
         mf = int(mfstr) if mfstr != '' else 0
         mt = int(mtstr) if mtstr != '' else 0
+    return mat, mf, mt
+
+def read_ctrl(line, nofail=False, **read_opts):
+    mat, mf, mt = read_ctrl_fields(line, nofail, **read_opts)
     return {'MAT': mat, 'MF': mf, 'MT': mt}
 
-def write_ctrl(dic, ns=None):
+def format_ctrl(mat, mf, mt, ns=None):
     nsstr = '' if not ns else str(ns).rjust(5)
-    return '{:>4}{:>2}{:>3}'.format(dic['MAT'], dic['MF'], dic['MT']) + nsstr
+    return '{:>4}{:>2}{:>3}'.format(mat, mf, mt) + nsstr
+
+def write_ctrl(dic, ns=None):
+    return format_ctrl(dic['MAT'], dic['MF'], dic['MT'], ns)
 
 def get_ctrl(dic, nofail=False):
-    while 'MAT' not in dic and '__up' in dic:
-        dic = dic['__up']
     if nofail:
         mat = 0 if 'MAT' not in dic else dic['MAT']
         mf = 0 if 'MF' not in dic else dic['MF']
@@ -57,14 +71,19 @@ def get_ctrl(dic, nofail=False):
         mt = dic['MT']
     return {'MAT': mat, 'MF': mf, 'MT': mt}
 
+def copy_ctrl(dic, srcdic):
+    # same as dic.update(get_ctrl(srcdic))
+    dic['MAT'] = srcdic['MAT']
+    dic['MF'] = srcdic['MF']
+    dic['MT'] = srcdic['MT']
+
 def read_text(lines, ofs=0, with_ctrl=True, **read_opts):
     width = read_opts.get('width', 11)
     ofs2 = width * 6
     line = lines[ofs]
     dic = {'HL': line[0:ofs2]}
     if with_ctrl:
-        ctrl = read_ctrl(line, **read_opts)
-        dic.update(ctrl)
+        dic['MAT'], dic['MF'], dic['MT'] = read_ctrl_fields(line, **read_opts)
     return dic, ofs+1
 
 def write_text(dic, with_ctrl=True, **write_opts):
@@ -81,8 +100,7 @@ def read_dir(lines, ofs=0, with_ctrl=True, blank_as_zero=False, **read_opts):
            'N1' : read_fort_int(line[4*width:5*width], blank_as_zero),
            'N2' : read_fort_int(line[5*width:6*width], blank_as_zero)}
     if with_ctrl:
-        ctrl = read_ctrl(line, **read_opts)
-        dic.update(ctrl)
+        dic['MAT'], dic['MF'], dic['MT'] = read_ctrl_fields(line, **read_opts)
     return dic, ofs+1
 
 def write_dir(dic, with_ctrl=True, **write_opts):
@@ -112,8 +130,7 @@ def read_intg(lines, ofs=0, with_ctrl=True, blank_as_zero=False,
            'KIJ': [read_fort_int(line[i:i+ndigit+1], blank_as_zero=blank_as_zero)
                    for i in range_iter]}
     if with_ctrl:
-        ctrl = read_ctrl(line, **read_opts)
-        dic.update(ctrl)
+        dic['MAT'], dic['MF'], dic['MT'] = read_ctrl_fields(line, **read_opts)
     return dic, ofs+1
 
 def write_intg(dic, with_ctrl=True, ndigit=None, **write_opts):
@@ -141,24 +158,29 @@ def read_cont(lines, ofs=0, with_ctrl=True, blank_as_zero=False, **read_opts):
            'N1' : read_fort_int(line[4*width:5*width], blank_as_zero),
            'N2' : read_fort_int(line[5*width:6*width], blank_as_zero)}
     if with_ctrl:
-        ctrl = read_ctrl(line, **read_opts)
-        dic.update(ctrl)
+        dic['MAT'], dic['MF'], dic['MT'] = read_ctrl_fields(line, **read_opts)
     return dic, ofs+1
 
-def write_cont(dic, with_ctrl=True, **write_opts):
+def format_cont(dic, N1, N2, with_ctrl=True, **write_opts):
+    # N1 and N2 are passed separately so that the TAB1, TAB2
+    # and LIST writers can insert the lengths of the tables
+    # without making a copy of the record dictionary
     width = write_opts.get('width', 11)
-    for varname in ('L1', 'L2', 'N1', 'N2'):
-        if not isinstance(dic[varname], int):
+    for varname, val in (('L1', dic['L1']), ('L2', dic['L2']),
+                         ('N1', N1), ('N2', N2)):
+        if not isinstance(val, int):
             raise InvalidIntegerError(
                     f'variable `{varname}` is not of type integer')
-    C1 = float2fortstr(dic['C1'], **write_opts)
-    C2 = float2fortstr(dic['C2'], **write_opts)
+    C1, C2 = write_fort_float_block((dic['C1'], dic['C2']), **write_opts)
     L1 = str(dic['L1']).rjust(width)
     L2 = str(dic['L2']).rjust(width)
-    N1 = str(dic['N1']).rjust(width)
-    N2 = str(dic['N2']).rjust(width)
+    N1 = str(N1).rjust(width)
+    N2 = str(N2).rjust(width)
     CTRL = write_ctrl(dic) if with_ctrl else ''
-    return [C1 + C2 + L1 + L2 + N1 + N2 + CTRL]
+    return C1 + C2 + L1 + L2 + N1 + N2 + CTRL
+
+def write_cont(dic, with_ctrl=True, **write_opts):
+    return [format_cont(dic, dic['N1'], dic['N2'], with_ctrl, **write_opts)]
 
 def prepare_zerostr_fields(zero_as_blank, **write_opts):
     width = write_opts.get('width', 11)
@@ -185,35 +207,28 @@ def read_send(lines, ofs=0, with_ctrl=True, blank_as_zero=False, **read_opts):
 def write_send(dic, with_ctrl=True, with_ns=True,
                zero_as_blank=False, **write_opts):
     C1, C2, L1, L2, N1, N2 = prepare_zerostr_fields(zero_as_blank, **write_opts)
-    ctrl_dic = get_ctrl(dic)
-    ctrl_dic['MT'] = 0
-    CTRL = write_ctrl(ctrl_dic) if with_ctrl else ''
+    CTRL = format_ctrl(dic['MAT'], dic['MF'], 0) if with_ctrl else ''
     NS = '99999' if with_ns else ''
     return [C1 + C2 + L1 + L2 + N1 + N2 + CTRL + NS]
 
 def write_fend(dic, with_ctrl=True, with_ns=True,
                zero_as_blank=False, **write_opts):
     C1, C2, L1, L2, N1, N2 = prepare_zerostr_fields(zero_as_blank, **write_opts)
-    ctrl_dic = get_ctrl(dic)
-    ctrl_dic['MF'] = 0
-    ctrl_dic['MT'] = 0
-    CTRL = write_ctrl(ctrl_dic) if with_ctrl else ''
+    CTRL = format_ctrl(dic['MAT'], 0, 0) if with_ctrl else ''
     NS = '0'.rjust(5) if with_ns else ''
     return [C1 + C2 + L1 + L2 + N1 + N2 + CTRL + NS]
 
 def write_mend(dic=None, with_ctrl=True, with_ns=True,
                zero_as_blank=False, **write_opts):
     C1, C2, L1, L2, N1, N2 = prepare_zerostr_fields(zero_as_blank, **write_opts)
-    ctrl_dic = {'MAT': 0, 'MF': 0, 'MT': 0}
-    CTRL = write_ctrl(ctrl_dic) if with_ctrl else ''
+    CTRL = format_ctrl(0, 0, 0) if with_ctrl else ''
     NS = '0'.rjust(5) if with_ns else ''
     return [C1 + C2 + L1 + L2 + N1 + N2 + CTRL + NS]
 
 def write_tend(dic=None, with_ctrl=True, with_ns=True,
                zero_as_blank=False, **write_opts):
     C1, C2, L1, L2, N1, N2 = prepare_zerostr_fields(zero_as_blank, **write_opts)
-    ctrl_dic = {'MAT': -1, 'MF': 0, 'MT': 0}
-    CTRL = write_ctrl(ctrl_dic) if with_ctrl else ''
+    CTRL = format_ctrl(-1, 0, 0) if with_ctrl else ''
     NS = '0'.rjust(5) if with_ns else ''
     return [C1 + C2 + L1 + L2 + N1 + N2 + CTRL + NS]
 
@@ -241,48 +256,64 @@ def read_list(lines, ofs=0, with_ctrl=True, callback=None,
 
 def write_list(dic, with_ctrl=True, **write_opts):
     NPL = len(dic['vals'])
-    tmpdic = dic.copy()
-    tmpdic['N1'] = NPL
     lines = write_cont(dic, with_ctrl, **write_opts)
     if NPL == 0:
-        body_lines = write_endf_numbers([0.0 for i in range(6)],
+        body_lines = write_endf_numbers([0.0]*6, **write_opts)
+    elif NPL % 6 != 0:
+        body_lines = write_endf_numbers(dic['vals'] + [0.0]*(6 - NPL % 6),
                                         **write_opts)
     else:
-        ext_vals = dic['vals'].copy()
-        if NPL % 6 != 0:
-            ext_vals += [0.0 for i in range(6 - NPL % 6)]
-        body_lines = write_endf_numbers(ext_vals, **write_opts)
+        body_lines = write_endf_numbers(dic['vals'], **write_opts)
     if with_ctrl:
         ctrl = write_ctrl(dic)
         body_lines = [t + ctrl for t in body_lines]
     lines += body_lines
     return lines
 
+def check_array_backend(array_backend):
+    if array_backend not in (None, 'numpy'):
+        raise ValueError(f'unknown array backend {array_backend}')
+    if array_backend == 'numpy' and numpy is None:
+        raise ImportError('the package numpy is required '
+                          'for array_backend=\'numpy\'')
+
+def to_table_array(vals, to_int=False, **read_opts):
+    # the columns of TAB1 and TAB2 records are stored as contiguous
+    # arrays with array_backend='numpy' and as lists otherwise
+    if read_opts.get('array_backend', None) != 'numpy':
+        return vals
+    # integers are expected but read_endf_numbers keeps
+    # the floats if not all numbers are integers
+    if to_int and all(type(v) is int for v in vals):
+        return numpy.array(vals, dtype=numpy.int32)
+    return numpy.array(vals, dtype=numpy.float64)
+
+def to_list(vals):
+    # the conversion of arrays to lists of Python numbers
+    # ensures the same output as for lists
+    if hasattr(vals, 'tolist'):
+        return vals.tolist()
+    return vals
+
 def read_tab2(lines, ofs=0, with_ctrl=True,
               blank_as_zero=False, **read_opts):
-    startline = lines[ofs]
-    dic, ofs = read_cont(lines, ofs, blank_as_zero=blank_as_zero,
+    dic, ofs = read_cont(lines, ofs, with_ctrl, blank_as_zero=blank_as_zero,
                          **read_opts)
     vals, ofs = read_endf_numbers(lines, 2*dic['N1'], ofs, to_int=True,
                                   blank_as_zero=blank_as_zero,
                                   **read_opts)
-    NBT = vals[::2]
-    INT = vals[1::2]
+    NBT = to_table_array(vals[::2], to_int=True, **read_opts)
+    INT = to_table_array(vals[1::2], to_int=True, **read_opts)
     dic['table'] = {'NBT': NBT, 'INT': INT}
-    if with_ctrl:
-        ctrl = read_ctrl(startline, **read_opts)
-        dic.update(ctrl)
     return dic, ofs
 
 def write_tab2(dic, with_ctrl=True, **write_opts):
-    dic = dic.copy()
     tbl_dic = dic['table']
-    NBT = tbl_dic['NBT']
-    INT = tbl_dic['INT']
+    NBT = to_list(tbl_dic['NBT'])
+    INT = to_list(tbl_dic['INT'])
     if len(NBT) != len(INT):
         raise ValueError('NBT and INT must be of same length')
-    dic.update({'N1': len(NBT)})
-    lines = write_cont(dic, with_ctrl, **write_opts)
+    lines = [format_cont(dic, len(NBT), dic['N2'], with_ctrl, **write_opts)]
     vals = [None]*(2*len(NBT))
     vals[::2] = NBT
     vals[1::2] = INT
@@ -294,24 +325,18 @@ def write_tab2(dic, with_ctrl=True, **write_opts):
 
 def read_tab1(lines, ofs=0, with_ctrl=True, blank_as_zero=False,
               **read_opts):
-    startline = lines[ofs]
     dic, ofs = read_cont(lines, ofs, with_ctrl,
                          blank_as_zero=blank_as_zero, **read_opts)
     tbl_dic, ofs = read_tab1_body_lines(lines, ofs, dic['N1'], dic['N2'],
                                         blank_as_zero=blank_as_zero,
                                         **read_opts)
     dic['table'] = tbl_dic
-    if with_ctrl:
-        ctrl = read_ctrl(startline, **read_opts)
-        dic.update(ctrl)
     return dic, ofs
 
 def write_tab1(dic, with_ctrl=True, **write_opts):
-    dic = dic.copy()
     tbl_dic = dic['table']
-    dic.update({'N1': len(tbl_dic['NBT']),
-                'N2': len(tbl_dic['X'])})
-    lines = write_cont(dic, with_ctrl, **write_opts)
+    lines = [format_cont(dic, len(tbl_dic['NBT']), len(tbl_dic['X']),
+                         with_ctrl, **write_opts)]
     tbl_lines = write_tab1_body_lines(
             tbl_dic['NBT'], tbl_dic['INT'],
             tbl_dic['X'], tbl_dic['Y'], **write_opts)
@@ -325,16 +350,17 @@ def read_tab1_body_lines(lines, ofs, nr, np, blank_as_zero=False,
     vals, ofs = read_endf_numbers(lines, 2*nr, ofs, to_int=True,
                                   blank_as_zero=blank_as_zero,
                                   **read_opts)
-    NBT = vals[::2]
-    INT = vals[1::2]
+    NBT = to_table_array(vals[::2], to_int=True, **read_opts)
+    INT = to_table_array(vals[1::2], to_int=True, **read_opts)
     vals, ofs = read_endf_numbers(lines, 2*np, ofs, to_int=False,
                                   blank_as_zero=blank_as_zero,
                                   **read_opts)
-    xvals = vals[::2]
-    yvals = vals[1::2]
+    xvals = to_table_array(vals[::2], **read_opts)
+    yvals = to_table_array(vals[1::2], **read_opts)
     return {'NBT': NBT, 'INT': INT, 'X': xvals,'Y':  yvals}, ofs
 
 def write_tab1_body_lines(NBT, INT, xvals, yvals, **write_opts):
+    NBT, INT, xvals, yvals = (to_list(v) for v in (NBT, INT, xvals, yvals))
     assert len(NBT) == len(INT)
     assert len(xvals) == len(yvals)
     vals = [None]*(2*len(NBT))
@@ -349,15 +375,9 @@ def write_tab1_body_lines(NBT, INT, xvals, yvals, **write_opts):
 
 def read_endf_numbers(lines, num, ofs, to_int=False,
                       blank_as_zero=False, **read_opts):
-    vals = []
     blank_symb = 0. if blank_as_zero else None
-    while num > 0:
-        l = lines[ofs]
-        m = min(6, num)
-        vals += read_fort_floats(l, m, blank=blank_symb,
-                                 **read_opts)
-        num -= 6
-        ofs += 1
+    vals, ofs = read_fort_float_block(lines, num, ofs, blank=blank_symb,
+                                      **read_opts)
     if to_int:
         try:
             vals = [int(v) for v in vals]
@@ -368,13 +388,11 @@ def read_endf_numbers(lines, num, ofs, to_int=False,
 
 def write_endf_numbers(vals, to_int=False, **write_opts):
     width = write_opts.get('width', 11)
-    lines = []
-    for i in range(0, len(vals), 6):
-        m = min(i+6, len(vals))
-        if to_int:
-            lines.append(''.join([str(v).rjust(width) for v in vals[i:m]]))
-        else:
-            lines.append(write_fort_floats(vals[i:m], **write_opts))
+    if to_int:
+        fields = [str(v).rjust(width) for v in vals]
+    else:
+        fields = write_fort_float_block(vals, **write_opts)
+    lines = [''.join(fields[i:i+6]) for i in range(0, len(fields), 6)]
     lines[-1] = lines[-1].ljust(width*6)
     return lines
 
@@ -393,14 +411,54 @@ def skip_blank_lines(lines, ofs):
                     'expected input but consumed all lines')
     return ofs
 
+def get_section_hashes(mfmt_dic):
+    # the hashes of the lines of the MF/MT sections
+    # returned by split_sections to detect changes.
+    # lines read from a file and lines created in memory
+    # are terminated in the same way before hashing
+    hashes = {}
+    for mf in mfmt_dic:
+        for mt in mfmt_dic[mf]:
+            hasher = md5()
+            for line in mfmt_dic[mf][mt]:
+                hasher.update(line.rstrip('\r\n').encode() + b'\n')
+            hashes[(mf, mt)] = hasher.hexdigest()
+    return hashes
+
+def iter_section_lines(lines, **read_opts):
+    # yields MAT, MF, MT and the lines of each section as soon
+    # as the section is complete. The lines can be provided by
+    # a file object so that only one section is held in memory.
+    # The lines are selected in the same way as by split_sections
+    # but sections of different materials are not merged.
+    curkey = None
+    curlines = []
+    is_first = True
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode()
+        if is_blank_line(line):
+            continue
+        key = read_ctrl_fields(line, nofail=True, **read_opts)
+        mf, mt = key[1:]
+        if key != curkey and curlines:
+            yield curkey + (curlines,)
+            curlines = []
+            curkey = None
+        # the tape head line is only expected at the beginning
+        if (mf != 0 and mt != 0) or (mf == 0 and mt == 0 and is_first):
+            curkey = key
+            curlines.append(line)
+        is_first = False
+    if curlines:
+        yield curkey + (curlines,)
+
 def split_sections(lines, **read_opts):
     mfdic = {}
     for line in lines:
         if is_blank_line(line):
             continue
-        dic = read_ctrl(line, nofail=True, **read_opts)
-        mf = dic['MF']
-        mt = dic['MT']
+        mat, mf, mt = read_ctrl_fields(line, nofail=True, **read_opts)
         # end markers (SEND, MEND, FEND, TEND) ignored
         # but: if the dictionary is empty and we get
         # mf=0 and mt=0, we assume it is the tape head
@@ -409,7 +467,6 @@ def split_sections(lines, **read_opts):
                 (mf == 0 and mt == 0 and not mfdic)):
             mfdic.setdefault(mf, {})
             mtdic = mfdic[mf]
-            mt = dic['MT']
             mtdic.setdefault(mt, [])
             mtdic[mt].append(line)
     return mfdic
@@ -11,13 +11,24 @@
 
 import traceback
 from .tree_utils import (get_child, get_child_value, get_name,
-        get_child_names, reconstruct_tree_str)
+        get_child_names)
 from .endf_mapping_utils import (
-        get_varname, eval_expr, eval_expr_without_unknown_var
+        eval_expr_without_unknown_var, get_compiled_expr
     )
-from .logging_utils import write_info
-from .custom_exceptions import LoopVariableError
-from copy import deepcopy
+from .logging_utils import trace_handlers, trace_event
+from .custom_exceptions import LoopVariableError, VariableNotFoundError
+from .overlay_utils import OverlayDict
+import operator
+
+
+def get_loop_range(start_expr, stop_expr, datadic, loop_vars):
+    start = eval_expr_without_unknown_var(start_expr, datadic, loop_vars)
+    stop = eval_expr_without_unknown_var(stop_expr, datadic, loop_vars)
+    if float(start) != int(start):
+        raise LoopVariableError('Loop start index must evaluate to an integer')
+    if float(stop) != int(stop):
+        raise LoopVariableError('Loop stop index must evaluate to an integer')
+    return int(start), int(stop)
 
 
 def cycle_for_loop(tree, tree_handler, datadic, loop_vars,
@@ -28,21 +39,14 @@ def cycle_for_loop(tree, tree_handler, datadic, loop_vars,
     # determine range for loop counter
     start_expr = get_child(for_head, 'for_start')
     stop_expr = get_child(for_head, 'for_stop')
-    start = eval_expr_without_unknown_var(start_expr, datadic, loop_vars)
-    stop = eval_expr_without_unknown_var(stop_expr, datadic, loop_vars)
-    if float(start) != int(start):
-        raise LoopVariableError('Loop start index must evaluate to an integer')
-    if float(stop) != int(stop):
-        raise LoopVariableError('Loop stop index must evaluate to an integer')
-
-    start = int(start)
-    stop = int(stop)
+    start, stop = get_loop_range(start_expr, stop_expr, datadic, loop_vars)
     for_body = get_child(tree, body_name)
     if varname in loop_vars:
         raise LoopVariableError(
                 f'The loop variable {varname} is already in use for another loop')
-    write_info(f'Enter for loop (type {loop_name}) ' + reconstruct_tree_str(for_head) +
-               f' (for_start: {start} and for_stop {stop})')
+    if trace_handlers:
+        trace_event('enter_loop', loop_type=loop_name, node=for_head,
+                    start=start, stop=stop)
     for i in range(start, stop+1):
         loop_vars[varname] = i
         tree_handler(for_body)
@@ -51,33 +55,53 @@ def cycle_for_loop(tree, tree_handler, datadic, loop_vars,
     # and consequently we don't have to delete it
     if start <= stop:
         del(loop_vars[varname])
-    write_info(f'Leave for loop (type {loop_name}) ' + reconstruct_tree_str(for_head) +
-               f' (for_start: {start} and for_stop: {stop})')
+    if trace_handlers:
+        trace_event('leave_loop', loop_type=loop_name, node=for_head,
+                    start=start, stop=stop)
 
-def eval_if_condition(if_condition, datadic, loop_vars):
+comparison_operators = {
+        '>': operator.gt,
+        '<': operator.lt,
+        '<=': operator.le,
+        '>=': operator.ge,
+        '!=': operator.ne,
+        '==': operator.eq
+    }
+
+def compile_if_condition(if_condition):
     if len(if_condition.children) != 3:
         raise IndexError('if_condition must have three children')
-    write_info('Dealing with the if_condition ' + reconstruct_tree_str(if_condition))
     left_expr = if_condition.children[0]
     cmpop = get_child_value(if_condition, 'IF_RELATION')
+    cmpfun = comparison_operators[cmpop]
     right_expr = if_condition.children[2]
-    left_val = eval_expr_without_unknown_var(left_expr, datadic, loop_vars)
-    right_val = eval_expr_without_unknown_var(right_expr, datadic, loop_vars)
-    write_info(f'Left side evaluates to {left_val} and right side to {right_val}')
-    if ((cmpop == ">" and left_val > right_val) or
-        (cmpop == "<" and left_val < right_val) or
-        (cmpop =="<=" and left_val <= right_val) or
-        (cmpop ==">=" and left_val >= right_val) or
-        (cmpop =="!=" and left_val != right_val) or
-        (cmpop =="==" and left_val == right_val)):
-        return True
-    else:
-        return False
+    left_fun = get_compiled_expr(left_expr)
+    right_fun = get_compiled_expr(right_expr)
 
-def determine_truthvalue(node, datadic, loop_vars):
+    def eval_if_condition(datadic, loop_vars):
+        left_val = get_known_value(left_fun(datadic, loop_vars, True))
+        right_val = get_known_value(right_fun(datadic, loop_vars, True))
+        if trace_handlers:
+            trace_event('if_condition', node=if_condition,
+                        left=left_val, right=right_val)
+        return cmpfun(left_val, right_val)
+
+    return eval_if_condition
+
+def get_known_value(expr_vv):
+    # same check as in eval_expr_without_unknown_var
+    if expr_vv[1] != 0:
+        unknown_varname = expr_vv[2][0]
+        raise VariableNotFoundError(
+                f'Unknown variable in expression ({unknown_varname})')
+    return expr_vv[0]
+
+def compile_condition(node):
+    # translate a boolean expression into a function
+    # that takes datadic and loop_vars as arguments
     name = get_name(node)
     if name == 'if_condition':
-        return eval_if_condition(node, datadic, loop_vars)
+        return compile_if_condition(node)
     elif name == 'comparison':
         # we strip away brackets because the information they
         # encode has already been considered in the tree generation process,
@@ -89,74 +113,79 @@ def determine_truthvalue(node, datadic, loop_vars):
         ch = trimmed_children[0]
         if get_name(ch) not in ('if_condition', 'disjunction'):
             raise ValueError('Child node must be either "if_condition" or "disjunction"')
-        return determine_truthvalue(ch, datadic, loop_vars)
+        return compile_condition(ch)
     elif name == 'conjunction':
-        # the following code is a bit messy because of the order of
-        # conjunction and comparison in the "conjunction" rule and
-        # that we want to avoid unnecessary evaluations of boolean expressions
+        # we want to avoid unnecessary evaluations of boolean expressions
         conj = get_child(node, 'conjunction', nofail=True)
-        comp = get_child(node, 'comparison')
-        if conj is not None:
-            conj_truthval = determine_truthvalue(conj, datadic, loop_vars)
-            if conj_truthval is False:
-                return False
-        comp_truthval = determine_truthvalue(comp, datadic, loop_vars)
+        comp = compile_condition(get_child(node, 'comparison'))
         if conj is None:
-            return comp_truthval
-        else:
-            return conj_truthval and comp_truthval
+            return comp
+        conj = compile_condition(conj)
+
+        def eval_conjunction(datadic, loop_vars):
+            return conj(datadic, loop_vars) and comp(datadic, loop_vars)
+
+        return eval_conjunction
     elif name == 'disjunction':
         disj = get_child(node, 'disjunction', nofail=True)
-        conj = get_child(node, 'conjunction')
-        if disj is not None:
-            disj_truthval = determine_truthvalue(disj, datadic, loop_vars)
-            if disj_truthval is True:
-                return True
-        conj_truthval = determine_truthvalue(conj, datadic, loop_vars)
+        conj = compile_condition(get_child(node, 'conjunction'))
         if disj is None:
-            return conj_truthval
-        else:
-            return disj_truthval or conj_truthval
+            return conj
+        disj = compile_condition(disj)
+
+        def eval_disjunction(datadic, loop_vars):
+            return disj(datadic, loop_vars) or conj(datadic, loop_vars)
+
+        return eval_disjunction
     else:
         raise TypeError(f'Unsupported node type {name} encountered ' +
                          'while parsing boolean expression')
 
 
-def evaluate_if_clause(tree, tree_handler, datadic, loop_vars,
+def evaluate_if_clause(if_statements, else_body, body_handler, datadic, loop_vars,
                        set_parser_state, get_parser_state, parse_opts=None):
-    chnames = get_child_names(tree)
-    assert chnames[0] == 'if_statement'
-    truthval = evaluate_if_statement(tree.children[0], tree_handler, datadic, loop_vars,
-                                     set_parser_state, get_parser_state, parse_opts=parse_opts)
-    if truthval is True:
-        return
-    else:
-        elif_tree_list = [t for t in tree.children if get_name(t) == 'elif_statement']
-        for elif_tree in elif_tree_list:
-            truthval = evaluate_if_statement(elif_tree, tree_handler, datadic, loop_vars,
-                                             set_parser_state, get_parser_state, parse_opts=parse_opts)
-            if truthval is True:
-                return
-
-        if 'else_statement' in chnames:
-            else_tree = get_child(tree, 'else_statement')
-            if_body = get_child(else_tree, 'if_body')
-            tree_handler(if_body)
+    # if_statements contains the if statement and
+    # all elif statements in the order of appearance
+    for if_statement in if_statements:
+        truthval = evaluate_if_statement(if_statement, body_handler, datadic, loop_vars,
+                                         set_parser_state, get_parser_state, parse_opts=parse_opts)
+        if truthval is True:
             return
 
+    if else_body is not None:
+        body_handler(else_body)
+
+
+def create_lookahead_state(parser_state):
+    # all modifications of datadic during the lookahead are
+    # recorded in an overlay. The offset, the number of lines
+    # and the position in the record log are remembered so that
+    # the lookahead can be undone by restore_parser_state
+    # without copying the parser state
+    lookahead_state = parser_state.copy()
+    lookahead_state['datadic'] = OverlayDict(parser_state['datadic'])
+    lookahead_state['loop_vars'] = parser_state['loop_vars'].copy()
+    lookahead_state['loop_vars']['__scopes'] = parser_state['loop_vars']['__scopes'].copy()
+    lookahead_state['numlines'] = len(parser_state['lines'])
+    return lookahead_state
 
-def evaluate_if_statement(tree, tree_handler, datadic, loop_vars,
+def restore_parser_state(parser_state, lookahead_state, set_parser_state):
+    # lines added in write mode during the lookahead are removed
+    set_parser_state(parser_state)
+    del parser_state['lines'][lookahead_state['numlines']:]
+
+def evaluate_if_statement(if_statement, body_handler, datadic, loop_vars,
                           set_parser_state, get_parser_state, parse_opts=None):
     parse_opts = parse_opts if parse_opts is not None else {}
     log_lookahead_traceback = parse_opts.get('log_lookahead_traceback', True)
-    assert tree.data in ('if_statement', 'elif_statement', 'else_statement')
-    if_head = get_child(tree, 'if_head')
-    if_body = get_child(tree, 'if_body')
-    lookahead_option = get_child(tree, 'lookahead_option', nofail=True)
+    if_head = if_statement['if_head']
+    if_body = if_statement['if_body']
+    lookahead_expr = if_statement['lookahead_expr']
+    lookahead_option = lookahead_expr is not None
     lookahead = 0
     if lookahead_option:
-        write_info('Start lookahead for if head ' + reconstruct_tree_str(if_head))
-        lookahead_expr = get_child(lookahead_option, 'expr')
+        if trace_handlers:
+            trace_event('start_lookahead', node=if_head)
         lookahead = eval_expr_without_unknown_var(lookahead_expr, datadic, loop_vars)
         if int(lookahead) != lookahead:
             raise ValueError( 'lookahead argument must evaluate to an integer' +
@@ -172,29 +201,31 @@ def evaluate_if_statement(tree, tree_handler, datadic, loop_vars,
         # we want to save the state of the parser
         # before the lookahead to rewind it afterwards
         parser_state = get_parser_state()
-        new_parser_state = deepcopy(parser_state)
+        new_parser_state = create_lookahead_state(parser_state)
         set_parser_state(new_parser_state)
         datadic = new_parser_state['datadic']
         loop_vars = new_parser_state['loop_vars']
 
         loop_vars['__lookahead'] = lookahead
         try:
-            tree_handler(if_body)
+            body_handler(if_body)
         except:
             # we accept parsing failure
             # during lookahead, but print
             # the traceback for diagnostics
             if log_lookahead_traceback:
-                write_info('Printing the stacktrace due to failure in lookahead...')
+                if trace_handlers:
+                    trace_event('lookahead_failure', node=if_head)
                 traceback.print_exc()
         del(loop_vars['__lookahead'])
 
     # evaluate the condition (with variables in datadic potentially
     # affected by the lookahead)
-    write_info('Evaluate if head ' + reconstruct_tree_str(if_head))
-    disj = get_child(if_head, 'disjunction')
+    if trace_handlers:
+        trace_event('evaluate_if_head', node=if_head)
+    condition = if_statement['condition']
     try:
-        truthval = determine_truthvalue(disj, datadic, loop_vars)
+        truthval = condition(datadic, loop_vars)
     except Exception as exc:
         # TODO: Improve the error handling. Ideally, we only want
         #       to assign the value False if any variable name
@@ -202,27 +233,27 @@ def evaluate_if_statement(tree, tree_handler, datadic, loop_vars,
         #       let this function fail.
         if lookahead_option:
             if log_lookahead_traceback:
-                write_info('Printing the stacktrace due to failure in determination of if condition after lookahead...')
+                if trace_handlers:
+                    trace_event('condition_failure', node=if_head)
                 traceback.print_exc()
         else:
             traceback.print_exc()
             raise exc
 
         truthval = False
+    if lookahead_option:
+        restore_parser_state(parser_state, new_parser_state, set_parser_state)
+        datadic = parser_state['datadic']
+        loop_vars = parser_state['loop_vars']
     if truthval:
-        write_info('Enter if body because ' + reconstruct_tree_str(if_head) + ' is true')
-        if lookahead_option:
-            set_parser_state(parser_state)
-            datadic = parser_state['datadic']
-            loop_vars = parser_state['loop_vars']
-        tree_handler(if_body)
-        write_info('Leave if body of if condition ' + reconstruct_tree_str(if_head))
+        if trace_handlers:
+            trace_event('enter_if_body', node=if_head)
+        body_handler(if_body)
+        if trace_handlers:
+            trace_event('leave_if_body', node=if_head)
     else:
-        if lookahead_option:
-            set_parser_state(parser_state)
-            datadic = parser_state['datadic']
-            loop_vars = parser_state['loop_vars']
-        write_info('Skip if body because if condition ' + reconstruct_tree_str(if_head) + ' is false')
+        if trace_handlers:
+            trace_event('skip_if_body', node=if_head)
 
     return truthval
 
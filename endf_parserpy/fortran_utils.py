@@ -14,6 +14,7 @@ from .custom_exceptions import (
         InvalidFloatError
     )
 from math import log10, floor
+import re
 
 
 def read_fort_int(valstr, blank_as_zero=False):
@@ -26,23 +27,66 @@ def read_fort_int(valstr, blank_as_zero=False):
             raise InvalidIntegerError(valerr)
 
 
+# matches the sign of the exponent in Fortran numbers
+# without exponent symbol, e.g., in 1.234567+5
+implicit_exponent_regex = re.compile('(?<=[0-9])[+-]')
+
+
 def fortstr2float(valstr, blank=None, **read_opts):
     accept_spaces = read_opts.get('accept_spaces', True)
     if valstr.strip() == '' and blank is not None:
         return blank
     if accept_spaces:
         valstr = valstr.replace(' ', '')
-    digitchars = tuple(str(i) for i in range(10))
-    for i, c in enumerate(valstr):
-        if i>0 and (c == '+' or c == '-'):
-            if valstr[i-1] in digitchars:
-                return float(valstr[:i] + 'E' + valstr[i:])
+    expsign = implicit_exponent_regex.search(valstr)
+    if expsign is not None:
+        i = expsign.start()
+        return float(valstr[:i] + 'E' + valstr[i:])
     try:
         return float(valstr)
     except ValueError as valerr:
         raise InvalidFloatError(valerr)
 
 
+# the values of field strings already converted, one dictionary
+# for accept_spaces=True and one for accept_spaces=False.
+# ENDF files contain many repeated numbers, such as 0.000000+0.
+fort_float_caches = {True: {}, False: {}}
+fort_float_cache_size = 100000
+
+
+def read_fort_float_block(lines, num, ofs=0, blank=None, **read_opts):
+    # read num numbers from consecutive lines with
+    # six fields per line starting at line ofs.
+    # The result is the same as of read_fort_floats
+    # applied to each line with at most six fields.
+    accept_spaces = bool(read_opts.get('accept_spaces', True))
+    width = read_opts.get('width', 11)
+    cache = fort_float_caches[accept_spaces]
+    if len(cache) > fort_float_cache_size:
+        cache.clear()
+    blank_field = ' '*width
+    vals = []
+    while num > 0:
+        line = lines[ofs]
+        assert isinstance(line, str)
+        for i in range(0, min(6, num)*width, width):
+            field = line[i:i+width]
+            val = cache.get(field, None)
+            if val is None:
+                if field == blank_field:
+                    if blank is None:
+                        raise ValueError('blank encountered but blank=None')
+                    vals.append(blank)
+                    continue
+                val = fortstr2float(field, accept_spaces=accept_spaces)
+                cache[field] = val
+            vals.append(val)
+        num -= 6
+        ofs += 1
+    return vals, ofs
+
+
 def float2basicnumstr(val, **write_opts):
     width = write_opts.get('width', 11)
     effwidth = width
@@ -149,6 +193,8 @@ def float2fortstr(val, **write_opts):
 
 
 def read_fort_floats(line, n=6, blank=None, **read_opts):
+    # all n fields are read from the given line, whereas
+    # read_fort_float_block continues on the next line after six fields
     accept_spaces = read_opts.get('accept_spaces', True)
     width = read_opts.get('width', 11)
     assert isinstance(line, str)
@@ -165,8 +211,34 @@ def read_fort_floats(line, n=6, blank=None, **read_opts):
     return vals
 
 
+# the formatted field strings of floats already converted,
+# one dictionary for each combination of write options
+fort_str_caches = {}
+fort_str_cache_size = 100000
+
+
+def write_fort_float_block(vals, **write_opts):
+    # convert all values to fields of the ENDF format at once.
+    # The fields are the same as produced by float2fortstr.
+    # Only values of type float are memoized because, e.g.,
+    # float2fortstr(10**17-1) and float2fortstr(1e17) differ.
+    optkey = tuple(sorted(write_opts.items()))
+    cache = fort_str_caches.get(optkey, None)
+    if cache is None or len(cache) > fort_str_cache_size:
+        cache = {}
+        fort_str_caches[optkey] = cache
+    fields = []
+    for v in vals:
+        if type(v) is not float:
+            fields.append(float2fortstr(v, **write_opts))
+            continue
+        valstr = cache.get(v, None)
+        if valstr is None:
+            valstr = float2fortstr(v, **write_opts)
+            cache[v] = valstr
+        fields.append(valstr)
+    return fields
+
+
 def write_fort_floats(vals, **write_opts):
-    line = ''
-    for i, v in enumerate(vals):
-        line += float2fortstr(v, **write_opts)
-    return line
+    return ''.join(write_fort_float_block(vals, **write_opts))
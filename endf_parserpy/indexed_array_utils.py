@@ -0,0 +1,175 @@
+############################################################
+#
+# Author(s):       Georg Schnabel
+# Email:           g.schnabel@iaea.org
+# Creation date:   2023/04/05
+# Last modified:   2023/04/05
+# License:         MIT
+# Copyright (c) 2023 International Atomic Energy Agency (IAEA)
+#
+############################################################
+
+# An indexed array stores the values of an indexed variable,
+# such as ER[k], with contiguous integer indices in a typed
+# array instead of a dictionary. It can be accessed like a
+# dictionary mapping the indices to the values. Assigning a value
+# that does not fit into the array, e.g., a value of another type
+# or at an index not adjacent to the others, moves all values
+# into a dictionary that is used from then on.
+
+from array import array
+from collections.abc import MutableMapping
+
+
+indexed_array_typecodes = {float: 'd', int: 'q'}
+
+
+class IndexedArray(MutableMapping):
+
+    __slots__ = ('_start', '_vals', '_dic')
+
+    def __init__(self, start, vals):
+        self._start = start
+        self._vals = vals
+        self._dic = None
+
+    def _index(self, key):
+        # position of key in the typed array or -1 if not present
+        if type(key) is int:
+            pos = key - self._start
+            if 0 <= pos < len(self._vals):
+                return pos
+        return -1
+
+    def _fits(self, val):
+        return indexed_array_typecodes.get(type(val), None) == \
+            self._vals.typecode
+
+    def _to_dict(self):
+        self._dic = dict(self.items())
+        self._vals = None
+
+    def is_dense(self):
+        return self._vals is not None
+
+    def get_typed_array(self):
+        # the values in the order of the indices
+        # or None if they are in a dictionary
+        return self._vals
+
+    def __len__(self):
+        if self._vals is None:
+            return len(self._dic)
+        return len(self._vals)
+
+    def __iter__(self):
+        if self._vals is None:
+            return iter(self._dic)
+        return iter(range(self._start, self._start + len(self._vals)))
+
+    def __reversed__(self):
+        if self._vals is None:
+            return reversed(self._dic)
+        return reversed(range(self._start, self._start + len(self._vals)))
+
+    def __contains__(self, key):
+        if self._vals is None:
+            return key in self._dic
+        return self._index(key) >= 0
+
+    def __getitem__(self, key):
+        if self._vals is None:
+            return self._dic[key]
+        pos = self._index(key)
+        if pos < 0:
+            raise KeyError(key)
+        return self._vals[pos]
+
+    def __setitem__(self, key, val):
+        if self._vals is not None and self._fits(val):
+            pos = self._index(key)
+            try:
+                if pos >= 0:
+                    self._vals[pos] = val
+                    return
+                elif key == self._start + len(self._vals) and \
+                        type(key) is int:
+                    self._vals.append(val)
+                    return
+            except OverflowError:
+                pass
+        if self._vals is not None:
+            self._to_dict()
+        self._dic[key] = val
+
+    def __delitem__(self, key):
+        if self._vals is not None:
+            # only the last value can be removed without
+            # leaving a gap in the indices
+            if len(self._vals) > 0 and \
+                    self._index(key) == len(self._vals) - 1:
+                self._vals.pop()
+                return
+            self._to_dict()
+        del self._dic[key]
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    # copies, e.g., by deepcopy or pickle, keep the typed array
+    def __reduce__(self):
+        if self._vals is None:
+            return (dict, (self._dic,))
+        return (IndexedArray, (self._start, self._vals))
+
+    def popitem(self):
+        # the last item is removed like for a dictionary
+        if len(self) == 0:
+            raise KeyError('popitem(): dictionary is empty')
+        key = next(reversed(self))
+        return key, self.pop(key)
+
+    def copy(self):
+        if self._vals is None:
+            return self._dic.copy()
+        return IndexedArray(self._start, array(self._vals.typecode,
+                                                self._vals))
+
+
+def to_indexed_array(dic):
+    # returns an indexed array if the keys are contiguous integers
+    # in ascending order and the values are either all floats or
+    # all integers, otherwise None
+    if len(dic) == 0:
+        return None
+    keyit = iter(dic)
+    start = next(keyit)
+    if type(start) is not int:
+        return None
+    for i, key in enumerate(keyit, start+1):
+        if key != i or type(key) is not int:
+            return None
+    vals = dic.values()
+    valtype = type(next(iter(vals)))
+    typecode = indexed_array_typecodes.get(valtype, None)
+    if typecode is None:
+        return None
+    if not all(type(v) is valtype for v in vals):
+        return None
+    try:
+        return IndexedArray(start, array(typecode, vals))
+    except OverflowError:
+        return None
+
+
+def compact_indexed_values(datadic):
+    # replaces the dictionaries of indexed variables in datadic
+    # by indexed arrays wherever possible
+    for key, val in datadic.items():
+        if type(val) is dict:
+            arr = to_indexed_array(val)
+            if arr is not None:
+                datadic[key] = arr
+            else:
+                compact_indexed_values(val)
+    return datadic
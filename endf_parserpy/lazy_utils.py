@@ -0,0 +1,82 @@
+############################################################
+#
+# Author(s):       Georg Schnabel
+# Email:           g.schnabel@iaea.org
+# Creation date:   2023/03/22
+# Last modified:   2023/03/22
+# License:         MIT
+# Copyright (c) 2023 International Atomic Energy Agency (IAEA)
+#
+############################################################
+
+# A lazy dictionary stores raw values, e.g., the lines of
+# MF/MT sections, and converts them with a loader function
+# the first time they are accessed. The converted value
+# replaces the raw value so that the conversion happens only once.
+# Assigning a new value to a key discards a pending conversion.
+# The raw values are kept in a separate dictionary and not in a
+# dict subclass, because dict(...) and {**...} would copy them
+# directly from the storage of a dict subclass without the loader.
+
+from collections.abc import MutableMapping
+
+
+class LazyDict(MutableMapping):
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._dic = {}
+        self._pending = set()
+
+    def set_lazy(self, key, rawval):
+        self._dic[key] = rawval
+        self._pending.add(key)
+
+    def is_loaded(self, key):
+        return key not in self._pending
+
+    def __len__(self):
+        return len(self._dic)
+
+    def __iter__(self):
+        return iter(self._dic)
+
+    def __reversed__(self):
+        return reversed(tuple(self._dic))
+
+    def __contains__(self, key):
+        return key in self._dic
+
+    def __getitem__(self, key):
+        val = self._dic[key]
+        if key in self._pending:
+            val = self._loader(key, val)
+            self._dic[key] = val
+            self._pending.discard(key)
+        return val
+
+    def __setitem__(self, key, val):
+        self._pending.discard(key)
+        self._dic[key] = val
+
+    def __delitem__(self, key):
+        del self._dic[key]
+        self._pending.discard(key)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    # copies, e.g., by deepcopy or pickle, are ordinary
+    # dictionaries with all values converted
+    def __reduce__(self):
+        return (dict, (dict(self.items()),))
+
+    def popitem(self):
+        # the last item is removed like for a dictionary
+        if len(self) == 0:
+            raise KeyError('popitem(): dictionary is empty')
+        key = next(reversed(self))
+        return key, self.pop(key)
+
+    def copy(self):
+        return dict(self.items())
@@ -10,13 +10,89 @@
 ############################################################
 
 import logging
-from .tree_utils import reconstruct_tree_str
+import json
+from collections.abc import Mapping
+from .tree_utils import reconstruct_tree_str, is_tree
 
 
 def write_info(message, ofs=None):
     prefix = f'Line #{ofs}: ' if ofs is not None else ''
     logging.info(prefix + message)
 
+# Tracing of the parsing process. Events are dictionaries with the
+# event type and the associated information, e.g., the recipe node,
+# the line offset and the variable values. Functions emitting an event
+# must check beforehand if trace_handlers is non-empty, e.g.,
+#     if trace_handlers:
+#         trace_event('open_section', name=varname)
+# so that nothing but this check is performed if tracing is disabled.
+# Recipe nodes are only converted to strings by the handlers.
+trace_handlers = []
+
+def trace_event(event_type, **fields):
+    event = {'event': event_type}
+    event.update(fields)
+    for handler in trace_handlers:
+        handler(event)
+
+def enable_tracing(handler=None):
+    # by default, the events are passed to the logging module
+    handler = handler if handler is not None else log_trace_event
+    if handler not in trace_handlers:
+        trace_handlers.append(handler)
+    return handler
+
+def disable_tracing(handler=None):
+    if handler is None:
+        trace_handlers.clear()
+    elif handler in trace_handlers:
+        trace_handlers.remove(handler)
+
+def render_trace_event(event):
+    return {k: reconstruct_tree_str(v) if is_tree(v) else v
+            for k, v in event.items()}
+
+trace_messages = {
+    'parse_section': 'Parsing section MF{mf}',
+    'parse_subsection': 'Parsing subsection MF/MT {mf}/{mt}',
+    'read_record': 'Reading a {record_type} record',
+    'record_content': 'Content of the {record_type} record: {content}',
+    'bind_variables': 'Variable names in this record: {variables}',
+    'open_section': 'Open section {name}[{indices}]',
+    'close_section': 'Close section {name}',
+    'enter_loop': 'Enter for loop (type {loop_type}) {node} (for_start: {start} and for_stop {stop})',
+    'leave_loop': 'Leave for loop (type {loop_type}) {node} (for_start: {start} and for_stop: {stop})',
+    'start_lookahead': 'Start lookahead for if head {node}',
+    'lookahead_failure': 'Printing the stacktrace due to failure in lookahead...',
+    'condition_failure': 'Printing the stacktrace due to failure in determination of if condition after lookahead...',
+    'evaluate_if_head': 'Evaluate if head {node}',
+    'if_condition': 'Dealing with the if_condition {node}: ' +
+                    'Left side evaluates to {left} and right side to {right}',
+    'enter_if_body': 'Enter if body because {node} is true',
+    'leave_if_body': 'Leave if body of if condition {node}',
+    'skip_if_body': 'Skip if body because if condition {node} is false'
+}
+
+def log_trace_event(event):
+    rendered = render_trace_event(event)
+    event_type = rendered['event']
+    if event_type == 'open_section':
+        rendered['indices'] = ','.join(str(idx) for idx in rendered['indices'])
+    elif event_type == 'bind_variables':
+        rendered['variables'] = ', '.join(f'{v}: {vv}'
+                                          for v, vv in rendered['variables'].items())
+    if event_type in trace_messages:
+        message = trace_messages[event_type].format(**rendered)
+    else:
+        message = str(rendered)
+    write_info(message, rendered.get('ofs', None))
+
+def create_jsonl_trace_handler(fileobj):
+    # write each event as JSON object on a separate line
+    def write_trace_event(event):
+        fileobj.write(json.dumps(render_trace_event(event), default=str) + '\n')
+    return write_trace_event
+
 def abbreviate_valstr(val):
     if isinstance(val, int) or isinstance(val, float):
         return str(val)
@@ -25,17 +101,17 @@ def abbreviate_valstr(val):
             return val
         else:
             return val[1:5] + '...' + val[1:5]
-    elif isinstance(val, dict):
+    elif isinstance(val, Mapping):
         return '{' + ', '.join(str(k) for k in tuple(val.keys())[:3]) + ', ...' + '}'
 
 def should_skip_logging_info(varnames, datadic):
     if len(varnames) == 0:
         return True
-    elif (len(varnames) == 1 and isinstance(datadic[varnames[0]], dict)
+    elif (len(varnames) == 1 and isinstance(datadic[varnames[0]], Mapping)
            and len(datadic[varnames[0]]) > 1):
         return True
     # if all variables are dictionaries...
-    elif len(tuple(1 for v in varnames if isinstance(datadic[v], dict))) == len(varnames):
+    elif len(tuple(1 for v in varnames if isinstance(datadic[v], Mapping))) == len(varnames):
         # and all these dictionaries have more than one element
         # we skip displaying then because they have been already
         # filled and displayed before
@@ -49,51 +125,52 @@ def should_skip_logging_info(varnames, datadic):
 
 class RingBuffer():
 
+    # keeps the offsets and recipe nodes of the last records read.
+    # The strings shown in case of failure are only
+    # created in display_record_logs.
+
     def __init__(self, capacity):
         self.capacity = capacity
-        self.buffer = [None] * capacity
-        self.tail = -1
+        self.ofs_buffer = [None] * capacity
+        self.node_buffer = [None] * capacity
+        # counters of enqueued elements, the oldest available
+        # element has the number first and the newest num_enqueued-1
+        self.first = 0
         self.num_enqueued = 0
 
-    def enqueue(self, elem):
-        self.tail = (self.tail + 1) % self.capacity
-        self.buffer[self.tail] = elem
+    def enqueue(self, ofs, node):
+        pos = self.num_enqueued % self.capacity
+        self.ofs_buffer[pos] = ofs
+        self.node_buffer[pos] = node
         self.num_enqueued += 1
+        if self.num_enqueued - self.first > self.capacity:
+            self.first += 1
 
     def get_queue(self):
-        if (self.num_enqueued > self.capacity):
-            return self.buffer[self.tail+1:] + self.buffer[:self.tail+1]
-        else:
-            return self.buffer[:self.tail+1]
-
-    def dump_state(self):
-        return {
-            'capacity': self.capacity,
-            'buffer': self.buffer,
-            'tail': self.tail,
-            'num_enqueued': self.num_enqueued
-        }
-
-    def load_state(self, state_info):
-        self.capacity = state_info['capacity']
-        self.buffer = state_info['buffer']
-        self.tail = state_info['tail']
-        self.num_enqueued = state_info['num_enqueued']
-
-    def save_record_log(self, ofs, line, record_tree, onlyfirst=False):
-        recon_str = reconstruct_tree_str(record_tree)
-        if onlyfirst:
-            recon_str = recon_str.split('\n')[0]
-        self.enqueue({
-            'ofs': ofs,
-            'line': line.rstrip(),
-            'record_spec': recon_str
-            })
-
-    def display_record_logs(self):
+        return [(self.ofs_buffer[i % self.capacity], self.node_buffer[i % self.capacity])
+                for i in range(self.first, self.num_enqueued)]
+
+    def get_position(self):
+        return self.num_enqueued
+
+    def rewind(self, position):
+        # remove the elements enqueued after position,
+        # e.g., the ones of a lookahead. Elements before
+        # position overwritten in the meantime are lost.
+        if position > self.num_enqueued:
+            raise IndexError('cannot rewind to a position in the future')
+        self.num_enqueued = position
+        self.first = min(self.first, position)
+
+    def save_record_log(self, ofs, record_tree):
+        self.enqueue(ofs, record_tree)
+
+    def display_record_logs(self, lines):
         outstr = ''
-        for curentry in self.get_queue():
-            outstr += f'-------- Line {curentry["ofs"]} -----------\n'
-            outstr += 'Template:  {}\n'.format(curentry['record_spec'])
-            outstr += 'Line:     "{}"\n\n'.format(curentry['line'])
+        for ofs, record_tree in self.get_queue():
+            record_spec = reconstruct_tree_str(record_tree)
+            line = lines[ofs].rstrip() if ofs < len(lines) else ''
+            outstr += f'-------- Line {ofs} -----------\n'
+            outstr += 'Template:  {}\n'.format(record_spec)
+            outstr += 'Line:     "{}"\n\n'.format(line)
         return outstr
@@ -0,0 +1,87 @@
+############################################################
+#
+# Author(s):       Georg Schnabel
+# Email:           g.schnabel@iaea.org
+# Creation date:   2023/03/15
+# Last modified:   2023/03/15
+# License:         MIT
+# Copyright (c) 2023 International Atomic Energy Agency (IAEA)
+#
+############################################################
+
+# An overlay dictionary records all modifications while
+# reading through to a base dictionary that remains unchanged.
+# It is used during the lookahead in if statements so that
+# the data read speculatively can be discarded by dropping the
+# overlay instead of working on a deep copy of the parser state.
+# The modifications are kept in a separate dictionary and not in
+# a dict subclass, because dict(...), {**...} or json.dumps would
+# only see the modifications in the storage of a dict subclass.
+
+from collections.abc import MutableMapping
+
+
+class OverlayDict(MutableMapping):
+
+    def __init__(self, base, registry=None):
+        # nested dictionaries in the base are wrapped on access.
+        # The registry makes sure that each base dictionary is
+        # wrapped by only one overlay, so that the modifications are
+        # also visible if a dictionary is reached via another path.
+        self._base = base
+        self._dic = {}
+        self._deleted = set()
+        self._registry = registry if registry is not None else {}
+        self._registry[id(base)] = self
+
+    def _wrap(self, val):
+        if isinstance(val, MutableMapping) and not isinstance(val, OverlayDict):
+            overlay = self._registry.get(id(val), None)
+            if overlay is None:
+                overlay = OverlayDict(val, self._registry)
+            return overlay
+        return val
+
+    def __getitem__(self, key):
+        if key in self._dic:
+            return self._dic[key]
+        if key in self._deleted:
+            raise KeyError(key)
+        val = self._base[key]
+        if isinstance(val, MutableMapping):
+            # store the overlay so that modifications persist
+            val = self._wrap(val)
+            self._dic[key] = val
+        return val
+
+    def __setitem__(self, key, val):
+        self._deleted.discard(key)
+        self._dic[key] = val
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._dic.pop(key, None)
+        if key in self._base:
+            self._deleted.add(key)
+
+    def __contains__(self, key):
+        return (key in self._dic or
+                (key in self._base and key not in self._deleted))
+
+    def __iter__(self):
+        for key in self._base:
+            if key not in self._deleted:
+                yield key
+        for key in self._dic:
+            if key not in self._base:
+                yield key
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def copy(self):
+        return dict(self.items())
@@ -0,0 +1,152 @@
+############################################################
+#
+# Author(s):       Georg Schnabel
+# Email:           g.schnabel@iaea.org
+# Creation date:   2023/04/03
+# Last modified:   2023/04/03
+# License:         MIT
+# Copyright (c) 2023 International Atomic Energy Agency (IAEA)
+#
+############################################################
+
+# The parsed MF/MT sections are stored in the cache directory
+# under a key derived from the content of the section, the
+# parser options and the recipes. A section parsed before
+# is then loaded from the cache instead of being parsed again.
+# The least recently used entries are removed if the size
+# of the cache exceeds section_cache_max_size.
+
+import os
+import pickle
+from hashlib import md5
+from appdirs import user_cache_dir
+from .endf_lark import endf_recipe_grammar
+from .endf_recipes import endf_recipe_dictionary as recipe_dic
+
+
+section_cache_max_size = 1024**3
+# to be increased if the layout of the cached
+# dictionaries changes without a change of the recipes
+section_cache_format_version = 1
+section_cache_state = {'size': None, 'recipe_hash': None}
+
+
+def get_section_cache_dir():
+    return os.path.join(user_cache_dir('endf_parserpy', 'gschnabel'),
+                        'section_cache')
+
+
+def get_recipe_hash():
+    # a change of the grammar or any recipe invalidates the cache
+    if section_cache_state['recipe_hash'] is None:
+        hasher = md5(endf_recipe_grammar.encode())
+        for mf in sorted(recipe_dic):
+            if isinstance(recipe_dic[mf], str):
+                hasher.update(f'{mf}:'.encode() + recipe_dic[mf].encode())
+            else:
+                for mt in sorted(recipe_dic[mf]):
+                    hasher.update(f'{mf}/{mt}:'.encode() +
+                                  recipe_dic[mf][mt].encode())
+        section_cache_state['recipe_hash'] = hasher.hexdigest()
+    return section_cache_state['recipe_hash']
+
+
+def get_section_cache_key(mf, mt, lines, parse_opts, read_opts):
+    hasher = md5(get_recipe_hash().encode())
+    hasher.update(repr((section_cache_format_version, mf, mt,
+                        sorted(parse_opts.items()),
+                        sorted(read_opts.items()))).encode())
+    for line in lines:
+        hasher.update(line.encode())
+    return hasher.hexdigest()
+
+
+def get_section_cache_filepath(key):
+    return os.path.join(get_section_cache_dir(), key + '.pkl')
+
+
+def load_cached_section(key):
+    filepath = get_section_cache_filepath(key)
+    try:
+        with open(filepath, 'rb') as fr:
+            datadic = pickle.load(fr)
+        # the modification time records the last use for the eviction
+        os.utime(filepath)
+        return datadic
+    except Exception:
+        return None
+
+
+def store_cached_section(key, datadic):
+    filepath = get_section_cache_filepath(key)
+    # the entry is written under a temporary name first
+    # so that other processes never see an incomplete file
+    try:
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        tmppath = filepath + f'.{os.getpid()}.tmp'
+        with open(tmppath, 'wb') as fw:
+            pickle.dump(datadic, fw, protocol=pickle.HIGHEST_PROTOCOL)
+        # an existing entry under the same key is replaced
+        oldsize = get_section_cache_filesize(filepath)
+        os.replace(tmppath, filepath)
+        filesize = os.path.getsize(filepath)
+    except OSError:
+        return
+    if section_cache_state['size'] is None:
+        section_cache_state['size'] = get_section_cache_size()
+    else:
+        section_cache_state['size'] += filesize - oldsize
+    if section_cache_state['size'] > section_cache_max_size:
+        evict_section_cache(section_cache_max_size)
+
+
+def list_section_cache_entries():
+    cache_dir = get_section_cache_dir()
+    entries = []
+    if not os.path.isdir(cache_dir):
+        return entries
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if entry.name.endswith('.pkl'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    return entries
+
+
+def get_section_cache_filesize(filepath):
+    try:
+        return os.path.getsize(filepath)
+    except OSError:
+        return 0
+
+
+def get_section_cache_size():
+    return sum(size for _, size, _ in list_section_cache_entries())
+
+
+def evict_section_cache(max_size):
+    # removes the least recently used entries until the
+    # size of the cache is below 90% of the maximum size
+    entries = sorted(list_section_cache_entries())
+    cursize = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if cursize <= 0.9 * max_size:
+            break
+        try:
+            os.remove(path)
+            cursize -= size
+        except OSError:
+            pass
+    section_cache_state['size'] = cursize
+
+
+def clear_section_cache():
+    for _, _, path in list_section_cache_entries():
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    section_cache_state['size'] = 0
@@ -0,0 +1,334 @@
+############################################################
+#
+# Author(s):       Georg Schnabel
+# Email:           g.schnabel@iaea.org
+# Creation date:   2023/03/20
+# Last modified:   2023/03/20
+# License:         MIT
+# Copyright (c) 2023 International Atomic Energy Agency (IAEA)
+#
+############################################################
+
+# The functions in this module locate the MAT/MF/MT sections
+# in the raw bytes of an ENDF file, e.g., a memory-mapped file,
+# so that only the lines of the sections actually needed
+# must be decoded and split into strings.
+
+import mmap
+import re
+import os
+import pickle
+from io import StringIO
+from hashlib import md5
+from locale import getpreferredencoding
+from appdirs import user_cache_dir
+from .endf_utils import is_blank_line, read_ctrl_fields
+from .fortran_utils import fortstr2float
+from .custom_exceptions import InvalidFloatError
+from .lazy_utils import LazyDict
+from functools import partial
+
+
+nonascii_regex = re.compile(b'[\x80-\xff]')
+
+
+def map_endf_file(fileobj):
+    # mmap refuses to map empty files
+    if fileobj.seek(0, 2) == 0:
+        return b''
+    return mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def iter_ctrl_fields(buf, **read_opts):
+    # yields the byte range and the MAT, MF and MT number of each
+    # line that is not blank. The numbers are None if they are
+    # not valid integers.
+    width = read_opts.get('width', 11)
+    ctrlofs = 6*width
+    encoding = getpreferredencoding(False)
+    # the control columns of lines with multi-byte
+    # characters are only found after decoding
+    is_ascii = nonascii_regex.search(buf) is None
+    bufsize = len(buf)
+    start = 0
+    while start < bufsize:
+        end = buf.find(b'\n', start)
+        end = bufsize if end == -1 else end+1
+        line = buf[start:end]
+        if not is_ascii:
+            line = line.decode(encoding)
+        ctrl = line[ctrlofs:ctrlofs+9]
+        try:
+            mat = int(ctrl[0:4])
+            mf = int(ctrl[4:6])
+            mt = int(ctrl[6:9])
+        except Exception:
+            # blank lines are recognized as in split_sections
+            if is_ascii:
+                line = line.decode(encoding)
+            if is_blank_line(line):
+                start = end
+                continue
+            mat = mf = mt = None
+        yield start, end, mat, mf, mt
+        start = end
+
+
+def add_to_section_index(index, key, start, end):
+    entry = index.get(key, None)
+    if entry is None:
+        index[key] = (start, end-start, 1)
+    else:
+        index[key] = (entry[0], end-entry[0], entry[2]+1)
+
+
+def build_section_index(buf, index=None, base=0, **read_opts):
+    # the index maps (MAT, MF, MT) to the byte offset and byte length
+    # of the range from the first to the last line of a section and
+    # the number of lines belonging to the section.
+    # The selection of lines is the same as in split_sections,
+    # where read_ctrl_fields(..., nofail=True) also assigns lines
+    # with invalid control fields to MAT=0, MF=0 and MT=0.
+    # An existing index can be extended by the sections in buf,
+    # which starts at byte offset base of the file.
+    if index is None:
+        index = {}
+    for start, end, mat, mf, mt in iter_ctrl_fields(buf, **read_opts):
+        if mat is None:
+            mat = mf = mt = 0
+        if ((mf != 0 and mt != 0) or
+                (mf == 0 and mt == 0 and not index)):
+            add_to_section_index(index, (mat, mf, mt), base+start, base+end)
+    return index
+
+
+def iter_material_indices(buf, **read_opts):
+    # yields a section index for each material on a tape.
+    # A material ends with the MEND record (MAT=0, MF=0, MT=0).
+    # The tape head record is included in the index of each
+    # material so that it can be treated like a file of its own.
+    tapehead = {}
+    index = {}
+    is_first = True
+    for start, end, mat, mf, mt in iter_ctrl_fields(buf, **read_opts):
+        if mat is None:
+            continue
+        if is_first and mf == 0 and mt == 0:
+            add_to_section_index(tapehead, (mat, mf, mt), start, end)
+        elif mf != 0 and mt != 0:
+            if not index:
+                index.update(tapehead)
+            add_to_section_index(index, (mat, mf, mt), start, end)
+        elif mat == 0 and mf == 0 and mt == 0 and index:
+            yield index
+            index = {}
+        is_first = False
+    # the last material may lack the MEND record
+    if index:
+        yield index
+
+
+def get_section_lines(buf, key, index, **read_opts):
+    ofs, length, numlines = index[key]
+    encoding = getpreferredencoding(False)
+    text = buf[ofs:ofs+length].decode(encoding)
+    # newline=None translates line endings like open(..., 'r')
+    lines = StringIO(text, newline=None).readlines()
+    if len(lines) != numlines:
+        # the range also contains lines not belonging to the section,
+        # e.g., blank lines or lines of another section in between
+        lines = [l for l in lines if not is_blank_line(l) and
+                 read_ctrl_fields(l, nofail=True, **read_opts) == key]
+    return lines
+
+
+def get_merged_section_lines(buf, keys, index, **read_opts):
+    lines = []
+    for key in keys:
+        lines.extend(get_section_lines(buf, key, index, **read_opts))
+    return lines
+
+
+def get_merged_section_lines_by_mt(buf, index, read_opts, mt, keys):
+    return get_merged_section_lines(buf, keys, index, **read_opts)
+
+
+def get_section_ranges(buf, keys, index):
+    # copies the bytes of the sections so that
+    # they remain available if the buffer is closed
+    ranges = []
+    for key in keys:
+        ofs, length, numlines = index[key]
+        ranges.append((key, bytes(buf[ofs:ofs+length]), numlines))
+    return ranges
+
+
+def get_merged_section_lines_by_range(read_opts, mt, ranges):
+    lines = []
+    for key, rangebuf, numlines in ranges:
+        rangeidx = {key: (0, len(rangebuf), numlines)}
+        lines.extend(get_section_lines(rangebuf, key, rangeidx, **read_opts))
+    return lines
+
+
+def split_sections_by_index(buf, index, lazy=False, skip=None, **read_opts):
+    # produces the same dictionary as split_sections,
+    # in which the lines of sections with the same MF/MT
+    # numbers but different MAT numbers are merged.
+    # If lazy=True, the lines are only decoded on access.
+    # Otherwise the lines of the sections for which skip(mf, mt)
+    # is true are only decoded on access, as these sections are
+    # not parsed.
+    mfkeys = {}
+    for key in index:
+        mat, mf, mt = key
+        mtkeys = mfkeys.setdefault(mf, {})
+        mtkeys.setdefault(mt, [])
+        mtkeys[mt].append(key)
+    mfdic = {}
+    for mf, mtkeys in mfkeys.items():
+        if lazy:
+            loader = partial(get_merged_section_lines_by_mt,
+                             buf, index, read_opts)
+            mtdic = LazyDict(loader)
+            for mt, keys in mtkeys.items():
+                mtdic.set_lazy(mt, keys)
+        elif skip is not None and any(skip(mf, mt) for mt in mtkeys):
+            loader = partial(get_merged_section_lines_by_range, read_opts)
+            mtdic = LazyDict(loader)
+            for mt, keys in mtkeys.items():
+                if skip(mf, mt):
+                    mtdic.set_lazy(mt, get_section_ranges(buf, keys, index))
+                else:
+                    mtdic[mt] = get_merged_section_lines(buf, keys, index,
+                                                         **read_opts)
+        else:
+            mtdic = {}
+            for mt, keys in mtkeys.items():
+                mtdic[mt] = get_merged_section_lines(buf, keys, index,
+                                                     **read_opts)
+        mfdic[mf] = mtdic
+    return mfdic
+
+
+def get_section_heads(buf, index, **read_opts):
+    # the C1 and C2 fields of the first line of each section,
+    # which are ZA and AWR for the HEAD records of most sections
+    width = read_opts.get('width', 11)
+    encoding = getpreferredencoding(False)
+    heads = {}
+    for key, (ofs, length, numlines) in index.items():
+        end = buf.find(b'\n', ofs, ofs+length)
+        end = ofs+length if end == -1 else end
+        line = buf[ofs:end].decode(encoding)
+        try:
+            heads[key] = (fortstr2float(line[:width], **read_opts),
+                          fortstr2float(line[width:2*width], **read_opts))
+        except (InvalidFloatError, ValueError):
+            heads[key] = None
+    return heads
+
+
+# The index of an ENDF file is stored in the cache directory
+# and reused as long as the file has not been changed.
+# The check relies on the size and modification time of the
+# file and a hash of its beginning and end.
+section_index_version = 1
+section_index_hash_len = 65536
+
+
+def get_buffer_hash(buf):
+    n = section_index_hash_len
+    return md5(buf[:n] + buf[-n:]).hexdigest()
+
+
+def read_line_ctrl_fields(buf, start, end, **read_opts):
+    encoding = getpreferredencoding(False)
+    try:
+        line = buf[start:end].decode(encoding)
+    except UnicodeDecodeError:
+        return None
+    if is_blank_line(line):
+        return None
+    return read_ctrl_fields(line, nofail=True, **read_opts)
+
+
+def is_valid_section_index(buf, index, **read_opts):
+    # a file changed without a change of its size, modification time
+    # and the hashed parts is detected by the lines at the boundaries
+    # of each section: the first and the last line must contain the
+    # MAT, MF and MT numbers of the section but not the line before
+    bufsize = len(buf)
+    for key, (ofs, length, numlines) in index.items():
+        end = ofs + length
+        if end > bufsize:
+            return False
+        firstend = buf.find(b'\n', ofs, end)
+        firstend = end if firstend == -1 else firstend
+        laststart = buf.rfind(b'\n', ofs, end-1) + 1
+        laststart = max(laststart, ofs)
+        if (read_line_ctrl_fields(buf, ofs, firstend, **read_opts) != key or
+                read_line_ctrl_fields(buf, laststart, end, **read_opts) != key):
+            return False
+        if ofs > 0:
+            prevstart = buf.rfind(b'\n', 0, ofs-1) + 1
+            if read_line_ctrl_fields(buf, prevstart, ofs, **read_opts) == key:
+                return False
+    return True
+
+
+def get_section_index_filepath(filename):
+    filepath = os.path.realpath(filename)
+    cache_dir = os.path.join(user_cache_dir('endf_parserpy', 'gschnabel'),
+                             'section_index')
+    idxname = md5(filepath.encode()).hexdigest() + '.endfidx'
+    return os.path.join(cache_dir, idxname)
+
+
+def get_section_index_signature(fileobj, buf, **read_opts):
+    stat = os.fstat(fileobj.fileno())
+    return {'version': section_index_version,
+            'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+            'width': read_opts.get('width', 11),
+            'hash': get_buffer_hash(buf)}
+
+
+def load_section_index(filename, fileobj, buf, **read_opts):
+    # returns the index and the values of HEAD records of the sections,
+    # taken from the cache file if it is valid for the current file
+    signature = get_section_index_signature(fileobj, buf, **read_opts)
+    idxpath = get_section_index_filepath(filename)
+    try:
+        with open(idxpath, 'rb') as fr:
+            idxdata = pickle.load(fr)
+        if (idxdata['signature'] == signature and
+                is_valid_section_index(buf, idxdata['index'], **read_opts)):
+            return idxdata['index'], idxdata['heads']
+    except Exception:
+        pass
+    index = build_section_index(buf, **read_opts)
+    heads = get_section_heads(buf, index, **read_opts)
+    idxdata = {'signature': signature, 'index': index, 'heads': heads}
+    # the cache file is written under a temporary name first
+    # so that other processes never see an incomplete file
+    try:
+        os.makedirs(os.path.dirname(idxpath), exist_ok=True)
+        tmppath = idxpath + f'.{os.getpid()}.tmp'
+        with open(tmppath, 'wb') as fw:
+            pickle.dump(idxdata, fw)
+        os.replace(tmppath, idxpath)
+    except OSError:
+        pass
+    return index, heads
+
+
+def read_section_index(filename, **read_opts):
+    with open(filename, 'rb') as fin:
+        buf = map_endf_file(fin)
+        try:
+            index, heads = load_section_index(filename, fin, buf,
+                                              **read_opts)
+        finally:
+            if isinstance(buf, mmap.mmap):
+                buf.close()
+    return index, heads
@@ -33,19 +33,53 @@ def get_name(tree, nofail=False):
 def get_value(token):
     return token.value
 
+def annotate_tree(tree):
+    # store the information needed by get_child, get_child_value,
+    # get_child_names and search_name in the nodes so that these
+    # functions don't need to scan the children of a node.
+    # The recipe trees are annotated once after they have been loaded.
+    child_dic = {}
+    contained_names = {get_name(tree)}
+    for child in tree.children:
+        name = get_name(child)
+        child_dic.setdefault(name, child)
+        if is_tree(child):
+            annotate_tree(child)
+            contained_names.update(child.contained_names)
+        else:
+            contained_names.add(name)
+    tree.child_dic = child_dic
+    tree.child_names = tuple(get_name(t) for t in tree.children)
+    tree.contained_names = frozenset(contained_names)
+    return tree
+
 def get_child_names(tree):
+    child_names = getattr(tree, 'child_names', None)
+    if child_names is not None:
+        return list(child_names)
     return list(get_name(t) for t in tree.children)
 
 def get_child(tree, name, nofail=False):
-    for child in tree.children:
-        if get_name(child) == name:
+    child_dic = getattr(tree, 'child_dic', None)
+    if child_dic is not None:
+        child = child_dic.get(name, None)
+        if child is not None:
             return child
+    else:
+        for child in tree.children:
+            if get_name(child) == name:
+                return child
     if nofail:
         return None
     else:
         raise IndexError(f'name {name} not found among child nodes')
 
 def get_child_value(tree, name):
+    child_dic = getattr(tree, 'child_dic', None)
+    if child_dic is not None:
+        child = child_dic.get(name, None)
+        if is_token(child):
+            return child.value
     for child in tree.children:
         if is_token(child):
             if get_name(child) == name:
@@ -60,6 +94,9 @@ def get_child_value_by_pos(tree, pos):
     return None
 
 def search_name(tree, name):
+    contained_names = getattr(tree, 'contained_names', None)
+    if contained_names is not None:
+        return name in contained_names
     if get_name(tree, nofail=True) == name:
         return True
     elif is_tree(tree):
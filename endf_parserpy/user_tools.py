@@ -9,6 +9,22 @@
 #
 ############################################################
 
+from .indexed_array_utils import IndexedArray
+from .lazy_utils import LazyDict
+
+
+def endf_json_default(obj):
+    # enables json.dump to serialize the arrays created
+    # with array_backend='numpy' or indexed_arrays=True, e.g.,
+    # json.dump(endf_dic, f, default=endf_json_default)
+    # It also converts the dictionaries created with lazy=True.
+    if isinstance(obj, (IndexedArray, LazyDict)):
+        return dict(obj.items())
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError(f'Object of type {type(obj).__name__} '
+                    'is not JSON serializable')
+
 def locate(dic, varname, as_string=False):
     path = []
     locations = []
@@ -22,7 +38,7 @@ def locate(dic, varname, as_string=False):
             return
         else:
             for key, item in dic.items():
-                if isinstance(item, dict):
+                if isinstance(item, (dict, LazyDict)):
                     path.append(key)
                     recfun(item) 
                     del path[-1]
@@ -98,7 +114,7 @@ def enter_section(endf_dic, path):
 def show_content(endf_dic, maxlevel=0, prefix='/'):
     maxlen = max(len(prefix+str(s)) for s in endf_dic.keys())
     for k, v in endf_dic.items():
-        if isinstance(v, dict):
+        if isinstance(v, (dict, IndexedArray, LazyDict)):
             if maxlevel > 0:
                 show_content(v, maxlevel-1,
                              prefix=prefix+str(k)+'/')
@@ -2,9 +2,44 @@ from pathlib import Path
 import os
 import pytest
 import json
+import gzip
+import bz2
+import lzma
+import io
+from copy import copy, deepcopy
+from itertools import product
 from endf_parserpy.endf_parser import BasicEndfParser
+from endf_parserpy.endf_recipe_utils import get_recipe_parser
+from endf_parserpy.endf_lark import endf_recipe_grammar
+from endf_parserpy.tree_utils import (annotate_tree, is_tree, get_child,
+                                      get_child_names, get_child_value,
+                                      search_name, reconstruct_tree_str)
+from endf_parserpy.endf_recipes import endf_recipe_dictionary
+from endf_parserpy.endf_mapping_utils import (compile_expr_helper,
+                                              get_compiled_expr, eval_expr)
+from endf_parserpy.fortran_utils import (fortstr2float, read_fort_floats,
+                                         read_fort_float_block, float2fortstr,
+                                         write_fort_floats,
+                                         write_fort_float_block)
+from endf_parserpy.endf_utils import (read_endf_numbers, read_ctrl_fields,
+                                      read_ctrl, write_ctrl, format_ctrl,
+                                      copy_ctrl, read_cont, write_cont,
+                                      read_tab1, write_tab1, write_send)
+from endf_parserpy.custom_exceptions import (ParserException,
+                                             NumberMismatchError,
+                                             SeveralUnboundVariablesError,
+                                             InvalidFloatError)
+from endf_parserpy.overlay_utils import OverlayDict
 from endf_parserpy.debugging_utils import smart_is_equal, compare_objects
-from endf_parserpy.user_tools import sanitize_fieldname_types
+from endf_parserpy.user_tools import (sanitize_fieldname_types,
+                                      endf_json_default)
+from endf_parserpy import endf_parser
+from endf_parserpy import compression_utils
+from endf_parserpy import (section_cache_utils, section_index_utils,
+                           logging_utils)
+from endf_parserpy.logging_utils import (enable_tracing, disable_tracing,
+                                         create_jsonl_trace_handler)
+from endf_parserpy.logging_utils import RingBuffer
 
 
 @pytest.fixture(scope="module")
@@ -48,7 +83,675 @@ def test_endf_read_write_read_roundtrip_preserves_content(endf_file, tmp_path, m
 
 def test_endf_json_endf_roundtrip_preserves_content(endf_file, tmp_path, myBasicEndfParser, mf_sel):
     endf_dic = myBasicEndfParser.parsefile(endf_file, include=mf_sel)
-    jsonstr = json.dumps(endf_dic, ensure_ascii=False)
+    jsonstr = json.dumps(endf_dic, ensure_ascii=False, default=endf_json_default)
     endf_dic2 = json.loads(jsonstr)
     sanitize_fieldname_types(endf_dic2)
     compare_objects(endf_dic, endf_dic2, atol=1e-10, rtol=1e-10)
+
+
+def test_lazy_parsing_yields_same_content(endf_file, myBasicEndfParser, mf_sel):
+    endf_dic = myBasicEndfParser.parsefile(endf_file, include=mf_sel)
+    lazy_dic = myBasicEndfParser.parsefile(endf_file, include=mf_sel, lazy=True)
+    # a deep copy turns the lazy dictionaries into ordinary ones
+    compare_objects(endf_dic, deepcopy(lazy_dic), atol=0, rtol=0)
+
+
+def test_lazy_parsing_survives_dict_conversion(endf_file, myBasicEndfParser, mf_sel):
+    endf_dic = myBasicEndfParser.parsefile(endf_file, include=mf_sel)
+    lazy_dic = myBasicEndfParser.parsefile(endf_file, include=mf_sel, lazy=True)
+    copied_dic = {mf: dict(mfsec) for mf, mfsec in lazy_dic.items()}
+    compare_objects(endf_dic, copied_dic, atol=0, rtol=0)
+    lazy_dic = myBasicEndfParser.parsefile(endf_file, include=mf_sel, lazy=True)
+    unpacked_dic = {mf: {**mfsec} for mf, mfsec in lazy_dic.items()}
+    compare_objects(endf_dic, unpacked_dic, atol=0, rtol=0)
+
+
+def test_indexed_arrays_yield_same_content(endf_file, myBasicEndfParser, mf_sel):
+    endf_dic = myBasicEndfParser.parsefile(endf_file, include=mf_sel)
+    dense_opts = {**myBasicEndfParser.get_parser_opts(), 'indexed_arrays': True}
+    dense_parser = BasicEndfParser(**dense_opts)
+    dense_dic = dense_parser.parsefile(endf_file, include=mf_sel)
+    assert dense_dic == endf_dic
+    assert dense_parser.write(dense_dic) == myBasicEndfParser.write(endf_dic)
+
+
+def test_overlay_keeps_base_unchanged(myBasicEndfParser, mf_sel):
+    base = {'NS': 1, 'sub': {1: {'E': 1.}}, 'AWR': 2.}
+    overlay = OverlayDict(base)
+    overlay['sub'][1]['E'] = 3.
+    overlay['sub'][2] = {'E': 4.}
+    overlay['NT'] = 5
+    del overlay['AWR']
+    expected = {'NS': 1, 'sub': {1: {'E': 3.}, 2: {'E': 4.}}, 'NT': 5}
+    assert base == {'NS': 1, 'sub': {1: {'E': 1.}}, 'AWR': 2.}
+    assert overlay == expected
+    assert 'AWR' not in overlay and len(overlay) == 3
+    # conversions implemented in C also see the modifications
+    assert json.loads(json.dumps(dict(overlay), default=dict)) == \
+        json.loads(json.dumps(expected))
+    assert {**overlay}['NT'] == 5 and copy(overlay)['NT'] == 5
+
+
+def test_lookahead_leaves_no_trace(myBasicEndfParser, mf_sel):
+    # the record read during the lookahead of the if branch
+    # is discarded if the else branch is taken
+    recipe = """
+    [MAT, 3, MT/ ZA, AWR, 0, 0, 0, 0] HEAD
+    (sub)
+    [MAT, 3, MT/ X, 0.0, 0, 0, 0, 0] CONT
+    (/sub)
+    if L1 == 1 [lookahead=1]:
+        [MAT, 3, MT/ Y, 0.0, L1, 0, 0, 0] CONT
+    else:
+        [MAT, 3, MT/ Z, 0.0, L2, 0, 0, 0] CONT
+    endif
+    SEND
+    """
+    tree = annotate_tree(get_recipe_parser(endf_recipe_grammar).parse(recipe))
+    parser = BasicEndfParser(**myBasicEndfParser.get_parser_opts())
+    parser.tree_dic = {3: tree}
+    head = {'MAT': 2925, 'MF': 3, 'MT': 1, 'ZA': 29063., 'AWR': 62.389,
+            'sub': {'X': 1.}}
+    for branch in ({'Y': 2., 'L1': 1}, {'Z': 3., 'L2': 2}):
+        mf3 = {**head, **branch}
+        lines = parser.write({3: {1: mf3}})
+        assert len(lines) == 7
+        assert parser.parse(lines)[3][1] == mf3
+
+
+def test_mf33_covariance_block_is_assembled_on_union_grid(myBasicEndfParser, mf_sel):
+    numpy = pytest.importorskip('numpy')
+    from endf_parserpy.covariance_utils import get_mf33_covariance
+    lb1 = {'LT': 0, 'LB': 1, 'NP': 3, 'Ek': {1: 1., 2: 2., 3: 4.},
+           'Fk': {1: 0.1, 2: 0.2, 3: 0.}}
+    lb5 = {'LS': 1, 'LB': 5, 'NT': 6, 'NE': 3, 'E': {1: 1., 2: 3., 3: 4.},
+           'F': {1: {1: 0.01, 2: 0.02}, 2: {2: 0.03}}}
+    mf33 = {'MAT': 2925, 'MF': 33, 'MT': 1, 'ZA': 29063., 'AWR': 62.389,
+            'MTL': 0, 'NL': 1,
+            'subsection': {1: {'XMF1': 0., 'XLFS1': 0., 'MAT1': 0, 'MT1': 1,
+                               'NC': 0, 'NI': 2,
+                               'ni_subsection': {1: lb1, 2: lb5}}}}
+    lines = myBasicEndfParser.write({33: {1: mf33}})
+    endf_dic = myBasicEndfParser.parse(lines)
+    block = get_mf33_covariance(endf_dic, 1, 1)
+    assert numpy.array_equal(block['row_energies'], [1., 2., 3., 4.])
+    expected = [[0.11, 0.01, 0.02], [0.01, 0.21, 0.22], [0.02, 0.22, 0.23]]
+    assert numpy.allclose(block['relative'], expected)
+    assert not block['absolute'].any()
+    packed = get_mf33_covariance(endf_dic, 1, 1, packed=True)
+    assert numpy.allclose(packed['relative'],
+                          [0.11, 0.01, 0.02, 0.21, 0.22, 0.23])
+
+
+def test_flow_actions_run_compiled_plan(myBasicEndfParser, mf_sel):
+    recipe = """
+    [MAT, 3, MT/ ZA, AWR, N, 0, 0, 0] HEAD
+    for k=1 to N:
+        (sub[k])
+        [MAT, 3, MT/ X, 0.0, 0, 0, 0, 0] CONT
+        (/sub[k])
+    endfor
+    SEND
+    """
+    tree = annotate_tree(get_recipe_parser(endf_recipe_grammar).parse(recipe))
+    parser = BasicEndfParser(**myBasicEndfParser.get_parser_opts())
+    parser.tree_dic = {3: tree}
+    mf3 = {'MAT': 2925, 'MF': 3, 'MT': 1, 'ZA': 29063., 'AWR': 62.389,
+           'N': 2, 'sub': {1: {'X': 1.}, 2: {'X': 2.}}}
+    lines = parser.write({3: {1: mf3}})
+    assert parser.parse(lines)[3][1] == mf3
+    # a single node of the recipe can still be run
+    for_node = next(t for t in tree.iter_subtrees() if t.data == 'for_loop')
+    parser.reset_parser_state(lines=lines[1:3], datadic={'N': 2})
+    parser.flow_actions['for_loop'](for_node)
+    assert parser.datadic == {'N': 2, 'sub': mf3['sub']}
+
+
+def test_record_with_unordered_dependent_fields_is_parsed(myBasicEndfParser, mf_sel):
+    # N+M cannot be evaluated before N is determined by L1*N,
+    # which needs L1 from the previous record
+    recipe = """
+    [MAT, 3, MT/ ZA, AWR, L1, 0, 0, 0] HEAD
+    [MAT, 3, MT/ 0.0, 0.0, N+M, L1*N, 0, 0] CONT
+    SEND
+    """
+    tree = annotate_tree(get_recipe_parser(endf_recipe_grammar).parse(recipe))
+    parser = BasicEndfParser(**myBasicEndfParser.get_parser_opts())
+    parser.tree_dic = {3: tree}
+    mf3 = {'MAT': 2925, 'MF': 3, 'MT': 1, 'ZA': 29063., 'AWR': 62.389,
+           'L1': 2, 'N': 3, 'M': 4}
+    lines = parser.write({3: {1: mf3}})
+    endf_dic = parser.parse(lines)
+    assert endf_dic[3][1] == mf3
+
+
+def test_dependent_fields_are_checked_in_source_order(myBasicEndfParser, mf_sel):
+    # NT is determined by N1 because LG is known from the HEAD record
+    # and the value in N2 is checked against it, as in MF12 with LG=2
+    recipe = """
+    [MAT, 3, MT/ ZA, AWR, LG, 0, 0, 0] HEAD
+    [MAT, 3, MT/ 0.0, 0.0, 0, 0, (LG+1)*NT, NT] CONT
+    SEND
+    """
+    tree = annotate_tree(get_recipe_parser(endf_recipe_grammar).parse(recipe))
+    parser_opts = myBasicEndfParser.get_parser_opts()
+    parser_opts['ignore_number_mismatch'] = False
+    parser = BasicEndfParser(**parser_opts)
+    parser.tree_dic = {3: tree}
+    mf3 = {'MAT': 2925, 'MF': 3, 'MT': 1, 'ZA': 29063., 'AWR': 62.389,
+           'LG': 2, 'NT': 3}
+    lines = parser.write({3: {1: mf3}})
+    assert parser.parse(lines)[3][1] == mf3
+    lines[1] = lines[1][:55] + '          4' + lines[1][66:]
+    with pytest.raises(ParserException) as exc_info:
+        parser.parse(lines)
+    assert isinstance(exc_info.value.__context__, NumberMismatchError)
+    assert 'source field named N2' in str(exc_info.value.__context__)
+
+
+def test_constant_expressions_are_folded(myBasicEndfParser, mf_sel):
+    recipe = '[MAT, 3, MT/ (6-2)/2, 2*(N+1), 1/0, 0, N-M, 0] CONT\n'
+    tree = get_recipe_parser(endf_recipe_grammar).parse(recipe)
+    fields = next(t for t in tree.iter_subtrees() if t.data == 'cont_fields')
+    exprs = [t for t in fields.children if is_tree(t)]
+    # expressions without variables are evaluated at compile time,
+    # unless the evaluation fails, which is left to the evaluation
+    assert compile_expr_helper(exprs[0])[1] == (2, 0, None)
+    assert compile_expr_helper(exprs[1])[1] is None
+    assert compile_expr_helper(exprs[2])[1] is None
+    assert get_compiled_expr(exprs[1]) is get_compiled_expr(exprs[1])
+    assert eval_expr(exprs[1], {}, {}) == (2, 2, ('N', None))
+    assert eval_expr(exprs[1], {'N': 3}, {}) == (8, 0, None)
+    assert eval_expr(exprs[4], {'N': 3, 'M': 1}, {}) == (2, 0, None)
+    with pytest.raises(ZeroDivisionError):
+        eval_expr(exprs[2], {}, {})
+    with pytest.raises(SeveralUnboundVariablesError):
+        eval_expr(exprs[4], {}, {})
+
+
+def test_list_loop_checks_existing_values(myBasicEndfParser, mf_sel):
+    # the values of X in the second LIST record are
+    # compared with the ones assigned by the first one
+    recipe = """
+    [MAT, 3, MT/ ZA, AWR, 0, 0, 0, 0] HEAD
+    [MAT, 3, MT/ 0.0, 0.0, 0, 0, 2*N, N/ {X[k], Y[k]}{k=1 to N} ] LIST
+    [MAT, 3, MT/ 0.0, 0.0, 0, 0, N, 0/ {X[k]}{k=1 to N} ] LIST
+    SEND
+    """
+    tree = get_recipe_parser(endf_recipe_grammar).parse(recipe)
+    parser = BasicEndfParser(ignore_number_mismatch=False)
+    parser.tree_dic = {3: tree}
+    mf3 = {'MAT': 2925, 'MF': 3, 'MT': 1, 'ZA': 29063., 'AWR': 62.389,
+           'N': 2, 'X': {1: 1., 2: 2.}, 'Y': {1: 3., 2: 4.}}
+    lines = parser.write({3: {1: mf3}})
+    assert parser.parse(lines)[3][1] == mf3
+    lines[4] = ' 5.000000+0' + lines[4][11:]
+    with pytest.raises(ParserException) as exc_info:
+        parser.parse(lines)
+    assert isinstance(exc_info.value.__context__, NumberMismatchError)
+    assert 'source field named val' in str(exc_info.value.__context__)
+
+
+def test_record_log_is_rendered_on_failure(myBasicEndfParser, mf_sel):
+    recipe = """
+    [MAT, 3, MT/ ZA, AWR, 0, 0, 0, 0] HEAD
+    [MAT, 3, MT/ X, 0.0, 0, 0, 0, 0] CONT
+    [MAT, 3, MT/ Y, 0.0, 0, 0, 0, 0] CONT
+    [MAT, 3, MT/ Z, 0.0, 0, 0, 0, 0] CONT
+    SEND
+    """
+    tree = get_recipe_parser(endf_recipe_grammar).parse(recipe)
+    nodes = [t for t in tree.iter_subtrees_topdown()
+             if t.data in ('head_line', 'cont_line')]
+    lines = [f'line {i}' for i in range(4)]
+    logbuffer = RingBuffer(3)
+    for ofs, node in enumerate(nodes):
+        logbuffer.save_record_log(ofs, node)
+    assert [ofs for ofs, node in logbuffer.get_queue()] == [1, 2, 3]
+    # the records read during a lookahead are discarded,
+    # the records overwritten by them are lost
+    position = logbuffer.get_position()
+    logbuffer.save_record_log(0, nodes[0])
+    logbuffer.rewind(position)
+    assert [ofs for ofs, node in logbuffer.get_queue()] == [2, 3]
+    logstr = logbuffer.display_record_logs(lines)
+    assert 'Line:     "line 0"' not in logstr
+    assert 'Line:     "line 3"' in logstr
+    assert 'Template:  ' + reconstruct_tree_str(nodes[3]) in logstr
+    with pytest.raises(IndexError):
+        logbuffer.rewind(position + 1)
+
+
+def test_nested_sections_see_enclosing_variables(myBasicEndfParser, mf_sel):
+    # the loop bounds in the innermost section are found in the
+    # enclosing section (M) and on the top level (N)
+    recipe = """
+    [MAT, 3, MT/ ZA, AWR, N, 0, 0, 0] HEAD
+    for k=1 to N:
+        (sub[k])
+        [MAT, 3, MT/ X, 0.0, M, 0, 0, 0] CONT
+        (inner)
+        for j=1 to M:
+            [MAT, 3, MT/ Y[j], 0.0, 0, 0, 0, 0] CONT
+        endfor
+        for j=1 to N:
+            [MAT, 3, MT/ Z[j], 0.0, 0, 0, 0, 0] CONT
+        endfor
+        (/inner)
+        (/sub[k])
+    endfor
+    SEND
+    """
+    tree = get_recipe_parser(endf_recipe_grammar).parse(recipe)
+    parser = BasicEndfParser()
+    parser.tree_dic = {3: tree}
+    mf3 = {'MAT': 2925, 'MF': 3, 'MT': 1, 'ZA': 29063., 'AWR': 62.389,
+           'N': 2, 'sub': {}}
+    mf3['sub'][1] = {'X': 1., 'M': 1,
+                     'inner': {'Y': {1: 2.}, 'Z': {1: 3., 2: 4.}}}
+    mf3['sub'][2] = {'X': 5., 'M': 2,
+                     'inner': {'Y': {1: 6., 2: 7.}, 'Z': {1: 8., 2: 9.}}}
+    orig_mf3 = deepcopy(mf3)
+    lines = parser.write({3: {1: mf3}})
+    assert mf3 == orig_mf3
+    endf_dic = parser.parse(lines)
+    assert endf_dic[3][1] == mf3
+    # no bookkeeping keys are left in the dictionaries
+    assert '__' not in json.dumps(endf_dic)
+
+
+def test_annotated_tree_yields_same_children(myBasicEndfParser, mf_sel):
+    # the recipes shipped do not contain desired numbers
+    # and inconsistent variable specifications, e.g., 0.0? and NP?
+    recipe = endf_recipe_dictionary[4] + """
+    [MAT, 4, MT/ 0.0?, AWR, 0, 0, NP?, 0] CONT
+    """
+    recipe_parser = get_recipe_parser(endf_recipe_grammar)
+    plain_tree = recipe_parser.parse(recipe)
+    annotated_tree = annotate_tree(recipe_parser.parse(recipe))
+    extra_names = ('DESIRED_NUMBER', 'inconsistent_varspec', 'unknown')
+    found_names = set()
+    for plain, annotated in zip(plain_tree.iter_subtrees(),
+                                annotated_tree.iter_subtrees()):
+        child_names = get_child_names(plain)
+        assert get_child_names(annotated) == child_names
+        for name in set(child_names).union(extra_names):
+            assert get_child(annotated, name, nofail=True) == \
+                get_child(plain, name, nofail=True)
+            assert search_name(annotated, name) == search_name(plain, name)
+            if search_name(plain, name):
+                found_names.add(name)
+            try:
+                value = get_child_value(plain, name)
+            except IndexError:
+                with pytest.raises(IndexError):
+                    get_child_value(annotated, name)
+            else:
+                assert get_child_value(annotated, name) == value
+    assert found_names.issuperset(extra_names[:2])
+
+
+def test_float_block_reader_matches_field_reader(myBasicEndfParser, mf_sel):
+    fields = [' 1.234567+5', '   -1.2-3  ', '    1.5E2  ', ' '*11,
+              '          7', ' 3.000000-1', ' 2.0       ', ' 1.5 +2    ']
+    lines = [''.join(fields[:6]), ''.join(fields[6:])]
+    for accept_spaces in (True, False):
+        num = 8 if accept_spaces else 7
+        expected = [fortstr2float(f, blank=0., accept_spaces=accept_spaces)
+                    for f in fields[:num]]
+        # the second time, the values come from the cache
+        for i in range(2):
+            vals, ofs = read_fort_float_block(lines, num, blank=0.,
+                                              accept_spaces=accept_spaces)
+            assert vals == expected and ofs == 2
+        assert read_fort_floats(lines[0], blank=0.,
+                                accept_spaces=accept_spaces) == expected[:6]
+        vals, ofs = read_endf_numbers(lines, 6, 0, to_int=True,
+                                      blank_as_zero=True,
+                                      accept_spaces=accept_spaces)
+        assert vals == [int(v) for v in expected[:6]] and ofs == 1
+    with pytest.raises(ValueError):
+        read_fort_float_block(lines, 4)
+    with pytest.raises(InvalidFloatError):
+        read_fort_float_block(lines, 8, blank=0., accept_spaces=False)
+
+
+def test_float_block_writer_matches_field_writer(myBasicEndfParser, mf_sel):
+    vals = [0., 1., -1., 7, -2, 1e-10, 2.5, -0.000123, 123456789.,
+            1.23456789e17, 10**17-1, 1e17, 1/3]
+    optnames = ('abuse_signpos', 'skip_intzero', 'prefer_noexp', 'keep_E')
+    for optvals in product((False, True), repeat=len(optnames)):
+        write_opts = dict(zip(optnames, optvals))
+        expected = [float2fortstr(v, **write_opts) for v in vals]
+        # the second time, the fields come from the cache
+        for i in range(2):
+            assert write_fort_float_block(vals, **write_opts) == expected
+            assert write_fort_floats(vals, **write_opts) == ''.join(expected)
+    assert write_fort_float_block([1/3], width=13) == \
+        [float2fortstr(1/3, width=13)]
+
+
+def test_records_are_read_and_written_without_ctrl_dicts(myBasicEndfParser, mf_sel):
+    line = ' 1.000000+0 2.000000+0          3          4          5          6'
+    line += format_ctrl(2925, 3, 1)
+    assert read_ctrl_fields(line) == (2925, 3, 1)
+    assert read_ctrl(line) == {'MAT': 2925, 'MF': 3, 'MT': 1}
+    assert write_ctrl(read_ctrl(line), ns=2) == format_ctrl(2925, 3, 1, ns=2)
+    dic, ofs = read_cont([line])
+    assert dic == {'C1': 1., 'C2': 2., 'L1': 3, 'L2': 4, 'N1': 5, 'N2': 6,
+                   'MAT': 2925, 'MF': 3, 'MT': 1}
+    assert write_cont(dic) == [line]
+    other = {}
+    copy_ctrl(other, dic)
+    assert other == read_ctrl(line)
+    # the lengths of the table are written in N1 and N2
+    # without modifying the record dictionary
+    tab1 = {'C1': 0., 'C2': 0., 'L1': 0, 'L2': 0, 'N1': 0, 'N2': 0,
+            'MAT': 2925, 'MF': 3, 'MT': 1,
+            'table': {'NBT': [3], 'INT': [2],
+                      'X': [1., 2., 3.], 'Y': [4., 5., 6.]}}
+    orig_tab1 = deepcopy(tab1)
+    tab1_lines = write_tab1(tab1)
+    assert tab1 == orig_tab1
+    dic, ofs = read_tab1(tab1_lines)
+    assert ofs == len(tab1_lines) == 3
+    assert dic == {**tab1, 'N1': 1, 'N2': 3}
+    assert write_send(dic)[0][66:] == format_ctrl(2925, 3, 0) + '99999'
+
+
+def test_iter_sections_accepts_path(endf_file, myBasicEndfParser, mf_sel):
+    endf_dic = myBasicEndfParser.parsefile(endf_file, include=mf_sel)
+    sections = myBasicEndfParser.iter_sections(Path(endf_file), include=mf_sel)
+    iter_dic = {}
+    for mat, mf, mt, section in sections:
+        iter_dic.setdefault(mf, {})[mt] = section
+    compare_objects(endf_dic, iter_dic, atol=0, rtol=0)
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_parse_library_isolates_corrupt_file(tmp_path, myBasicEndfParser, mf_sel, workers):
+    endf_dir = Path(__file__).parent / 'testdata'
+    for endf_file in endf_dir.glob('*.endf'):
+        (tmp_path / endf_file.name).write_text(endf_file.read_text())
+    # the first number of the first selected section cannot be read
+    lines = (endf_dir / 'n_2925_29-Cu-63.endf').read_text().splitlines()
+    for i, line in enumerate(lines):
+        mf = int(line[70:72])
+        if mf > 0 and (mf_sel is None or mf in mf_sel):
+            lines[i] = 'xxxxxxxxxxx' + line[11:]
+            break
+    (tmp_path / 'corrupt.endf').write_text('\n'.join(lines))
+    results = myBasicEndfParser.parse_library(tmp_path, workers=workers,
+                                              include=mf_sel)
+    results = {os.path.basename(r['filename']): r for r in results}
+    assert len(results) == 3
+    assert results['corrupt.endf']['error'] is not None
+    assert results['corrupt.endf']['endf_dic'] is None
+    for endf_file in endf_dir.glob('*.endf'):
+        result = results[endf_file.name]
+        assert result['error'] is None
+        endf_dic = myBasicEndfParser.parsefile(endf_file, include=mf_sel)
+        compare_objects(endf_dic, result['endf_dic'], atol=0, rtol=0)
+
+
+def exit_worker(filename, exclude, include, nofail):
+    os._exit(1)
+
+
+def test_parse_library_reports_failed_worker(tmp_path, monkeypatch, myBasicEndfParser, mf_sel):
+    # a worker process terminating abruptly breaks the pool
+    monkeypatch.setattr(endf_parser, 'parse_library_file_in_worker', exit_worker)
+    endf_dir = Path(__file__).parent / 'testdata'
+    paths = sorted(endf_dir.glob('*.endf'))
+    results = list(myBasicEndfParser.parse_library(paths, workers=2,
+                                                   include=mf_sel))
+    assert sorted(r['filename'] for r in results) == paths
+    for result in results:
+        assert result['error'].startswith('BrokenProcessPool')
+        assert result['endf_dic'] is None
+        assert result['filesize'] == os.path.getsize(result['filename'])
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+@pytest.mark.parametrize('compression', ['gz', 'bz2', 'xz'])
+def test_compressed_files_yield_same_content(endf_file, tmp_path, myBasicEndfParser, mf_sel, compression, lazy):
+    open_funs = {'gz': gzip.open, 'bz2': bz2.open, 'xz': lzma.open}
+    endf_dic = myBasicEndfParser.parsefile(endf_file, include=mf_sel)
+    compfile = tmp_path / (os.path.basename(endf_file) + '.' + compression)
+    with open_funs[compression](compfile, 'wb') as f:
+        f.write(Path(endf_file).read_bytes())
+    comp_dic = myBasicEndfParser.parsefile(compfile, include=mf_sel, lazy=lazy)
+    compare_objects(endf_dic, deepcopy(comp_dic), atol=0, rtol=0)
+    # the compressed output decompresses to the uncompressed output
+    outfile = tmp_path / 'output.endf'
+    myBasicEndfParser.writefile(outfile, endf_dic)
+    compoutfile = tmp_path / ('output.endf.' + compression)
+    myBasicEndfParser.writefile(compoutfile, comp_dic)
+    with open_funs[compression](compoutfile, 'rb') as f:
+        assert f.read() == outfile.read_bytes()
+
+
+def test_plain_file_starting_with_bz2_magic_is_not_decompressed(tmp_path, myBasicEndfParser, mf_sel):
+    endf_file = Path(__file__).parent / 'testdata' / 'n_3025_30-Zn-64.endf'
+    lines = endf_file.read_text().splitlines(keepends=True)
+    lines[0] = 'BZh1 tape' + lines[0][9:]
+    plainfile = tmp_path / 'plain.endf'
+    plainfile.write_text(''.join(lines))
+    assert compression_utils.get_compression(plainfile) is None
+    endf_dic = myBasicEndfParser.parse(lines, include=mf_sel)
+    plain_dic = myBasicEndfParser.parsefile(plainfile, include=mf_sel)
+    compare_objects(endf_dic, plain_dic, atol=0, rtol=0)
+
+
+def test_parallel_parsing_yields_same_content(endf_file, tmp_path, myBasicEndfParser, mf_sel):
+    endf_dic = myBasicEndfParser.parsefile(endf_file, include=mf_sel)
+    parallel_dic = myBasicEndfParser.parsefile(endf_file, include=mf_sel, workers=2)
+    compare_objects(endf_dic, parallel_dic, atol=0, rtol=0)
+    outfile = tmp_path / 'output.endf'
+    myBasicEndfParser.writefile(outfile, endf_dic)
+    parallel_outfile = tmp_path / 'parallel_output.endf'
+    myBasicEndfParser.writefile(parallel_outfile, parallel_dic)
+    assert parallel_outfile.read_bytes() == outfile.read_bytes()
+
+
+def test_section_cache_yields_same_content(endf_file, tmp_path, myBasicEndfParser, mf_sel, monkeypatch):
+    cache_dir = str(tmp_path / 'section_cache')
+    monkeypatch.setattr(section_cache_utils, 'get_section_cache_dir', lambda: cache_dir)
+    monkeypatch.setitem(section_cache_utils.section_cache_state, 'size', None)
+    endf_dic = myBasicEndfParser.parsefile(endf_file, include=mf_sel)
+    cache_opts = {**myBasicEndfParser.get_parser_opts(), 'section_cache': True}
+    cache_parser = BasicEndfParser(**cache_opts)
+    # the sections are stored in the cache by the first call
+    # and loaded from the cache by the second one
+    for i in range(2):
+        cached_dic = cache_parser.parsefile(endf_file, include=mf_sel)
+        compare_objects(endf_dic, cached_dic, atol=0, rtol=0)
+        assert len(section_cache_utils.list_section_cache_entries()) > 0
+    assert cache_parser.write(cached_dic) == myBasicEndfParser.write(endf_dic)
+    section_cache_utils.clear_section_cache()
+    assert len(section_cache_utils.list_section_cache_entries()) == 0
+    cached_dic = cache_parser.parsefile(endf_file, include=mf_sel)
+    compare_objects(endf_dic, cached_dic, atol=0, rtol=0)
+
+
+def test_section_cache_keeps_track_of_size(tmp_path, myBasicEndfParser, mf_sel, monkeypatch):
+    cache_dir = str(tmp_path / 'section_cache')
+    monkeypatch.setattr(section_cache_utils, 'get_section_cache_dir', lambda: cache_dir)
+    monkeypatch.setitem(section_cache_utils.section_cache_state, 'size', None)
+    parse_opts = myBasicEndfParser.get_parser_opts()
+    lines = ['line 1', 'line 2']
+    key = section_cache_utils.get_section_cache_key(3, 1, lines, parse_opts, {})
+    # a new format version invalidates the entries
+    monkeypatch.setattr(section_cache_utils, 'section_cache_format_version', -1)
+    assert section_cache_utils.get_section_cache_key(3, 1, lines, parse_opts, {}) != key
+    # overwriting an entry does not increase the size
+    section_cache_utils.store_cached_section('other', {'AWR': 1.})
+    for i in range(3):
+        section_cache_utils.store_cached_section(key, {'AWR': 1.})
+        size = section_cache_utils.section_cache_state['size']
+        assert size == section_cache_utils.get_section_cache_size()
+    assert section_cache_utils.load_cached_section(key) == {'AWR': 1.}
+
+
+def test_incremental_parsing_yields_same_content(endf_file, tmp_path, myBasicEndfParser, mf_sel):
+    endf_dic = myBasicEndfParser.parsefile(endf_file, include=mf_sel)
+    inc_dic, hashes = myBasicEndfParser.parsefile_incremental(endf_file, include=mf_sel)
+    compare_objects(endf_dic, inc_dic, atol=0, rtol=0)
+    # the sections of the original and the modified file
+    # are written with the same formatting
+    origfile = tmp_path / 'original.endf'
+    myBasicEndfParser.writefile(origfile, endf_dic)
+    inc_dic, hashes = myBasicEndfParser.parsefile_incremental(origfile, include=mf_sel)
+    # modify the first parsed section with a HEAD record
+    mf, mt = next((mf, mt) for mf in endf_dic for mt in endf_dic[mf]
+                  if isinstance(endf_dic[mf][mt], dict) and 'AWR' in endf_dic[mf][mt])
+    mod_dic = deepcopy(endf_dic)
+    mod_dic[mf][mt]['AWR'] *= 2
+    modfile = tmp_path / 'modified.endf'
+    myBasicEndfParser.writefile(modfile, mod_dic)
+    mod_dic = myBasicEndfParser.parsefile(modfile, include=mf_sel)
+    inc_dic2, hashes2 = myBasicEndfParser.parsefile_incremental(
+            modfile, previous=(inc_dic, hashes), include=mf_sel)
+    compare_objects(mod_dic, inc_dic2, atol=0, rtol=0)
+    assert myBasicEndfParser.write(inc_dic2) == myBasicEndfParser.write(mod_dic)
+    assert hashes2[(mf, mt)] != hashes[(mf, mt)]
+    # the unchanged sections are taken from the previous result
+    for curmf in inc_dic2:
+        for curmt in inc_dic2[curmf]:
+            if (curmf, curmt) != (mf, mt) and isinstance(inc_dic[curmf][curmt], dict):
+                assert inc_dic2[curmf][curmt] is inc_dic[curmf][curmt]
+    # the same for lists of lines
+    lines = myBasicEndfParser.write(mod_dic)
+    inc_dic3, hashes3 = myBasicEndfParser.parse_incremental(
+            lines, previous=(inc_dic2, hashes2), include=mf_sel)
+    # the unparsed sections are lines without the line endings
+    compare_objects(mod_dic, inc_dic3, atol=0, rtol=0, do_rstrip=True)
+    # the lines in the file and in memory have the same hashes
+    assert hashes3 == hashes2
+    for curmf in inc_dic3:
+        for curmt in inc_dic3[curmf]:
+            if isinstance(inc_dic2[curmf][curmt], dict):
+                assert inc_dic3[curmf][curmt] is inc_dic2[curmf][curmt]
+
+
+def test_numpy_arrays_yield_same_content(endf_file, myBasicEndfParser, mf_sel):
+    pytest.importorskip('numpy')
+    endf_dic = myBasicEndfParser.parsefile(endf_file, include=mf_sel)
+    numpy_opts = {**myBasicEndfParser.get_parser_opts(), 'array_backend': 'numpy'}
+    numpy_parser = BasicEndfParser(**numpy_opts)
+    numpy_dic = numpy_parser.parsefile(endf_file, include=mf_sel)
+    # the arrays are converted back to lists
+    jsonstr = json.dumps(numpy_dic, default=endf_json_default)
+    numpy_dic2 = json.loads(jsonstr)
+    sanitize_fieldname_types(numpy_dic2)
+    compare_objects(endf_dic, numpy_dic2, atol=0, rtol=0)
+    assert numpy_parser.write(numpy_dic) == myBasicEndfParser.write(endf_dic)
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_section_index_cache_yields_same_content(endf_file, tmp_path, myBasicEndfParser, mf_sel, monkeypatch, lazy):
+    monkeypatch.setattr(section_index_utils, 'user_cache_dir', lambda *args: str(tmp_path))
+    endf_dic = myBasicEndfParser.parsefile(endf_file, include=mf_sel)
+    # the index is stored by the first call and loaded by the second one
+    for i in range(2):
+        index_dic = myBasicEndfParser.parsefile(endf_file, include=mf_sel,
+                                               lazy=lazy, use_index_cache=True)
+        compare_objects(endf_dic, deepcopy(index_dic), atol=0, rtol=0)
+        assert os.path.exists(section_index_utils.get_section_index_filepath(endf_file))
+    assert myBasicEndfParser.write(index_dic) == myBasicEndfParser.write(endf_dic)
+    index, heads = section_index_utils.read_section_index(endf_file)
+    assert set((mf, mt) for mat, mf, mt in index) == \
+        set((mf, mt) for mf in endf_dic for mt in endf_dic[mf])
+
+
+def test_section_index_cache_detects_moved_sections(endf_file, tmp_path, myBasicEndfParser, mf_sel, monkeypatch):
+    monkeypatch.setattr(section_index_utils, 'user_cache_dir', lambda *args: str(tmp_path))
+    lines = Path(endf_file).read_text().splitlines(keepends=True)
+    endf_file = tmp_path / 'moved.endf'
+    endf_file.write_text(''.join(lines))
+    myBasicEndfParser.parsefile(endf_file, include=(), use_index_cache=True)
+    # a line is moved from the beginning to the end of the file so that
+    # the sections in between start one line earlier. The size, the
+    # modification time and the first and last lines of the file,
+    # which are part of the signature, remain unchanged.
+    stat = os.stat(endf_file)
+    lines.insert(len(lines)-1000, lines.pop(1000))
+    endf_file.write_text(''.join(lines))
+    os.utime(endf_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    endf_dic = myBasicEndfParser.parsefile(endf_file, include=())
+    index_dic = myBasicEndfParser.parsefile(endf_file, include=(),
+                                            use_index_cache=True)
+    compare_objects(endf_dic, index_dic, atol=0, rtol=0)
+
+
+def test_unselected_sections_are_decoded_on_access(endf_file, myBasicEndfParser, mf_sel):
+    endf_dic = myBasicEndfParser.parsefile(endf_file, include=(3,))
+    for mf in endf_dic:
+        if mf != 3:
+            assert not any(endf_dic[mf].is_loaded(mt) for mt in endf_dic[mf])
+    lines = Path(endf_file).read_text().splitlines(keepends=True)
+    line_dic = myBasicEndfParser.parse(lines, include=(3,))
+    compare_objects(line_dic, endf_dic, atol=0, rtol=0)
+    assert myBasicEndfParser.write(endf_dic) == myBasicEndfParser.write(line_dic)
+
+
+def test_section_index_selects_same_lines_as_split_sections(tmp_path, myBasicEndfParser, mf_sel):
+    endf_file = Path(__file__).parent / 'testdata' / 'n_2925_29-Cu-63.endf'
+    lines = endf_file.read_text().splitlines(keepends=True)
+    # a line blank apart from a control character and lines with
+    # invalid control fields at the beginning and inside a section
+    lines[0:0] = ['\x1c\n', 'first line with invalid control fields\n']
+    lines.insert(5, 'x'*66 + 'xxxxx1451  \n')
+    endf_file = tmp_path / 'invalid.endf'
+    endf_file.write_text(''.join(lines))
+    endf_dic = myBasicEndfParser.parsefile(endf_file, include=mf_sel)
+    line_dic = myBasicEndfParser.parse(lines, include=mf_sel)
+    compare_objects(line_dic, endf_dic, atol=0, rtol=0)
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_iter_materials_yields_same_content(tmp_path, myBasicEndfParser, mf_sel, lazy):
+    # a tape with a tape head record and the materials of all test files
+    endf_files = sorted((Path(__file__).parent / 'testdata').glob('*.endf'))
+    tapelines = ['tape with the test materials'.ljust(66) + '   1 0  0    0']
+    for endf_file in endf_files:
+        # without the tape head and tape end records of each file
+        lines = endf_file.read_text().splitlines()[:-1]
+        if lines[0][70:75] == ' 0  0':
+            del lines[0]
+        tapelines.extend(lines)
+    tapelines.append(' 0.000000+0 0.000000+0          0          0          0          0  -1 0  0    0')
+    tapefile = tmp_path / 'tape.endf'
+    tapefile.write_text('\n'.join(tapelines))
+    materials = list(myBasicEndfParser.iter_materials(tapefile, include=mf_sel, lazy=lazy))
+    assert len(materials) == len(endf_files)
+    for endf_file, mat_dic in zip(endf_files, materials):
+        endf_dic = myBasicEndfParser.parsefile(endf_file, include=mf_sel)
+        mat_dic = deepcopy(mat_dic)
+        # the tape head record of the tape is included in each material
+        assert 0 in mat_dic
+        del mat_dic[0]
+        endf_dic.pop(0, None)
+        compare_objects(endf_dic, mat_dic, atol=0, rtol=0)
+        assert myBasicEndfParser.write(mat_dic) == myBasicEndfParser.write(endf_dic)
+
+
+def test_tracing_does_not_change_content(endf_file, myBasicEndfParser, mf_sel):
+    endf_dic = myBasicEndfParser.parsefile(endf_file, include=mf_sel)
+    events = []
+    fout = io.StringIO()
+    enable_tracing(events.append)
+    enable_tracing(create_jsonl_trace_handler(fout))
+    try:
+        traced_dic = myBasicEndfParser.parsefile(endf_file, include=mf_sel)
+    finally:
+        disable_tracing()
+    assert len(logging_utils.trace_handlers) == 0
+    compare_objects(endf_dic, traced_dic, atol=0, rtol=0)
+    assert myBasicEndfParser.write(traced_dic) == myBasicEndfParser.write(endf_dic)
+    parsed = set((ev['mf'], ev['mt']) for ev in events
+                 if ev['event'] == 'parse_subsection')
+    assert parsed == set((mf, mt) for mf in endf_dic for mt in endf_dic[mf]
+                         if isinstance(endf_dic[mf][mt], dict))
+    jsonl_events = [json.loads(line) for line in fout.getvalue().splitlines()]
+    assert [ev['event'] for ev in jsonl_events] == [ev['event'] for ev in events]